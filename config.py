@@ -7,6 +7,18 @@ API_ID: int = int(os.getenv("API_ID", "12345678"))
 API_HASH: str = os.getenv("API_HASH", "your_api_hash_here")
 BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")  # Optional: for assistant bot
 SESSION_STRING: str = os.getenv("SESSION_STRING", "your_session_string_here")
+# Extra assistant accounts (space separated), each carrying its own voice chats
+SESSION_STRINGS: List[str] = list(dict.fromkeys([SESSION_STRING] + os.getenv("SESSION_STRINGS", "").split()))
+ASSISTANT_MAX_CALLS: int = int(os.getenv("ASSISTANT_MAX_CALLS", "0"))  # per assistant, 0 = unlimited
+ASSISTANT_STICKY_SLACK: int = int(os.getenv("ASSISTANT_STICKY_SLACK", "2"))  # extra calls tolerated to keep a chat's previous assistant
+ASSISTANT_HEALTH_INTERVAL: int = int(os.getenv("ASSISTANT_HEALTH_INTERVAL", "30"))  # seconds
+
+# Sharding Configuration (one coordinator process + worker processes)
+SHARD_WORKERS: int = int(os.getenv("SHARD_WORKERS", "0"))  # playback worker processes, 0 = single process
+SHARD_INDEX: int = int(os.getenv("SHARD_INDEX", "-1"))  # set by the coordinator for its workers
+SHARD_SOCKET_DIR: str = os.getenv("SHARD_SOCKET_DIR", os.path.join("cache", "shards"))
+SHARD_HEALTH_INTERVAL: int = int(os.getenv("SHARD_HEALTH_INTERVAL", "10"))  # seconds between worker pings
+SHARD_COMMAND_TIMEOUT: int = int(os.getenv("SHARD_COMMAND_TIMEOUT", "10"))  # seconds to hand a command to a worker
 
 # Admin Configuration
 ADMINS: List[int] = [int(x) for x in os.getenv("ADMINS", "").split() if x.isdigit()]
@@ -27,20 +39,73 @@ BITRATE: int = int(os.getenv("BITRATE", "512"))
 AUTO_LEAVE: bool = os.getenv("AUTO_LEAVE", "True").lower() in ["true", "1", "yes"]
 AUTO_LEAVE_DURATION: int = int(os.getenv("AUTO_LEAVE_DURATION", "300"))  # 5 minutes
 MAX_QUEUE_SIZE: int = int(os.getenv("MAX_QUEUE_SIZE", "50"))
+QUEUE_PAGE_SIZE: int = int(os.getenv("QUEUE_PAGE_SIZE", "10"))  # songs per /queue page
 MAX_DURATION_LIMIT: int = int(os.getenv("MAX_DURATION_LIMIT", "3600"))  # 1 hour in seconds
 PLAYLIST_LIMIT: int = int(os.getenv("PLAYLIST_LIMIT", "25"))
+PLAYLIST_MAX_TRACKS: int = int(os.getenv("PLAYLIST_MAX_TRACKS", "500"))  # /playlist streams up to this many
+PLAYLIST_PAGE_SIZE: int = int(os.getenv("PLAYLIST_PAGE_SIZE", "50"))
+PLAYLIST_FILL_INTERVAL: int = int(os.getenv("PLAYLIST_FILL_INTERVAL", "5"))  # seconds between checks for queue space
 
 # Download Configuration
 DOWNLOAD_DIR: str = os.getenv("DOWNLOAD_DIR", "downloads")
 CLEANUP_DOWNLOADS: bool = os.getenv("CLEANUP_DOWNLOADS", "True").lower() in ["true", "1", "yes"]
 CLEANUP_INTERVAL: int = int(os.getenv("CLEANUP_INTERVAL", "300"))  # 5 minutes
 
+DOWNLOAD_WORKERS: int = int(os.getenv("DOWNLOAD_WORKERS", "4"))  # concurrent yt-dlp jobs
+YDL_POOL_SIZE: int = int(os.getenv("YDL_POOL_SIZE", str(DOWNLOAD_WORKERS)))  # idle YoutubeDL objects per profile
+PROGRESS_UPDATE_INTERVAL: float = float(os.getenv("PROGRESS_UPDATE_INTERVAL", "3"))  # seconds between progress edits
+
+# Media Cache Configuration
+MEDIA_CACHE_DIR: str = os.getenv("MEDIA_CACHE_DIR", os.path.join("cache", "media"))
+MEDIA_CACHE_MAX_SIZE: int = int(os.getenv("MEDIA_CACHE_MAX_SIZE", "2048"))  # MB
+PREENCODE_AUDIO: bool = os.getenv("PREENCODE_AUDIO", "False").lower() in ["true", "1", "yes"]
+PREENCODE_KEEP_SOURCE: bool = os.getenv("PREENCODE_KEEP_SOURCE", "False").lower() in ["true", "1", "yes"]
+TRANSCODE_WORKERS: int = int(os.getenv("TRANSCODE_WORKERS", "2"))  # concurrent ffmpeg encodes
+LOUDNESS_NORMALIZATION: bool = os.getenv("LOUDNESS_NORMALIZATION", "False").lower() in ["true", "1", "yes"]
+LOUDNESS_TARGET: float = float(os.getenv("LOUDNESS_TARGET", "-14"))  # LUFS
+LOUDNESS_WORKERS: int = int(os.getenv("LOUDNESS_WORKERS", "2"))  # concurrent analysis passes
+STREAM_WHILE_DOWNLOAD: bool = os.getenv("STREAM_WHILE_DOWNLOAD", "False").lower() in ["true", "1", "yes"]
+
+# Search Cache Configuration
+SEARCH_CACHE_SIZE: int = int(os.getenv("SEARCH_CACHE_SIZE", "2000"))  # entries
+SEARCH_CACHE_TTL: int = int(os.getenv("SEARCH_CACHE_TTL", "21600"))  # 6 hours
+SEARCH_CACHE_NEGATIVE_TTL: int = int(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", "300"))  # empty results
+SEARCH_CACHE_PERSIST: bool = os.getenv("SEARCH_CACHE_PERSIST", "False").lower() in ["true", "1", "yes"]
+SEARCH_CACHE_PATH: str = os.getenv("SEARCH_CACHE_PATH", os.path.join("cache", "search_cache.json"))
+
+# Prefetch Configuration
+PREFETCH_ENABLED: bool = os.getenv("PREFETCH_ENABLED", "True").lower() in ["true", "1", "yes"]
+PREFETCH_DEPTH: int = int(os.getenv("PREFETCH_DEPTH", "2"))  # upcoming tracks per chat
+PREFETCH_MAX_DEPTH: int = int(os.getenv("PREFETCH_MAX_DEPTH", "5"))  # cap for per-chat depth
+PREFETCH_MAX_CONCURRENT: int = int(os.getenv("PREFETCH_MAX_CONCURRENT", "4"))  # across all chats
+
+# Queue Lifecycle & Persistence Configuration
+QUEUE_IDLE_TIMEOUT: int = int(os.getenv("QUEUE_IDLE_TIMEOUT", "3600"))  # seconds before an idle chat is forgotten
+QUEUE_EVICT_INTERVAL: int = int(os.getenv("QUEUE_EVICT_INTERVAL", "300"))  # seconds between idle-chat sweeps
+QUEUE_PERSIST: bool = os.getenv("QUEUE_PERSIST", "True").lower() in ["true", "1", "yes"]
+QUEUE_JOURNAL_DIR: str = os.getenv("QUEUE_JOURNAL_DIR", os.path.join("cache", "queues"))
+QUEUE_JOURNAL_COMPACT_EVERY: int = int(os.getenv("QUEUE_JOURNAL_COMPACT_EVERY", "1000"))  # journal entries per snapshot
+QUEUE_SNAPSHOT_INTERVAL: int = int(os.getenv("QUEUE_SNAPSHOT_INTERVAL", "60"))  # seconds
+QUEUE_JOURNAL_MONGO: bool = os.getenv("QUEUE_JOURNAL_MONGO", "False").lower() in ["true", "1", "yes"]
+
 # Language Configuration
 DEFAULT_LANGUAGE: str = os.getenv("DEFAULT_LANGUAGE", "en")
 
-# Database Configuration (MongoDB)
+# Database Configuration (MongoDB or embedded SQLite)
+DB_BACKEND: str = os.getenv("DB_BACKEND", "auto")  # auto (MongoDB if MONGO_DB_URI is set, else SQLite), mongo, sqlite, none
 MONGO_DB_URI: str = os.getenv("MONGO_DB_URI", "")
 DB_NAME: str = os.getenv("DB_NAME", "musicbot")
+SQLITE_DB_PATH: str = os.getenv("SQLITE_DB_PATH", os.path.join("cache", "musicbot.db"))
+DB_CACHE_SIZE: int = int(os.getenv("DB_CACHE_SIZE", "10000"))  # cached chat documents
+DB_CACHE_TTL: int = int(os.getenv("DB_CACHE_TTL", "300"))  # seconds
+BAN_SYNC_INTERVAL: int = int(os.getenv("BAN_SYNC_INTERVAL", "30"))  # seconds between polls for bans made by other processes, 0 = off
+DB_WRITE_INTERVAL: int = int(os.getenv("DB_WRITE_INTERVAL", "10"))  # seconds between buffered activity flushes
+DB_WRITE_BATCH_SIZE: int = int(os.getenv("DB_WRITE_BATCH_SIZE", "1000"))  # pending users/chats that force a flush
+DB_STATS_RECONCILE_INTERVAL: int = int(os.getenv("DB_STATS_RECONCILE_INTERVAL", "3600"))  # seconds between global stats recounts
+DB_RETENTION_DAYS: int = int(os.getenv("DB_RETENTION_DAYS", "30"))  # daily stats and inactive users older than this are removed
+DB_RETENTION_BATCH_SIZE: int = int(os.getenv("DB_RETENTION_BATCH_SIZE", "500"))  # rows deleted per batch
+DB_RETENTION_PAUSE: float = float(os.getenv("DB_RETENTION_PAUSE", "0.5"))  # seconds between batches
+DB_RETENTION_INTERVAL: int = int(os.getenv("DB_RETENTION_INTERVAL", "0"))  # seconds between automatic retention runs, 0 = only on /maintenance
 
 # Spotify Configuration (Optional)
 SPOTIFY_CLIENT_ID: str = os.getenv("SPOTIFY_CLIENT_ID", "")
@@ -65,7 +130,7 @@ CACHE_DIR = "cache"
 LOGS_DIR = "logs"
 
 # Create necessary directories
-for directory in [DOWNLOAD_DIR, CACHE_DIR, LOGS_DIR]:
+for directory in [DOWNLOAD_DIR, CACHE_DIR, LOGS_DIR, MEDIA_CACHE_DIR, QUEUE_JOURNAL_DIR]:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
@@ -135,9 +200,11 @@ HELP_TEXT = f"""
 • `/resume` - Resume paused stream
 • `/skip` or `/next` - Skip current track
 • `/stop` or `/end` - Stop playing and clear queue
+• `/seek` [mm:ss] - Jump to a position in the current track
 • `/queue` or `/q` - Show current queue
 • `/shuffle` - Shuffle queue
 • `/loop` - Toggle loop mode
+• `/prefetch` [depth] - Upcoming songs downloaded in advance
 • `/volume` [1-100] - Adjust volume
 • `/playlist` [url] - Play entire playlist
 • `/radio` [station/url] - Play radio stream
@@ -151,6 +218,7 @@ HELP_TEXT = f"""
 • `/reload` - Reload bot configurations
 • `/logs` - Get bot logs
 • `/speedtest` - Test server speed
+• `/memory` - Queue memory report
 
 **🎵 Special Features:**
 • Auto-queue management
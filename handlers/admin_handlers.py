@@ -8,6 +8,7 @@ import platform
 from pyrogram import Client
 from pyrogram.types import Message
 import config
+from utils.helpers import humanbytes
 
 async def reload_handler(client: Client, message: Message, bot):
     if message.from_user.id not in config.ADMINS:
@@ -50,4 +51,34 @@ async def speedtest_handler(client: Client, message: Message, bot):
         )
     except Exception as e:
         await message.reply_text(f"❌ Speedtest failed: `{e}`")
-        
\ No newline at end of file
+        
+async def memory_handler(client: Client, message: Message, bot):
+    if message.from_user.id not in config.ADMINS:
+        return await message.reply_text("❌ You don't have permission to use this.")
+    try:
+        # Optional argument evicts idle chats right away
+        if len(message.command) > 1 and message.command[1] == "evict":
+            evicted = bot.queue_manager.evict_idle()
+        else:
+            evicted = None
+        report = bot.queue_manager.get_memory_report()
+        process = psutil.Process(os.getpid())
+        lines = [
+            "🧠 Queue Memory\n",
+            f"💬 Tracked chats: `{report['chats']}` (playing: `{len(bot.players.active_chats())}`)",
+            f"🎵 Queued tracks: `{report['tracks']}`",
+            f"📦 Queue memory: `{humanbytes(report['total_bytes'])}`",
+            f"🧹 Evicted idle chats: `{report['evicted']}`",
+            f"🖥 Process RSS: `{humanbytes(process.memory_info().rss)}`",
+        ]
+        if evicted is not None:
+            lines.append(f"✅ Evicted now: `{evicted}`")
+        if report['top']:
+            lines.append("\nLargest chats:")
+            lines.extend(
+                f"`{chat['chat_id']}`: {chat['tracks']} tracks, {humanbytes(chat['bytes'])}"
+                for chat in report['top']
+            )
+        await message.reply_text("\n".join(lines))
+    except Exception as e:
+        await message.reply_text(f"❌ Memory report failed: `{e}`")
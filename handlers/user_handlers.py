@@ -9,6 +9,7 @@ import pytgcalls
 from pyrogram import Client
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 import config
+from utils.context import RequestContext
 from utils.helpers import get_readable_time, humanbytes
 
 # User command handlers
@@ -108,6 +109,8 @@ async def ping_handler(client: Client, message: Message, bot):
         memory = type('obj', (object,), {'percent': 0, 'used': 0, 'total': 0})
         disk = type('obj', (object,), {'percent': 0, 'used': 0, 'total': 0})
     
+    player_stats = bot.players.get_stats()
+    
     # Bot uptime (simplified)
     bot_uptime = get_readable_time(time.time() - getattr(bot, 'start_time', time.time()))
     
@@ -120,12 +123,45 @@ async def ping_handler(client: Client, message: Message, bot):
                 f"**Memory:** `{memory.percent}%` ({humanbytes(memory.used)}/{humanbytes(memory.total)})\n" \
                 f"**Disk:** `{disk.percent}%` ({humanbytes(disk.used)}/{humanbytes(disk.total)})\n\n" \
                 f"**🎵 Music Status:**\n" \
-                f"**Playing:** `{'Yes' if bot.is_playing else 'No'}`\n" \
-                f"**Paused:** `{'Yes' if bot.is_paused else 'No'}`\n" \
-                f"**Active Chats:** `{len(bot.queue_manager.queues)}`"
+                f"**Playing:** `{player_stats['playing']}` chats\n" \
+                f"**Paused:** `{player_stats['paused']}` chats\n" \
+                f"**Active Chats:** `{len(bot.players.active_chats())}`\n" \
+                f"**Command Pre-check:** `{RequestContext.get_stats()['average_ms']:.1f}ms` avg"
     
     await ping_msg.edit_text(ping_text)
 
+def _shard_line(bot) -> str:
+    """Worker health line for /stats when running sharded"""
+    if not bot.shards:
+        return ""
+    workers = bot.shards.get_stats()['workers']
+    healthy = sum(1 for w in workers if w['healthy'])
+    chats = sum(w['chats'] for w in workers)
+    return f"**Workers:** `{healthy}/{len(workers)}` healthy, `{chats}` active chats\n"
+
+def _background_lines(bot) -> str:
+    """Prefetch, yt-dlp pool, audio processing, journal and DB write lines for /stats"""
+    prefetch = bot.prefetcher.get_stats()
+    pool = bot.downloader.pool.get_stats()
+    writes = bot.db.get_write_stats()
+    lines = [
+        f"**Prefetch:** `{prefetch['active_jobs']}` running, `{prefetch['completed']}` done, `{prefetch['cancelled']}` cancelled",
+        f"**yt-dlp Pool:** `{pool['idle']}` idle, `{pool['created']}` created, `{pool['reused']}` reused",
+    ]
+    for name, stats, done in (
+        ("Pre-encode", bot.downloader.transcoder.get_stats(), 'completed'),
+        ("Loudness", bot.downloader.loudness.get_stats(), 'completed'),
+    ):
+        lines.append(f"**{name}:** `{stats['pending']}` pending, `{stats[done]}` done, `{stats['failed']}` failed")
+    if bot.journal:
+        journal = bot.journal.get_stats()
+        lines.append(f"**Queue Journal:** seq `{journal['seq']}`, `{journal['pending']}` since snapshot, `{journal['compactions']}` snapshots")
+    lines.append(
+        f"**DB Writes:** `{writes['buffered']}` buffered → `{writes['written']}` written "
+        f"in `{writes['flushes']}` flushes, `{writes['pending']}` pending"
+    )
+    return "\n".join(lines) + "\n"
+
 async def stats_handler(client: Client, message: Message, bot):
     """Handle /stats command"""
     # Get global stats from database
@@ -134,6 +170,12 @@ async def stats_handler(client: Client, message: Message, bot):
     # Get queue manager stats
     queue_stats = bot.queue_manager.get_queue_stats()
     
+    # Get media cache stats
+    cache_stats = bot.downloader.cache.get_stats()
+    download_stats = bot.downloader.scheduler.get_stats()
+    search_stats = bot.downloader.search_cache.get_stats()
+    db_cache_stats = bot.db.get_cache_stats()
+    
     # Get system stats
     try:
         memory = psutil.virtual_memory()
@@ -150,8 +192,22 @@ async def stats_handler(client: Client, message: Message, bot):
                  f"**🎵 Music Stats:**\n" \
                  f"**Songs Played:** `{global_stats.get('total_songs_played', 0)}`\n" \
                  f"**Songs in Queue:** `{queue_stats['total_songs']}`\n" \
+                 f"**Queued Duration:** `{get_readable_time(queue_stats['total_duration'])}`\n" \
                  f"**Active Loops:** `{queue_stats['active_loops']}`\n" \
-                 f"**Currently Playing:** `{'Yes' if bot.is_playing else 'No'}`\n\n" \
+                 f"**Currently Playing:** `{bot.players.get_stats()['playing']}` chats\n" \
+                 f"**Assistant Calls:** `{', '.join(str(a['calls']) if a['available'] else 'down' for a in bot.assistants.get_stats())}`\n" \
+                 f"{_shard_line(bot)}\n" \
+                 f"**📦 Media Cache:**\n" \
+                 f"**Cached Tracks:** `{cache_stats['entries']}` ({humanbytes(cache_stats['total_size'])})\n" \
+                 f"**Hit Rate:** `{cache_stats['hit_rate'] * 100:.1f}%` ({cache_stats['hits']} hits / {cache_stats['misses']} misses)\n" \
+                 f"**Downloads:** `{download_stats['running']}/{download_stats['workers']}` running, " \
+                 f"`{download_stats['queued_play'] + download_stats['queued_prefetch']}` waiting " \
+                 f"(avg wait `{download_stats['average_wait']:.2f}s`)\n" \
+                 f"**Search Cache:** `{search_stats['size']}` queries, `{search_stats['hit_rate'] * 100:.1f}%` hit rate\n" \
+                 f"**DB Cache:** chats `{db_cache_stats['chats']['hit_rate'] * 100:.1f}%` hit rate, " \
+                 f"`{db_cache_stats['bans']['banned']}` bans in memory ({humanbytes(db_cache_stats['bans']['bytes'])})\n\n" \
+                 f"**⚙️ Background Work:**\n" \
+                 f"{_background_lines(bot)}\n" \
                  f"**💾 System Resources:**\n" \
                  f"**Memory Usage:** `{memory.percent}%`\n" \
                  f"**Disk Usage:** `{disk.percent}%`\n" \
@@ -446,6 +502,15 @@ async def unban_user_handler(client: Client, message: Message, bot):
     except Exception as e:
         await message.reply_text(f"❌ **Error:** `{str(e)}`")
 
+def _retention_line(retention) -> str:
+    """Progress of the database retention job for /maintenance"""
+    removed = retention['stats'] + retention['users']
+    if retention['running']:
+        return f"Database cleanup running: `{removed}` rows removed so far ({retention['rate']:.0f}/s)"
+    if retention['runs']:
+        return f"Database cleanup: `{removed}` rows removed in the last run ({retention['rate']:.0f}/s)"
+    return "Database cleanup unavailable"
+
 async def maintenance_handler(client: Client, message: Message, bot):
     """Handle /maintenance command (Owner only)"""
     if message.from_user.id != config.OWNER_ID:
@@ -458,10 +523,14 @@ async def maintenance_handler(client: Client, message: Message, bot):
         await bot.downloader.cleanup_downloads()
         await maintenance_msg.edit_text("🔧 **Cleaning up downloads...**")
         
-        # Cleanup database
-        await bot.db.cleanup_old_data()
+        # Cleanup database in the background, in small batches
+        retention = await bot.db.cleanup_old_data()
         await maintenance_msg.edit_text("🔧 **Cleaning up database...**")
         
+        # Measure loudness of cached tracks that predate the analyzer
+        if config.LOUDNESS_NORMALIZATION:
+            bot.downloader.loudness.start_backfill()
+        
         # Clear inactive queues
         # Add more maintenance tasks as needed
         
@@ -469,7 +538,7 @@ async def maintenance_handler(client: Client, message: Message, bot):
             "✅ **Maintenance completed successfully!**\n\n"
             "**Tasks completed:**\n"
             "• Cleaned up old downloads\n"
-            "• Cleaned up database records\n"
+            f"• {_retention_line(retention)}\n"
             "• Optimized performance"
         )
     
@@ -3,7 +3,9 @@
 
 import asyncio
 import logging
+import os
 import time
+from typing import Dict, List, Set
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from pytgcalls import PyTgCalls, StreamType
@@ -14,6 +16,11 @@ from handlers import music_handlers, user_handlers, admin_handlers
 from utils.database import Database
 from utils.queue_manager import QueueManager
 from utils.downloader import YouTubeDownloader
+from utils.prefetcher import Prefetcher
+from utils.player import PlayerRegistry, IDLE
+from utils.assistants import Assistant, AssistantPool
+from utils.queue_journal import QueueJournal
+from utils.sharding import ShardCoordinator, ShardServer, socket_path
 
 # Configure logging
 logging.basicConfig(
@@ -31,19 +38,44 @@ class MusicBot:
         # Store start time for uptime calculation
         self.start_time = time.time()
         
-        # Initialize Pyrogram client
-        self.app = Client(
-            "musicbot",
-            api_id=config.API_ID,
-            api_hash=config.API_HASH,
-            session_string=config.SESSION_STRING
-        )
+        # With shard workers, this process only receives commands and the
+        # extra sessions are split between the worker processes
+        sessions = config.SESSION_STRINGS
+        if config.SHARD_WORKERS:
+            self.shards = ShardCoordinator(config.SHARD_WORKERS, sessions[1:], os.path.abspath(__file__))
+            sessions = sessions[:1]
+        else:
+            self.shards = None
+        
+        # Running as a shard worker: serve commands routed by the coordinator
+        if config.SHARD_INDEX >= 0:
+            self.shard_server = ShardServer(socket_path(config.SHARD_INDEX), {
+                'ping': self._shard_ping,
+                'command': self._shard_command,
+            })
+        else:
+            self.shard_server = None
+        self.shard_tasks: Set[asyncio.Task] = set()
+        
+        # Initialize assistant accounts, each with its own PyTgCalls
+        assistants = []
+        for index, session_string in enumerate(sessions):
+            app = Client(
+                "musicbot" if index == 0 else f"musicbot_{index}",
+                api_id=config.API_ID,
+                api_hash=config.API_HASH,
+                session_string=session_string
+            )
+            call_py = PyTgCalls(
+                app,
+                overload_quiet_mode=True
+            )
+            assistants.append(Assistant(index, app, call_py))
+        self.assistants = AssistantPool(assistants)
         
-        # Initialize PyTgCalls
-        self.call_py = PyTgCalls(
-            self.app,
-            overload_quiet_mode=True
-        )
+        # The first assistant also receives commands
+        self.app = self.assistants.primary.app
+        self.call_py = self.assistants.primary.call_py
         
         # Initialize bot client if bot token is provided
         if config.BOT_TOKEN:
@@ -60,66 +92,144 @@ class MusicBot:
         self.db = Database()
         self.queue_manager = QueueManager()
         self.downloader = YouTubeDownloader()
+        self.prefetcher = Prefetcher(self.queue_manager, self.downloader)
+        
+        # Background tasks filling queues from large playlists
+        self.playlist_loaders: Dict[int, asyncio.Task] = {}
+        self.queue_manager.add_listener(self._on_queue_event)
+        
+        # Playback state of every voice chat
+        self.players = PlayerRegistry()
+        self.players.add_listener(self._on_player_state)
+        self.downloader.transcoder.add_listener(self._on_transcoded)
         
-        # Current playing status
-        self.current_chat = None
-        self.is_playing = False
-        self.is_paused = False
+        # Journal of queue changes, replayed on startup
+        persist = config.QUEUE_PERSIST and not self.shards
+        self.journal = QueueJournal(self.queue_manager, self.db) if persist else None
+        self.eviction_task = None
+        self.health_task = None
         
         # Add handlers
         self._add_handlers()
     
+    def _on_queue_event(self, chat_id: int, event: str):
+        """Stop loading a playlist into a queue that was cleared"""
+        if event == "clear":
+            loader = self.playlist_loaders.pop(chat_id, None)
+            if loader:
+                loader.cancel()
+    
+    def _on_transcoded(self, source_path: str, out_path: str):
+        """Move tracks off a download that was replaced by its pre-encoded copy"""
+        self.queue_manager.replace_path(source_path, out_path)
+        for player in self.players.players.values():
+            if player.track and player.track.path == source_path:
+                player.track.path = out_path
+    
+    def _on_player_state(self, chat_id: int, state: str):
+        """Free the chat's assistant slot once it stops playing"""
+        if state == IDLE:
+            self.assistants.release(chat_id)
+    
+    async def _chat_command(self, handler, client, message: Message):
+        """Run a voice chat command here or on the shard worker owning the chat"""
+        if self.shards:
+            await self.shards.route(handler.__name__, message)
+        else:
+            await handler(client, message, self)
+    
+    async def _shard_command(self, handler: str, chat_id: int, message_id: int, command: List[str]) -> bool:
+        """Run a command routed here by the coordinator"""
+        func = getattr(music_handlers, handler, None)
+        if not handler.endswith("_handler") or not callable(func):
+            raise ValueError(f"Unknown handler {handler}")
+        # The worker's own assistant fetches the command and sends the replies
+        try:
+            message = await self.app.get_messages(chat_id, message_id)
+        except Exception as e:
+            raise RuntimeError(f"assistant of shard {config.SHARD_INDEX} cannot read this chat ({e})")
+        if not message or message.empty:
+            raise RuntimeError(f"assistant of shard {config.SHARD_INDEX} cannot read this chat")
+        message.command = command
+        # Downloads can take a while, so acknowledge now and run in the background
+        task = asyncio.create_task(func(self.app, message, self))
+        self.shard_tasks.add(task)
+        task.add_done_callback(self.shard_tasks.discard)
+        return True
+    
+    async def _shard_ping(self) -> dict:
+        """Health and load of this shard worker"""
+        return {
+            'pid': os.getpid(),
+            'chats': len(self.players.active_chats()),
+            'queued': self.queue_manager.total_tracks,
+        }
+    
     def _add_handlers(self):
         """Add all command and message handlers"""
         
+        # Shard workers get their commands from the coordinator
+        if self.shard_server:
+            for assistant in self.assistants.assistants:
+                self._add_call_handlers(assistant.call_py)
+            return
+        
         # Music commands
         @self.app.on_message(filters.command(["play", "p"]) & filters.group)
         async def play_command(client, message: Message):
-            await music_handlers.play_handler(client, message, self)
+            await self._chat_command(music_handlers.play_handler, client, message)
         
         @self.app.on_message(filters.command(["vplay", "vp"]) & filters.group)
         async def vplay_command(client, message: Message):
-            await music_handlers.vplay_handler(client, message, self)
+            await self._chat_command(music_handlers.vplay_handler, client, message)
         
         @self.app.on_message(filters.command(["pause"]) & filters.group)
         async def pause_command(client, message: Message):
-            await music_handlers.pause_handler(client, message, self)
+            await self._chat_command(music_handlers.pause_handler, client, message)
         
         @self.app.on_message(filters.command(["resume"]) & filters.group)
         async def resume_command(client, message: Message):
-            await music_handlers.resume_handler(client, message, self)
+            await self._chat_command(music_handlers.resume_handler, client, message)
         
         @self.app.on_message(filters.command(["skip", "next"]) & filters.group)
         async def skip_command(client, message: Message):
-            await music_handlers.skip_handler(client, message, self)
+            await self._chat_command(music_handlers.skip_handler, client, message)
         
         @self.app.on_message(filters.command(["stop", "end"]) & filters.group)
         async def stop_command(client, message: Message):
-            await music_handlers.stop_handler(client, message, self)
+            await self._chat_command(music_handlers.stop_handler, client, message)
+        
+        @self.app.on_message(filters.command(["seek"]) & filters.group)
+        async def seek_command(client, message: Message):
+            await self._chat_command(music_handlers.seek_handler, client, message)
         
         @self.app.on_message(filters.command(["queue", "q"]) & filters.group)
         async def queue_command(client, message: Message):
-            await music_handlers.queue_handler(client, message, self)
+            await self._chat_command(music_handlers.queue_handler, client, message)
         
         @self.app.on_message(filters.command(["shuffle"]) & filters.group)
         async def shuffle_command(client, message: Message):
-            await music_handlers.shuffle_handler(client, message, self)
+            await self._chat_command(music_handlers.shuffle_handler, client, message)
         
         @self.app.on_message(filters.command(["loop"]) & filters.group)
         async def loop_command(client, message: Message):
-            await music_handlers.loop_handler(client, message, self)
+            await self._chat_command(music_handlers.loop_handler, client, message)
+        
+        @self.app.on_message(filters.command(["prefetch"]) & filters.group)
+        async def prefetch_command(client, message: Message):
+            await self._chat_command(music_handlers.prefetch_handler, client, message)
         
         @self.app.on_message(filters.command(["volume", "vol"]) & filters.group)
         async def volume_command(client, message: Message):
-            await music_handlers.volume_handler(client, message, self)
+            await self._chat_command(music_handlers.volume_handler, client, message)
         
         @self.app.on_message(filters.command(["playlist", "pl"]) & filters.group)
         async def playlist_command(client, message: Message):
-            await music_handlers.playlist_handler(client, message, self)
+            await self._chat_command(music_handlers.playlist_handler, client, message)
         
         @self.app.on_message(filters.command(["radio", "stream"]) & filters.group)
         async def radio_command(client, message: Message):
-            await music_handlers.radio_handler(client, message, self)
+            await self._chat_command(music_handlers.radio_handler, client, message)
         
         # Admin commands
         @self.app.on_message(filters.command(["reload"]) & filters.user(config.ADMINS))
@@ -130,6 +240,10 @@ class MusicBot:
         async def logs_command(client, message: Message):
             await admin_handlers.logs_handler(client, message, self)
         
+        @self.app.on_message(filters.command(["memory"]) & filters.user(config.ADMINS))
+        async def memory_command(client, message: Message):
+            await admin_handlers.memory_handler(client, message, self)
+        
         @self.app.on_message(filters.command(["speedtest"]) & filters.user(config.ADMINS))
         async def speedtest_command(client, message: Message):
             await admin_handlers.speedtest_handler(client, message, self)
@@ -175,28 +289,36 @@ class MusicBot:
         async def language_command(client, message: Message):
             await user_handlers.language_handler(client, message, self)
         
-        # PyTgCalls event handlers
-        @self.call_py.on_stream_end()
+        # PyTgCalls event handlers, for every assistant
+        for assistant in self.assistants.assistants:
+            self._add_call_handlers(assistant.call_py)
+    
+    def _add_call_handlers(self, call_py: PyTgCalls):
+        """Add voice chat event handlers to one PyTgCalls instance"""
+        
+        @call_py.on_stream_end()
         async def on_stream_end(client, update):
             await music_handlers.stream_end_handler(client, update, self)
         
-        @self.call_py.on_closed_voice_chat()
+        @call_py.on_closed_voice_chat()
         async def on_closed_vc(client, chat_id):
             await music_handlers.closed_vc_handler(client, chat_id, self)
         
-        @self.call_py.on_kicked()
+        @call_py.on_kicked()
         async def on_kicked(client, chat_id):
             await music_handlers.kicked_handler(client, chat_id, self)
         
-        @self.call_py.on_left()
+        @call_py.on_left()
         async def on_left(client, chat_id):
             await music_handlers.left_handler(client, chat_id, self)
     
     async def start(self):
         """Start the music bot"""
         try:
-            await self.app.start()
-            await self.call_py.start()
+            for assistant in self.assistants.assistants:
+                await assistant.app.start()
+                await assistant.call_py.start()
+            logger.info(f"Started {len(self.assistants.assistants)} assistant(s)")
             
             if self.bot:
                 await self.bot.start()
@@ -205,6 +327,27 @@ class MusicBot:
             # Initialize database
             await self.db.connect()
             
+            # Pre-create yt-dlp instances
+            await self.downloader.warmup()
+            
+            # Rebuild queues from before the last shutdown or crash
+            await self.restore_queues()
+            
+            # Spawn playback workers, or accept commands from the coordinator
+            if self.shards:
+                await self.shards.start()
+                logger.info(f"Started {config.SHARD_WORKERS} shard workers")
+            if self.shard_server:
+                await self.shard_server.start()
+                logger.info(f"Shard worker {config.SHARD_INDEX} is ready")
+            
+            # Forget chats that have been idle for a while
+            self.eviction_task = asyncio.create_task(self._evict_idle_chats())
+            
+            # Move calls off assistants that lost their connection
+            if len(self.assistants.assistants) > 1:
+                self.health_task = asyncio.create_task(self._check_assistants())
+            
             logger.info("Music Bot started successfully!")
             logger.info(f"Bot username: @{self.app.me.username}")
             
@@ -231,23 +374,92 @@ class MusicBot:
             logger.error(f"Error starting bot: {e}")
             raise
     
+    async def restore_queues(self):
+        """Restore persisted queues and resume the chats that were playing"""
+        if not self.journal:
+            return
+        
+        playing = await self.journal.restore()
+        self.journal.start()
+        if playing:
+            logger.info(f"Resuming playback in {len(playing)} chats")
+            await asyncio.gather(
+                *(music_handlers.play_next(self, chat_id) for chat_id in playing),
+                return_exceptions=True
+            )
+    
+    async def _evict_idle_chats(self):
+        """Periodically drop queue state of idle chats"""
+        while True:
+            await asyncio.sleep(config.QUEUE_EVICT_INTERVAL)
+            evicted = self.queue_manager.evict_idle()
+            if evicted:
+                logger.info(f"Evicted {evicted} idle chats")
+    
+    async def _check_assistants(self):
+        """Periodically health-check assistants and rebalance chats of failed ones"""
+        while True:
+            await asyncio.sleep(config.ASSISTANT_HEALTH_INTERVAL)
+            for assistant in self.assistants.assistants:
+                try:
+                    await asyncio.wait_for(assistant.app.get_me(), timeout=10)
+                    alive = True
+                except Exception:
+                    alive = False
+                
+                if not alive and assistant.healthy:
+                    moved = self.assistants.mark_down(assistant)
+                    logger.warning(f"Assistant {assistant.index} is down, moving {len(moved)} chats")
+                    for chat_id in moved:
+                        await music_handlers.move_chat(self, chat_id)
+                elif alive and not assistant.healthy:
+                    self.assistants.mark_up(assistant)
+                    logger.info(f"Assistant {assistant.index} is back")
+    
     async def stop(self):
         """Stop the music bot"""
         try:
-            # Clear all queues
+            for task in (self.eviction_task, self.health_task):
+                if task:
+                    task.cancel()
+            
+            # Stop taking commands and shut down shard workers
+            if self.shard_server:
+                await self.shard_server.close()
+            if self.shards:
+                await self.shards.stop()
+            
+            # Snapshot queues so they survive the restart
+            if self.journal:
+                await self.journal.close()
+            
+            # Clear all queues (also cancels prefetch jobs)
             self.queue_manager.clear_all()
             
             # Leave all voice chats
-            if self.call_py.is_connected:
-                await self.call_py.leave_group_call(self.current_chat)
+            for chat_id in self.players.active_chats():
+                assistant = self.assistants.current(chat_id)
+                try:
+                    if assistant:
+                        await assistant.call_py.leave_group_call(chat_id)
+                except Exception as e:
+                    logger.error(f"Failed to leave {chat_id}: {e}")
+                self.players.get(chat_id).reset()
             
             # Stop clients
-            await self.call_py.stop()
-            await self.app.stop()
+            for assistant in self.assistants.assistants:
+                await assistant.call_py.stop()
+                await assistant.app.stop()
             
             if self.bot:
                 await self.bot.stop()
             
+            # Stop download workers and persist caches
+            self.downloader.scheduler.shutdown()
+            self.downloader.pool.close()
+            self.downloader.cache.flush()
+            self.downloader.flush_search_cache()
+            
             # Close database
             await self.db.disconnect()
             
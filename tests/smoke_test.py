@@ -15,5 +15,875 @@ def test_queue_manager():
     assert pos == 1
     assert not qm.is_empty(cid)
     nxt = qm.get_next(cid)
-    assert nxt["title"] == "Test Song"
+    assert nxt.title == "Test Song"
+    assert nxt.duration == 180
     assert qm.is_empty(cid)
+
+def test_queue_manager_remove_and_move():
+    from utils.queue_manager import QueueManager, Track
+    qm = QueueManager()
+    for title in ("a", "b", "c", "d"):
+        qm.add_to_queue(1, Track(title, 60, requested_by="Tester"))
+    assert qm.remove(1, 2).title == "b"
+    assert qm.remove(1, 9) is None
+    assert qm.move(1, 3, 1)
+    assert [track.title for track in qm.get_queue(1)] == ["d", "a", "c"]
+    assert [track.title for track in qm.peek(1, 2)] == ["d", "a"]
+    assert qm.get_next(1).title == "d"
+    assert qm.queue_length(1) == 2
+
+def test_player_registry_per_chat_states():
+    from utils.player import PlayerRegistry, IDLE, PLAYING, PAUSED
+    players = PlayerRegistry()
+    first = players.get(1)
+    assert first.begin()
+    assert not players.get(1).begin()  # second /play in the same chat queues
+    assert players.get(2).begin()  # other chats are independent
+    assert first.transition(PLAYING, "song")
+    assert first.transition(PAUSED)
+    assert not players.get(3).transition(PAUSED)  # idle chats cannot pause
+    assert players.active_chats() == [1, 2]
+    assert players.get_stats()["paused"] == 1
+    players.get(2).reset()
+    assert players.state(2) == IDLE and 2 not in players.players
+
+def test_queue_journal_restore(tmp_path):
+    import asyncio
+    from utils.queue_manager import QueueManager, Track
+    from utils.queue_journal import QueueJournal
+
+    qm = QueueManager()
+    journal = QueueJournal(qm, directory=str(tmp_path))
+    for title in ("a", "b", "c", "d"):
+        qm.add_to_queue(1, Track(title, 60, type="youtube", url=title))
+    qm.add_to_queue(2, Track("x", 60, type="youtube", url="x"))
+    qm.clear_queue(2)
+    qm.get_next(1)
+    qm.move(1, 3, 1)
+    journal.compact()
+    qm.toggle_loop(1)
+    qm.get_next(1)
+    with open(journal.journal_path, "a") as journal_file:
+        journal_file.write('{"op": "add", "chat"')  # torn write from a crash
+
+    restored = QueueManager()
+    playing = asyncio.run(QueueJournal(restored, directory=str(tmp_path)).restore())
+    assert playing == [1]
+    # "d" was playing when the process died, "a" re-queued by loop mode
+    assert [track.title for track in restored.get_queue(1)] == ["d", "b", "c", "a"]
+    assert restored.loop_mode[1]
+    assert 2 not in restored.queues
+
+def test_queue_journal_restores_first_track(tmp_path):
+    import asyncio
+    from utils.queue_manager import QueueManager, Track
+    from utils.queue_journal import QueueJournal
+
+    qm = QueueManager()
+    journal = QueueJournal(qm, directory=str(tmp_path))
+    # /play and /playlist start their first song without get_next()
+    qm.set_current(1, Track("first", 60, type="youtube", url="first"))
+    qm.set_current(2, Track("solo", 60, type="youtube", url="solo"))
+    journal.compact()
+    qm.toggle_loop(1)
+    qm.add_to_queue(1, Track("second", 60, type="youtube", url="second"))
+
+    restored = QueueManager()
+    playing = asyncio.run(QueueJournal(restored, directory=str(tmp_path)).restore())
+    assert sorted(playing) == [1, 2]
+    assert [track.title for track in restored.get_queue(1)] == ["first", "second"]
+    assert [track.title for track in restored.get_queue(2)] == ["solo"]
+
+    # Loop mode re-queues the first song as well
+    assert qm.get_next(1).title == "second"
+    assert [track.title for track in qm.get_queue(1)] == ["first"]
+
+def test_queue_manager_idle_eviction():
+    from utils.queue_manager import QueueManager, Track
+    qm = QueueManager()
+    events = []
+    qm.add_listener(lambda chat_id, event: events.append((chat_id, event)))
+    assert qm.is_empty(7) and qm.get_queue(7) == [] and qm.get_current(7) is None
+    assert qm.get_memory_report()["chats"] == 0  # reads create nothing
+    qm.add_to_queue(1, Track("a", 60))
+    qm.toggle_loop(2)
+    qm.add_to_queue(3, Track("b", 60))
+    qm.get_next(3)  # playing, queue empty
+    assert qm.chat_memory(1) > 0
+    assert qm.evict_idle(max_idle=0) == 1  # only the loop-only chat 2
+    assert (2, "evict") in events
+    assert set(qm.last_active) == {1, 3}
+    qm.end_playback(3)
+    assert qm.evict_idle(max_idle=0) == 1
+    assert 3 not in qm.queues and qm.get_memory_report()["evicted"] == 2
+
+def test_queue_manager_counters_and_pages():
+    import random
+    from utils.queue_manager import QueueManager, Track
+    qm = QueueManager()
+    rng = random.Random(1)
+    for i in range(200):
+        chat_id = rng.randrange(4)
+        action = rng.random()
+        if action < 0.5:
+            qm.add_to_queue(chat_id, Track(str(i), rng.randrange(300)))
+        elif action < 0.7:
+            qm.get_next(chat_id)
+        elif action < 0.8:
+            qm.remove(chat_id, 1)
+        elif action < 0.85:
+            qm.toggle_loop(chat_id)
+        elif action < 0.9:
+            qm.clear_queue(chat_id)
+        else:
+            qm.evict_idle(max_idle=0)
+        stats = qm.get_queue_stats()
+        assert stats["total_songs"] == sum(len(queue) for queue in qm.queues.values())
+        assert stats["total_duration"] == sum(t.duration for queue in qm.queues.values() for t in queue)
+        assert stats["total_chats"] == sum(1 for queue in qm.queues.values() if queue)
+        for chat_id in range(4):
+            assert qm.get_queue_duration(chat_id) == sum(t.duration for t in qm.get_queue(chat_id))
+
+    qm.clear_queue(9)
+    for i in range(25):
+        qm.add_to_queue(9, Track(str(i), 10))
+    assert [t.title for t in qm.get_page(9, 3, 10)] == [str(i) for i in range(20, 25)]
+    assert qm.get_page(9, 4, 10) == []
+
+def test_assistant_pool_least_loaded_and_sticky():
+    from utils.assistants import Assistant, AssistantPool
+    pool = AssistantPool([Assistant(i, app=None, call_py=f"calls{i}") for i in range(3)])
+    assert [pool.assign(chat_id).index for chat_id in (1, 2, 3, 4)] == [0, 1, 2, 0]
+    assert pool.call_for(2) == "calls1"  # sticky while active
+    pool.release(2)
+    pool.release(3)
+    assert pool.assign(3).index == 2  # previous assistant within slack
+    moved = pool.mark_down(pool.assistants[0])
+    assert sorted(moved) == [1, 4]
+    assert all(pool.current(chat_id).index != 0 for chat_id in moved)
+    assert pool.assistants[0].load == 0
+    assert sorted(a["calls"] for a in pool.get_stats()) == [0, 1, 2]
+
+def test_hash_ring_and_shard_ipc(tmp_path):
+    import asyncio
+    import config
+    from utils.sharding import HashRing, ShardClient, ShardCoordinator, ShardError, ShardServer
+    ring = HashRing([0, 1, 2])
+    owners = {chat_id: ring.node_for(chat_id) for chat_id in range(-1000, 2000)}
+    assert set(owners.values()) == {0, 1, 2}
+    ring.remove(2)
+    # Only chats of the removed worker move
+    assert all(ring.node_for(c) == n for c, n in owners.items() if n != 2)
+    ring.add(2)
+    assert all(ring.node_for(c) == n for c, n in owners.items())
+
+    # Per-process files are split between workers, the database is shared
+    coordinator = ShardCoordinator(2, ["a", "b", "c"], "main.py")
+    envs = [coordinator._worker_env(worker) for worker in coordinator.workers]
+    assert [env["SESSION_STRING"] for env in envs] == ["a", "b"]
+    for key in ("MEDIA_CACHE_DIR", "QUEUE_JOURNAL_DIR", "SEARCH_CACHE_PATH"):
+        assert envs[0][key] != envs[1][key] != getattr(config, key)
+    assert envs[1]["SEARCH_CACHE_PATH"].endswith("search_cache.shard-1.json")
+    assert all(env.get("SQLITE_DB_PATH", config.SQLITE_DB_PATH) == config.SQLITE_DB_PATH for env in envs)
+
+    async def route_errors():
+        from types import SimpleNamespace
+        replies = []
+
+        async def reply_text(text):
+            replies.append(text)
+
+        async def refuse(method, **kwargs):
+            raise ShardError("assistant of shard 0 cannot read this chat")
+
+        message = SimpleNamespace(chat=SimpleNamespace(id=-100), id=1, command=["play", "x"], reply_text=reply_text)
+        worker = coordinator.worker_for(-100)
+        # Unhealthy workers are restarting, worker errors are shown as they are
+        assert not await coordinator.route("play_handler", message)
+        worker.healthy = True
+        worker.client = SimpleNamespace(call=refuse)
+        assert not await coordinator.route("play_handler", message)
+        assert "restarting" in replies[0]
+        assert "cannot read this chat" in replies[1]
+
+    asyncio.run(route_errors())
+
+    async def run():
+        async def echo(value):
+            return {"value": value}
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        path = str(tmp_path / "worker-0.sock")
+        server = ShardServer(path, {"echo": echo, "fail": fail})
+        await server.start()
+        client = ShardClient(path)
+        results = await asyncio.gather(*(client.call("echo", value=i) for i in range(5)))
+        assert [r["value"] for r in results] == list(range(5))
+        try:
+            await client.call("fail")
+            raise AssertionError("expected ShardError")
+        except ShardError as e:
+            assert "boom" in str(e)
+        await client.close()
+        await server.close()
+
+    asyncio.run(run())
+
+def test_request_context_loads_state_once():
+    import asyncio
+    from types import SimpleNamespace
+    from utils.context import RequestContext
+
+    calls = []
+
+    class FakeDB:
+        async def add_user(self, user_id, username="", first_name=""):
+            calls.append("add_user")
+
+        async def is_user_banned(self, user_id):
+            calls.append("is_user_banned")
+            return False
+
+        async def get_chat(self, chat_id):
+            calls.append("get_chat")
+            return {"chat_id": chat_id, "settings": {"admin_only": True}}
+
+    class FakeClient:
+        async def get_chat_member(self, chat_id, user_id):
+            calls.append("get_chat_member")
+            return SimpleNamespace(status=SimpleNamespace(value="administrator"))
+
+    message = SimpleNamespace(
+        from_user=SimpleNamespace(id=7, username="u", first_name="U"),
+        chat=SimpleNamespace(id=-100),
+    )
+
+    async def run():
+        ctx = await RequestContext.build(FakeClient(), message, SimpleNamespace(db=FakeDB()))
+        assert not ctx.banned and ctx.admin_only
+        assert await ctx.is_group_admin()
+        assert await ctx.is_group_admin()
+
+    asyncio.run(run())
+    assert sorted(calls) == ["add_user", "get_chat", "get_chat_member", "is_user_banned"]
+    assert RequestContext.get_stats()["builds"] >= 1
+
+def test_database_sqlite_backend(tmp_path, monkeypatch):
+    import asyncio
+    import config
+    from utils.database import Database
+    import pytest
+    from utils.storage import SQLiteBackend, StorageBackend
+
+    # Backends must implement every operation
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+    async def run():
+        db = Database(SQLiteBackend(str(tmp_path / "bot.db")))
+        await db.connect()
+        assert db.connected
+
+        await db.add_user(1, "alice", "Alice")
+        await db.add_user(1, "alice", "Alice")
+        await db.add_user(2, "bob", "Bob")
+        await db.add_chat(-100, "Group", "supergroup")
+        await db.record_play(-100, 180)
+        await db.record_play(-100, 120)
+        # Unflushed users are read through the buffer
+        assert (await db.get_user(2))["username"] == "bob"
+        assert await db.flush() == 4
+        assert (await db.get_user(1))["username"] == "alice"
+
+        assert not await db.is_user_banned(2)
+        await db.ban_user(2)
+        assert await db.is_user_banned(2)
+        await db.load_bans()
+        assert await db.is_user_banned(2)
+        await db.unban_user(2)
+        assert not await db.is_user_banned(2)
+
+        # A ban made by another process arrives with the next sync
+        other = Database(SQLiteBackend(str(tmp_path / "bot.db")))
+        await other.connect()
+        await other.ban_user(1)
+        await other.disconnect()
+        assert not await db.is_user_banned(1)
+        assert await db.sync_bans() >= 1
+        assert await db.is_user_banned(1)
+        await db.unban_user(1)
+
+        chat = await db.get_chat(-100)
+        assert chat["settings"]["admin_only"] is False
+        assert chat["stats"]["songs_played"] == 2
+        await db.update_chat_settings(-100, {"admin_only": True})
+        assert (await db.get_chat(-100))["settings"]["admin_only"] is True
+
+        stats = await db.get_global_stats()
+        assert stats == {"total_users": 2, "total_chats": 1, "total_songs_played": 2}
+        assert await db.reconcile_stats() == stats
+
+        await db.save_playlist(1, "mix", [{"title": "a"}])
+        assert await db.get_playlist(1, "mix") == [{"title": "a"}]
+        assert await db.get_user_playlists(1) == ["mix"]
+        assert await db.delete_playlist(1, "mix")
+
+        snapshot = {"seq": 3, "time": 1.0, "chats": {"-100": {"queue": [], "current": None, "loop": True}}}
+        await db.save_queue_snapshot(snapshot)
+        assert await db.get_queue_snapshot() == snapshot
+
+        # Retention removes old rows in batches and keeps the counters right
+        await db.add_user(4, "dave", "Dave")
+        await db.flush()
+        await db.backend._run(db.backend._write, "UPDATE users SET last_seen = 0 WHERE user_id IN (2, 4)")
+        await db.backend._run(db.backend._write, "UPDATE stats SET date = 0")
+        await db.ban_user(2)
+        monkeypatch.setattr(config, "DB_RETENTION_BATCH_SIZE", 1)
+        monkeypatch.setattr(config, "DB_RETENTION_PAUSE", 0)
+        progress = await db.run_retention(days=30)
+        assert (progress["stats"], progress["users"], progress["running"]) == (1, 1, False)
+        assert await db.get_user(4) is None
+        assert await db.is_user_banned(2)
+        assert (await db.get_global_stats())["total_users"] == 2
+
+        # A full buffer starts one early flush, not one per write
+        monkeypatch.setattr(config, "DB_WRITE_BATCH_SIZE", 2)
+        for user_id in (10, 11, 12, 13):
+            await db.add_user(user_id, "", "")
+            if user_id == 11:
+                task = db.batch_flush_task
+        assert task is db.batch_flush_task
+        await task
+        assert not db.pending_users and (await db.get_user(13)) is not None
+        monkeypatch.setattr(config, "DB_WRITE_BATCH_SIZE", 1000)
+
+        # Buffered activity is written on shutdown
+        await db.add_user(3, "carol", "Carol")
+        await db.disconnect()
+        db = Database(SQLiteBackend(str(tmp_path / "bot.db")))
+        await db.connect()
+        assert (await db.get_user(3))["first_name"] == "Carol"
+        await db.disconnect()
+
+    asyncio.run(run())
+
+def test_ban_list_membership():
+    from utils.banlist import BanList
+    bans = BanList()
+    bans.load([5, 3, 5, 2 ** 40])
+    assert len(bans) == 3
+    assert 3 in bans and 2 ** 40 in bans
+    assert 4 not in bans
+    bans.add(4)
+    bans.add(4)
+    bans.discard(3)
+    bans.discard(99)
+    assert 4 in bans and 3 not in bans
+    assert list(bans.ids) == [4, 5, 2 ** 40]
+    misses = [user_id for user_id in range(1000, 2000) if user_id in bans]
+    assert not misses
+    stats = bans.get_stats()
+    assert stats['banned'] == 3
+    assert stats['filtered'] >= 990
+
+def _handler_bot(tmp_path, assistants=1):
+    """Bot with fake downloader, database and voice calls for handler tests"""
+    from types import SimpleNamespace
+    from utils.assistants import Assistant, AssistantPool
+    from utils.player import PlayerRegistry
+    from utils.queue_manager import QueueManager
+
+    class FakeCall:
+        def __init__(self):
+            self.streams = []
+            self.joined = set()
+            self.failing = set()
+
+        def get_call(self, chat_id):
+            return chat_id in self.joined
+
+        async def join_group_call(self, chat_id, stream, stream_type=None):
+            if stream[0] in self.failing:
+                raise RuntimeError("stream failed")
+            self.joined.add(chat_id)
+            self.streams.append(stream)
+
+        async def change_stream(self, chat_id, stream):
+            if stream[0] in self.failing:
+                raise RuntimeError("stream failed")
+            self.streams.append(stream)
+
+    class FakeDownloader:
+        def __init__(self):
+            self.loudness = SimpleNamespace(gain_for=lambda video_id: None)
+
+        async def search_youtube(self, query, **kwargs):
+            return [{"id": query, "title": query, "duration": 180, "thumbnail": None, "url": query}]
+
+        async def get_audio_source(self, url, **kwargs):
+            path = tmp_path / f"{url}.opus"
+            path.write_bytes(b"x")
+            return {"path": str(path), "headers": None, "stream": False}
+
+    class FakeDB:
+        async def add_user(self, *args):
+            pass
+
+        async def add_chat(self, *args):
+            pass
+
+        async def is_user_banned(self, user_id):
+            return False
+
+        async def get_chat(self, chat_id):
+            return {"chat_id": chat_id, "settings": {}}
+
+        async def record_play(self, chat_id, duration):
+            pass
+
+    queue_manager = QueueManager()
+    return SimpleNamespace(
+        players=PlayerRegistry(),
+        queue_manager=queue_manager,
+        prefetcher=SimpleNamespace(is_ready=lambda track: bool(track.path)),
+        downloader=FakeDownloader(),
+        assistants=AssistantPool([Assistant(i, app=None, call_py=FakeCall()) for i in range(assistants)]),
+        db=FakeDB(),
+    )
+
+def _handler_message(*command):
+    from types import SimpleNamespace
+    replies = []
+
+    async def reply(text=None, *args, **kwargs):
+        replies.append(text)
+        return SimpleNamespace(edit_text=reply, delete=reply)
+
+    return SimpleNamespace(
+        command=list(command),
+        chat=SimpleNamespace(id=-100, title="Group", type="supergroup"),
+        from_user=SimpleNamespace(id=7, username="u", first_name="U", mention="U"),
+        reply_to_message=None,
+        reply_text=reply,
+        reply_photo=reply,
+        replies=replies,
+    )
+
+def _fake_streams(monkeypatch):
+    import pytest
+    pytest.importorskip("pytgcalls")
+    import config
+    from handlers import music_handlers
+    monkeypatch.setattr(config, "STREAM_WHILE_DOWNLOAD", True)
+    monkeypatch.setattr(music_handlers, "InputStream", lambda stream: stream)
+    monkeypatch.setattr(
+        music_handlers, "_audio_piped", lambda track, seek=None: (track.title, seek)
+    )
+    return music_handlers
+
+def test_seek_first_track_started_by_play(tmp_path, monkeypatch):
+    import asyncio
+    music_handlers = _fake_streams(monkeypatch)
+
+    async def run():
+        bot = _handler_bot(tmp_path)
+        await music_handlers.play_handler(None, _handler_message("play", "song"), bot)
+        message = _handler_message("seek", "1:00")
+        await music_handlers.seek_handler(None, message, bot)
+        assert bot.assistants.call_for(-100).streams == [("song", None), ("song", 60)]
+        assert message.replies[-1].startswith("⏩")
+
+    asyncio.run(run())
+
+def test_failover_moves_first_track(tmp_path, monkeypatch):
+    import asyncio
+    music_handlers = _fake_streams(monkeypatch)
+
+    async def run():
+        bot = _handler_bot(tmp_path, assistants=2)
+        await music_handlers.play_handler(None, _handler_message("play", "song"), bot)
+        first = bot.assistants.current(-100)
+        # No get_next() has happened in this chat yet
+        assert bot.assistants.mark_down(first) == [-100]
+        await music_handlers.move_chat(bot, -100)
+        second = bot.assistants.current(-100)
+        assert second is not first
+        assert second.call_py.streams == [("song", None)]
+
+    asyncio.run(run())
+
+def test_play_next_skips_failed_streams(tmp_path, monkeypatch):
+    import asyncio
+    music_handlers = _fake_streams(monkeypatch)
+    from utils.player import IDLE, PLAYING
+    from utils.queue_manager import Track
+
+    async def run():
+        bot = _handler_bot(tmp_path)
+        call = bot.assistants.call_for(-100)
+        call.failing.add("bad")
+        path = str(tmp_path / "x.opus")
+        for title in ("bad", "good"):
+            bot.queue_manager.add_to_queue(-100, Track(title, path=path))
+        await music_handlers.play_next(bot, -100)
+        player = bot.players.get(-100)
+        assert player.state == PLAYING and player.track.title == "good"
+
+        # Every song failing in loop mode clears the queue instead of spinning
+        call.failing.add("good")
+        bot.queue_manager.toggle_loop(-100)
+        bot.queue_manager.add_to_queue(-100, Track("bad", path=path))
+        await music_handlers.play_next(bot, -100)
+        assert player.state == IDLE
+        assert bot.queue_manager.is_empty(-100)
+
+        # An idle chat with a stale queue starts playing again on /play
+        bot.queue_manager.toggle_loop(-100)
+        call.failing.clear()
+        bot.queue_manager.add_to_queue(-100, Track("old", path=path))
+        await music_handlers.play_handler(None, _handler_message("play", "song"), bot)
+        player = bot.players.get(-100)
+        assert player.state == PLAYING and player.track.title == "old"
+        assert [track.title for track in bot.queue_manager.get_queue(-100)] == ["song"]
+
+    asyncio.run(run())
+
+def test_prefetch_command_sets_chat_depth(tmp_path, monkeypatch):
+    import asyncio
+    import config
+    from utils.prefetcher import Prefetcher
+    music_handlers = _fake_streams(monkeypatch)
+    monkeypatch.setattr(config, "ADMINS", [7])
+    monkeypatch.setattr(config, "PREFETCH_MAX_DEPTH", 5)
+
+    async def run():
+        bot = _handler_bot(tmp_path)
+        bot.prefetcher = Prefetcher(bot.queue_manager, bot.downloader)
+        await music_handlers.prefetch_handler(None, _handler_message("prefetch", "9"), bot)
+        assert bot.prefetcher.get_depth(-100) == 5
+        message = _handler_message("prefetch")
+        await music_handlers.prefetch_handler(None, message, bot)
+        assert "`5`" in message.replies[-1]
+
+    asyncio.run(run())
+
+def test_playlist_pages_are_fetched_lazily(tmp_path, monkeypatch):
+    import asyncio
+    import pytest
+    pytest.importorskip("yt_dlp")
+    monkeypatch.chdir(tmp_path)
+    from utils.downloader import YouTubeDownloader
+
+    downloader = YouTubeDownloader()
+    opened, produced, closed = [], [], []
+
+    def open_playlist(url, stack):
+        opened.append(url)
+        stack.callback(closed.append, url)
+
+        def entries():
+            for i in range(1, 13):
+                produced.append(i)
+                yield {"id": f"video{i:06d}", "title": str(i), "duration": 60}
+
+        return {"title": "Mix", "entries": entries()}
+
+    monkeypatch.setattr(downloader, "_open_playlist", open_playlist)
+
+    async def collect(**kwargs):
+        return [page async for page in downloader.iter_playlist("list", **kwargs)]
+
+    async def run():
+        pages = await collect(page_size=5, max_entries=20)
+        assert [len(page["entries"]) for page in pages] == [5, 5, 2]
+        # One extraction for the whole playlist, released when it is exhausted
+        assert opened == closed == ["list"]
+        assert pages[0]["title"] == "Mix"
+        assert pages[0]["entries"][0]["webpage_url"] == "https://www.youtube.com/watch?v=video000001"
+
+        # Stops at the track limit, and stops reading once the consumer stops
+        produced.clear()
+        assert [len(page["entries"]) for page in await collect(page_size=5, max_entries=7)] == [5, 2]
+        assert produced == list(range(1, 8))
+        produced.clear()
+        pages = downloader.iter_playlist("list", page_size=5, max_entries=20)
+        await pages.__anext__()
+        await pages.aclose()
+        assert produced == list(range(1, 6))
+        assert opened == closed == ["list"] * 3
+        downloader.scheduler.shutdown()
+
+    asyncio.run(run())
+
+def test_ydl_pool_reuses_instances_and_restores_params():
+    import pytest
+    pytest.importorskip("yt_dlp")
+    from utils.ydl_pool import YDLPool
+
+    pool = YDLPool({"audio": {"quiet": True}}, size=1)
+    statuses = []
+
+    def report(ydl, status):
+        # What YoutubeDL does for every registered hook
+        for registered in ydl._progress_hooks:
+            registered(status)
+
+    with pool.checkout("audio", progress_hooks=[statuses.append], overrides={"playlist_items": "1-5"}) as ydl:
+        assert ydl.params["playlist_items"] == "1-5"
+        report(ydl, "first")
+    with pool.checkout("audio") as reused:
+        assert reused is ydl
+        assert "playlist_items" not in reused.params and reused.params["quiet"]
+        # The previous job's hook is no longer called
+        report(reused, "second")
+        assert statuses == ["first"]
+        # A second concurrent checkout gets its own instance
+        with pool.checkout("audio") as other:
+            assert other is not reused
+    assert pool.get_stats() == {"idle": 1, "created": 2, "reused": 1}
+    pool.close()
+
+def test_audio_source_streams_while_caching(tmp_path, monkeypatch):
+    import asyncio
+    import pytest
+    pytest.importorskip("yt_dlp")
+    monkeypatch.chdir(tmp_path)
+    from utils.downloader import YouTubeDownloader
+
+    downloader = YouTubeDownloader()
+    background = []
+    monkeypatch.setattr(downloader, "_extract", lambda profile, url, **kwargs: {
+        "url": "https://media.example/a", "http_headers": {"User-Agent": "x"}, "id": "aaaaaaaaaaa",
+    })
+    monkeypatch.setattr(
+        downloader, "download_in_background",
+        lambda url, video_id=None, **kwargs: background.append((url, video_id))
+    )
+    url = "https://youtu.be/aaaaaaaaaaa"
+
+    async def run():
+        # Not cached: play the direct URL and fill the cache in background
+        source = await downloader.get_audio_source(url)
+        assert source == {"path": "https://media.example/a", "headers": {"User-Agent": "x"}, "stream": True}
+        assert background == [(url, "aaaaaaaaaaa")]
+
+        # Cached: play the file
+        path = tmp_path / "a.m4a"
+        path.write_bytes(b"x")
+        downloader.cache.put("aaaaaaaaaaa", "audio", str(path))
+        source = await downloader.get_audio_source(url)
+        assert source == {"path": str(path), "headers": None, "stream": False}
+        assert len(background) == 1
+        downloader.scheduler.shutdown()
+
+    asyncio.run(run())
+
+def test_media_cache_lru(tmp_path):
+    from utils.media_cache import MediaCache
+    cache = MediaCache(cache_dir=str(tmp_path), max_size=10)
+    for vid in ("a", "b"):
+        path = tmp_path / f"{vid}.m4a"
+        path.write_bytes(b"x" * 4)
+        cache.put(vid, "audio", str(path))
+    assert cache.get("a", "audio")  # "b" is now least recently used
+    path = tmp_path / "c.m4a"
+    path.write_bytes(b"x" * 4)
+    cache.put("c", "audio", str(path))
+    assert cache.get("b", "audio") is None
+    assert cache.get("c", "audio")
+    assert cache.get_stats()["evictions"] == 1
+    reloaded = MediaCache(cache_dir=str(tmp_path), max_size=10)
+    assert set(reloaded.entries) == {"audio:a", "audio:c"}
+
+def test_prefetcher_window_and_cancel(tmp_path):
+    import asyncio
+    from utils.queue_manager import QueueManager
+    from utils.prefetcher import Prefetcher
+
+    class FakeDownloader:
+        async def download_audio(self, url, **kwargs):
+            await asyncio.sleep(0.01)
+            path = tmp_path / url
+            path.write_bytes(b"x")
+            return str(path)
+
+    async def run():
+        qm = QueueManager()
+        prefetcher = Prefetcher(qm, FakeDownloader())
+        prefetcher.set_depth(1, 2)
+        for url in ("a", "b", "c"):
+            qm.add_to_queue(1, {"title": url, "type": "youtube", "url": url, "path": None})
+        assert set(prefetcher.tasks[1]) == {"a", "b"}
+        await asyncio.sleep(0.05)
+        queue = qm.get_queue(1)
+        assert prefetcher.is_ready(queue[0]) and prefetcher.is_ready(queue[1])
+        assert queue[2].path is None
+        qm.get_next(1)
+        assert set(prefetcher.tasks[1]) == {"c"}
+        qm.clear_queue(1)
+        assert 1 not in prefetcher.tasks
+
+    asyncio.run(run())
+
+def test_download_scheduler_priority_and_fairness():
+    import asyncio
+    import threading
+    from utils.download_scheduler import DownloadScheduler, PRIORITY_PLAY, PRIORITY_PREFETCH
+
+    async def run():
+        scheduler = DownloadScheduler(workers=1)
+        gate = threading.Event()
+        order = []
+        blocker = asyncio.create_task(scheduler.submit(gate.wait, chat_id=0))
+        await asyncio.sleep(0.01)
+        jobs = [
+            scheduler.submit(order.append, f"a{i}", chat_id=1, priority=PRIORITY_PREFETCH)
+            for i in range(3)
+        ]
+        jobs.append(scheduler.submit(order.append, "b0", chat_id=2, priority=PRIORITY_PREFETCH))
+        jobs.append(scheduler.submit(order.append, "play", chat_id=3, priority=PRIORITY_PLAY))
+        tasks = [asyncio.create_task(job) for job in jobs]
+        await asyncio.sleep(0.01)
+        assert scheduler.get_stats()["queued_prefetch"] == 4
+        gate.set()
+        await asyncio.gather(blocker, *tasks)
+        scheduler.shutdown()
+        return order
+
+    assert asyncio.run(run()) == ["play", "a0", "b0", "a1", "a2"]
+
+def test_download_job_coalesces_progress():
+    import asyncio
+    import threading
+    from utils.download_job import DownloadJob
+
+    async def run():
+        job = DownloadJob("url", "audio", min_interval=0.05)
+
+        def worker():
+            for i in range(1, 101):
+                job.progress_hook({'status': 'downloading', 'downloaded_bytes': i, 'total_bytes': 100})
+            job.progress_hook({'status': 'finished', 'filename': '/tmp/x.m4a'})
+
+        async def download():
+            await asyncio.get_running_loop().run_in_executor(None, worker)
+            await asyncio.sleep(0.12)
+            return job.filename
+
+        job.start(download())
+        snapshots = [snapshot async for snapshot in job.progress()]
+        return snapshots, await job.result()
+
+    snapshots, result = asyncio.run(run())
+    assert result == "/tmp/x.m4a"
+    assert 1 <= len(snapshots) <= 3
+    assert snapshots[-1]["downloaded_bytes"] == 100
+
+def test_ttl_cache_lru_expiry_and_persistence(tmp_path):
+    from utils.cache import TTLCache
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", [1])
+    cache.set("b", [])  # negative entry
+    assert cache.get("a") == [1]
+    assert cache.get("b", "miss") == []
+    cache.set("c", [3])  # "a" is least recently used
+    assert "a" not in cache and "b" in cache
+    cache.set("d", [4], ttl=-1)
+    assert cache.get("d") is None
+    assert cache.get_stats()["expirations"] == 1
+    path = str(tmp_path / "cache.json")
+    cache.set("c", [3])
+    cache.save(path)
+    restored = TTLCache(maxsize=2, ttl=60)
+    restored.load(path)
+    assert restored.get("c") == [3]
+
+def test_transcoder_swaps_cached_source(tmp_path, monkeypatch):
+    import asyncio
+    import config
+    from utils.media_cache import MediaCache
+    from utils.queue_manager import QueueManager, Track
+    from utils.transcoder import AudioTranscoder
+    monkeypatch.setattr(config, "PREENCODE_AUDIO", True)
+    monkeypatch.setattr(config, "PREENCODE_KEEP_SOURCE", False)
+    monkeypatch.setattr(config, "AUDIO_QUALITY", "high")
+
+    class FakeProcess:
+        returncode = 0
+
+        async def communicate(self):
+            return b"", b""
+
+    async def fake_ffmpeg(*args, **kwargs):
+        with open(args[-1], "wb") as out:
+            out.write(b"opus")
+        return FakeProcess()
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", fake_ffmpeg)
+    cache = MediaCache(cache_dir=str(tmp_path), max_size=10)
+    source = tmp_path / "a.m4a"
+    source.write_bytes(b"m4a")
+    cache.put("a", "audio", str(source), title="A", duration=60)
+
+    qm = QueueManager()
+    playing = Track("A", 60, path=str(source), type="youtube", video_id="a")
+    queued = Track("A", 60, path=str(source), type="youtube", video_id="a")
+    qm.set_current(1, playing)
+    qm.add_to_queue(2, queued)
+    transcoder = AudioTranscoder(cache)
+    transcoder.add_listener(qm.replace_path)
+
+    async def run():
+        return await transcoder.schedule("a", str(source))
+
+    out_path = asyncio.run(run())
+    assert out_path.endswith("opus-high/a.ogg")
+    assert cache.get_any("a", [transcoder.profile, "audio"]) == out_path
+    assert cache.get_entry("a", transcoder.profile)["title"] == "A"
+    assert cache.get_entry("a", "audio") is None and not source.exists()
+    assert playing.path == queued.path == out_path
+    assert transcoder.get_stats() == {"pending": 0, "completed": 1, "failed": 0}
+    assert transcoder.schedule("a", str(source)) is None  # already encoded
+
+def test_loudness_gain_from_cached_measurement(tmp_path, monkeypatch):
+    import config
+    from utils.media_cache import MediaCache
+    from utils.loudness import LoudnessAnalyzer
+    monkeypatch.setattr(config, "LOUDNESS_NORMALIZATION", True)
+    monkeypatch.setattr(config, "LOUDNESS_TARGET", -14.0)
+    output = 'Input #0 ...\n[Parsed_loudnorm_0 @ 0x1]\n{\n "input_i" : "-20.50",\n "input_tp" : "-3.00"\n}\n'
+    measurement = LoudnessAnalyzer.parse_loudnorm(output)
+    assert measurement == {"integrated": -20.5, "true_peak": -3.0}
+
+    cache = MediaCache(cache_dir=str(tmp_path), max_size=0)
+    path = tmp_path / "v.m4a"
+    path.write_bytes(b"x")
+    cache.put("v", "audio", str(path), loudness=measurement)
+    analyzer = LoudnessAnalyzer(cache, ["opus-high", "audio"])
+    # +6.5 dB would push the peak over -1 dBTP, so it is limited to +2 dB
+    assert analyzer.gain_for("v") == 2.0
+    assert analyzer.gain_for("unknown") is None
+
+    import asyncio
+    analyzed = []
+
+    async def analyze(video_id, path):
+        analyzed.append(video_id)
+        await asyncio.sleep(0)
+
+    async def run():
+        other = tmp_path / "w.m4a"
+        other.write_bytes(b"x")
+        cache.put("w", "audio", str(other))
+        analyzer.analyze = analyze
+        # A running backfill is reused and its analyses are tracked as pending
+        task = analyzer.start_backfill()
+        assert analyzer.start_backfill() is task
+        await asyncio.sleep(0)
+        assert list(analyzer.pending) == ["w"]
+        await task
+        assert analyzed == ["w"]
+
+    asyncio.run(run())
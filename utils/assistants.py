@@ -0,0 +1,122 @@
+# Assistant (userbot) pool for VCPlay Music Bot
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+import config
+
+class Assistant:
+    """One userbot account with its own PyTgCalls instance"""
+
+    def __init__(self, index: int, app: Any, call_py: Any):
+        self.index = index
+        self.app = app
+        self.call_py = call_py
+        self.chats: Set[int] = set()
+        self.healthy = True
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and getattr(self.app, "is_connected", True) is not False
+
+    @property
+    def load(self) -> int:
+        """Number of voice chats currently assigned"""
+        return len(self.chats)
+
+    @property
+    def full(self) -> bool:
+        return 0 < config.ASSISTANT_MAX_CALLS <= self.load
+
+class AssistantPool:
+    """Assigns voice chats to assistants.
+
+    A chat keeps its assistant while it is active. New chats go to the
+    least-loaded available assistant, preferring the one that served the
+    chat before (it is already a member there) unless that one is
+    ASSISTANT_STICKY_SLACK calls busier than the least-loaded one.
+    """
+
+    # Remembered previous assistants, bounded so idle chats do not pile up
+    HOME_LIMIT = 10000
+
+    def __init__(self, assistants: List[Assistant]):
+        if not assistants:
+            raise ValueError("At least one assistant is required")
+        self.assistants = assistants
+        self.assignments: Dict[int, Assistant] = {}
+        self.home: "OrderedDict[int, int]" = OrderedDict()
+        self.moved = 0
+
+    @property
+    def primary(self) -> Assistant:
+        """Assistant that also receives commands"""
+        return self.assistants[0]
+
+    def current(self, chat_id: int) -> Optional[Assistant]:
+        """Assistant serving a chat, without assigning one"""
+        return self.assignments.get(chat_id)
+
+    def assign(self, chat_id: int) -> Assistant:
+        """Assistant for a chat, assigning the least-loaded one if needed"""
+        assistant = self.assignments.get(chat_id)
+        if assistant and assistant.available:
+            return assistant
+
+        candidates = [a for a in self.assistants if a.available and not a.full]
+        if not candidates:
+            # Everyone is full or down: fall back to any connected assistant
+            candidates = [a for a in self.assistants if a.available] or self.assistants
+        best = min(candidates, key=lambda a: (a.load, a.index))
+
+        home_index = self.home.get(chat_id)
+        if home_index is not None:
+            home = self.assistants[home_index]
+            if home in candidates and home.load - best.load < config.ASSISTANT_STICKY_SLACK:
+                best = home
+
+        self._bind(chat_id, best)
+        return best
+
+    def call_for(self, chat_id: int):
+        """PyTgCalls instance that should carry a chat's call"""
+        return self.assign(chat_id).call_py
+
+    def _bind(self, chat_id: int, assistant: Assistant):
+        previous = self.assignments.get(chat_id)
+        if previous is assistant:
+            return
+        if previous:
+            previous.chats.discard(chat_id)
+        assistant.chats.add(chat_id)
+        self.assignments[chat_id] = assistant
+        self.home[chat_id] = assistant.index
+        self.home.move_to_end(chat_id)
+        while len(self.home) > self.HOME_LIMIT:
+            self.home.popitem(last=False)
+
+    def release(self, chat_id: int):
+        """Free a chat's slot once it stops playing"""
+        assistant = self.assignments.pop(chat_id, None)
+        if assistant:
+            assistant.chats.discard(chat_id)
+
+    def mark_down(self, assistant: Assistant) -> List[int]:
+        """Take an assistant out of rotation and move its chats elsewhere"""
+        assistant.healthy = False
+        moved = list(assistant.chats)
+        for chat_id in moved:
+            self.home.pop(chat_id, None)
+            self.assign(chat_id)
+        self.moved += len(moved)
+        return moved
+
+    def mark_up(self, assistant: Assistant):
+        """Put a recovered assistant back into rotation"""
+        assistant.healthy = True
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """Load of every assistant"""
+        return [
+            {'index': a.index, 'calls': a.load, 'available': a.available}
+            for a in self.assistants
+        ]
@@ -0,0 +1,77 @@
+# In-memory banned user set for VCPlay Music Bot
+
+import bisect
+from array import array
+from typing import Dict, Iterable
+
+class BanList:
+    """Banned user ids, answering membership without any I/O.
+
+    Ids are kept in a sorted ``array('q')`` (8 bytes per id). In front of
+    it sits a fixed 64 KiB table of per-slot counters, so the usual
+    answer - not banned - costs one table lookup. Only ids whose slot is
+    taken go on to a binary search.
+    """
+
+    SLOTS = 1 << 16
+
+    def __init__(self):
+        self.ids = array('q')
+        self.slots = bytearray(self.SLOTS)
+        self.loaded = False
+        self.lookups = 0
+        self.filtered = 0
+
+    @classmethod
+    def _slot(cls, user_id: int) -> int:
+        # Fibonacci hashing spreads sequential ids over the table
+        return ((user_id * 0x9E3779B97F4A7C15) >> 32) & (cls.SLOTS - 1)
+
+    def load(self, user_ids: Iterable[int]):
+        """Replace the contents with a full list of banned ids"""
+        self.ids = array('q', sorted(set(user_ids)))
+        self.slots = bytearray(self.SLOTS)
+        for user_id in self.ids:
+            slot = self._slot(user_id)
+            if self.slots[slot] < 255:
+                self.slots[slot] += 1
+        self.loaded = True
+
+    def __contains__(self, user_id: int) -> bool:
+        self.lookups += 1
+        if not self.slots[self._slot(user_id)]:
+            self.filtered += 1
+            return False
+        i = bisect.bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def add(self, user_id: int):
+        i = bisect.bisect_left(self.ids, user_id)
+        if i < len(self.ids) and self.ids[i] == user_id:
+            return
+        self.ids.insert(i, user_id)
+        slot = self._slot(user_id)
+        if self.slots[slot] < 255:
+            self.slots[slot] += 1
+
+    def discard(self, user_id: int):
+        i = bisect.bisect_left(self.ids, user_id)
+        if i == len(self.ids) or self.ids[i] != user_id:
+            return
+        del self.ids[i]
+        slot = self._slot(user_id)
+        # A saturated counter no longer knows its exact count; it stays set
+        if 0 < self.slots[slot] < 255:
+            self.slots[slot] -= 1
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Size and filter effectiveness"""
+        return {
+            'banned': len(self.ids),
+            'bytes': self.ids.itemsize * len(self.ids) + len(self.slots),
+            'lookups': self.lookups,
+            'filtered': self.filtered,
+        }
@@ -0,0 +1,109 @@
+# In-memory TTL + LRU cache for VCPlay Music Bot
+
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries also expire after a TTL.
+
+    Values may be falsy (e.g. an empty result list for negative caching);
+    use ``get(key, default)`` or ``in`` to tell a miss from a cached value.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a live value and mark it recently used"""
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at <= time.time():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entry if full"""
+        self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry (used for invalidation)"""
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] > time.time()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def save(self, path: str):
+        """Write live entries to a JSON file (keys must be strings)"""
+        now = time.time()
+        data = [[key, expires_at, value] for key, (expires_at, value) in self._data.items() if expires_at > now]
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as cache_file:
+                json.dump(data, cache_file)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Cache save error {path}: {e}")
+
+    def load(self, path: str):
+        """Load entries written by save(), skipping expired ones"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as cache_file:
+                data = json.load(cache_file)
+        except Exception as e:
+            print(f"Cache load error {path}: {e}")
+            return
+
+        now = time.time()
+        for key, expires_at, value in data:
+            if expires_at > now:
+                self._data[key] = (expires_at, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
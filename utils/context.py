@@ -0,0 +1,82 @@
+# Per-command request context for VCPlay Music Bot
+
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+# Member statuses allowed to use admin-only commands (Pyrogram 1.x and 2.x names)
+_ADMIN_STATUSES = ("creator", "owner", "administrator")
+
+class RequestContext:
+    """User, ban and chat state of one incoming command, loaded once.
+
+    Built by the authorization decorator and handed to the handler as the
+    ``ctx`` keyword, so nothing downstream has to query them again.
+    """
+
+    __slots__ = ("client", "message", "user_id", "chat_id", "banned", "chat", "elapsed", "_is_admin")
+
+    # Totals over all built contexts
+    builds = 0
+    build_time = 0.0
+
+    def __init__(self, client: Any, message: Any, banned: bool, chat: Optional[Dict[str, Any]]):
+        self.client = client
+        self.message = message
+        self.user_id = message.from_user.id
+        self.chat_id = message.chat.id
+        self.banned = banned
+        self.chat = chat
+        self.elapsed = 0.0
+        self._is_admin: Optional[bool] = None
+
+    @classmethod
+    async def build(cls, client: Any, message: Any, bot) -> "RequestContext":
+        """Record the user's activity and load ban flag and chat document concurrently"""
+        started = time.perf_counter()
+        user = message.from_user
+        await bot.db.add_user(user.id, user.username or "", user.first_name or "")
+        banned, chat = await asyncio.gather(
+            bot.db.is_user_banned(user.id),
+            bot.db.get_chat(message.chat.id),
+        )
+        if chat is None:
+            # First command in this chat: create its document (buffered)
+            await bot.db.add_chat(
+                message.chat.id,
+                getattr(message.chat, "title", None) or "",
+                str(getattr(message.chat.type, "value", message.chat.type)),
+            )
+        ctx = cls(client, message, banned, chat)
+        ctx.elapsed = time.perf_counter() - started
+        cls.builds += 1
+        cls.build_time += ctx.elapsed
+        return ctx
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return (self.chat or {}).get("settings", {})
+
+    @property
+    def admin_only(self) -> bool:
+        """Whether the chat restricts commands to its admins"""
+        return bool(self.settings.get("admin_only"))
+
+    async def is_group_admin(self) -> bool:
+        """Whether the user administers the chat (looked up at most once)"""
+        if self._is_admin is None:
+            try:
+                member = await self.client.get_chat_member(self.chat_id, self.user_id)
+                status = getattr(member.status, "value", member.status)
+                self._is_admin = status in _ADMIN_STATUSES
+            except Exception:
+                self._is_admin = False
+        return self._is_admin
+
+    @classmethod
+    def get_stats(cls) -> Dict[str, float]:
+        """Average time spent loading request state"""
+        return {
+            'builds': cls.builds,
+            'average_ms': cls.build_time / cls.builds * 1000 if cls.builds else 0.0,
+        }
@@ -1,66 +1,90 @@
 # Database utilities for VCPlay Music Bot
 
-import motor.motor_asyncio
+import asyncio
 from typing import Dict, List, Optional, Any
 import config
 from datetime import datetime, timedelta
+from utils.banlist import BanList
+from utils.cache import TTLCache
+from utils.storage import StorageBackend, create_backend
+
+_MISSING = object()
 
 class Database:
-    def __init__(self):
-        if config.MONGO_DB_URI:
-            self.client = motor.motor_asyncio.AsyncIOMotorClient(config.MONGO_DB_URI)
-            self.db = self.client[config.DB_NAME]
-            self.users = self.db.users
-            self.chats = self.db.chats
-            self.stats = self.db.stats
-            self.playlists = self.db.playlists
-            self.settings = self.db.settings
-            self.connected = False
-        else:
-            self.client = None
-            self.connected = False
+    def __init__(self, backend: Optional[StorageBackend] = None):
+        # All banned ids, loaded on connect and kept current by ban_user,
+        # unban_user and a delta poll for bans made by other processes
+        self.bans = BanList()
+        self.ban_synced: Optional[datetime] = None
+        self.ban_sync_task: Optional[asyncio.Task] = None
+        
+        # Read-through cache for chat documents; writes below invalidate
+        # it, the TTL bounds staleness from writes made by other processes
+        self.chat_cache = TTLCache(maxsize=config.DB_CACHE_SIZE, ttl=config.DB_CACHE_TTL)
+        
+        # Write-behind buffers of user/chat activity, keyed by id so repeated
+        # updates coalesce into one upsert per flush
+        self.pending_users: Dict[int, Dict[str, Any]] = {}
+        self.pending_chats: Dict[int, Dict[str, Any]] = {}
+        self.pending_plays: Dict[int, List[int]] = {}
+        self.buffered_writes = 0
+        self.flushed_writes = 0
+        self.flushes = 0
+        self.flush_task: Optional[asyncio.Task] = None
+        # Early flush started when the buffers reach DB_WRITE_BATCH_SIZE
+        self.batch_flush_task: Optional[asyncio.Task] = None
+        self.reconcile_task: Optional[asyncio.Task] = None
+        
+        # Progress of the batched retention job (see cleanup_old_data)
+        self.retention: Dict[str, Any] = {"running": False, "runs": 0, "stats": 0, "users": 0, "rate": 0.0}
+        self.retention_task: Optional[asyncio.Task] = None
+        self.retention_loop_task: Optional[asyncio.Task] = None
+        
+        # MongoDB or SQLite, chosen by DB_BACKEND
+        self.backend = backend if backend is not None else create_backend()
+        self.connected = False
     
     async def connect(self):
         """Connect to database"""
-        if self.client:
+        if self.backend:
             try:
-                await self.client.admin.command('ping')
+                await self.backend.connect()
                 self.connected = True
-                print("✅ Connected to MongoDB successfully")
+                print(f"✅ Connected to {self.backend.name} successfully")
                 
-                # Create indexes
-                await self._create_indexes()
+                # Answer ban checks from memory
+                await self.load_bans()
                 
+                # Periodically write buffered activity and recount statistics
+                self.flush_task = asyncio.create_task(self._flush_loop())
+                self.reconcile_task = asyncio.create_task(self._reconcile_loop())
+                if config.BAN_SYNC_INTERVAL > 0:
+                    self.ban_sync_task = asyncio.create_task(self._ban_sync_loop())
+                if config.DB_RETENTION_INTERVAL > 0:
+                    self.retention_loop_task = asyncio.create_task(self._retention_loop())
+            
             except Exception as e:
-                print(f"❌ Failed to connect to MongoDB: {e}")
+                print(f"❌ Failed to connect to {self.backend.name}: {e}")
                 self.connected = False
         else:
-            print("⚠️ No MongoDB URI provided, running without database")
+            print("⚠️ No database configured, running without database")
     
     async def disconnect(self):
         """Disconnect from database"""
-        if self.client and self.connected:
-            self.client.close()
+        if self.backend and self.connected:
+            for task in (self.flush_task, self.reconcile_task, self.ban_sync_task,
+                         self.retention_task, self.retention_loop_task):
+                if task:
+                    task.cancel()
+            self.flush_task = self.reconcile_task = self.ban_sync_task = None
+            self.retention_task = self.retention_loop_task = None
+            # Write buffered activity before closing
+            if self.batch_flush_task:
+                await asyncio.gather(self.batch_flush_task, return_exceptions=True)
+            await self.flush()
+            await self.backend.close()
             self.connected = False
-            print("📤 Disconnected from MongoDB")
-    
-    async def _create_indexes(self):
-        """Create database indexes for better performance"""
-        try:
-            # User indexes
-            await self.users.create_index("user_id", unique=True)
-            
-            # Chat indexes
-            await self.chats.create_index("chat_id", unique=True)
-            
-            # Stats indexes
-            await self.stats.create_index([("chat_id", 1), ("date", -1)])
-            
-            # Playlist indexes
-            await self.playlists.create_index([("user_id", 1), ("name", 1)])
-            
-        except Exception as e:
-            print(f"Error creating indexes: {e}")
+            print(f"📤 Disconnected from {self.backend.name}")
     
     # User management
     async def add_user(self, user_id: int, username: str = "", first_name: str = ""):
@@ -68,24 +92,99 @@ class Database:
         if not self.connected:
             return
         
-        try:
-            user_data = {
-                "user_id": user_id,
-                "username": username,
-                "first_name": first_name,
-                "join_date": datetime.utcnow(),
-                "last_seen": datetime.utcnow(),
-                "commands_used": 0,
-                "is_banned": False
-            }
-            
-            await self.users.update_one(
-                {"user_id": user_id},
-                {"$setOnInsert": user_data, "$set": {"last_seen": datetime.utcnow()}},
-                upsert=True
-            )
-        except Exception as e:
-            print(f"Error adding user: {e}")
+        # Buffered: written by flush() with all other pending activity
+        self.pending_users[user_id] = {
+            "username": username,
+            "first_name": first_name,
+            "last_seen": datetime.utcnow(),
+        }
+        self._buffered()
+    
+    def _buffered(self):
+        self.buffered_writes += 1
+        if len(self.pending_users) + len(self.pending_chats) + len(self.pending_plays) < config.DB_WRITE_BATCH_SIZE:
+            return
+        # One early flush at a time; writes arriving meanwhile wait for the next
+        if self.batch_flush_task is None or self.batch_flush_task.done():
+            self.batch_flush_task = asyncio.create_task(self.flush())
+            self.batch_flush_task.add_done_callback(self._flush_done)
+    
+    @staticmethod
+    def _flush_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"Error flushing buffered activity: {task.exception()}")
+    
+    async def flush(self) -> int:
+        """Write all buffered activity with batched writes"""
+        if not self.connected or not (self.pending_users or self.pending_chats or self.pending_plays):
+            return 0
+        
+        users, self.pending_users = self.pending_users, {}
+        chats, self.pending_chats = self.pending_chats, {}
+        plays, self.pending_plays = self.pending_plays, {}
+        totals = {"total_users": 0, "total_chats": 0, "total_songs_played": 0}
+        written = 0
+        
+        if users:
+            try:
+                totals["total_users"] = await self.backend.upsert_users(users)
+                written += len(users)
+            except Exception as e:
+                print(f"Error flushing user activity: {e}")
+                # Upserts are idempotent: retry with the next flush unless
+                # newer activity replaced them
+                for user_id, user in users.items():
+                    self.pending_users.setdefault(user_id, user)
+        
+        if chats:
+            try:
+                totals["total_chats"] = await self.backend.upsert_chats(chats)
+                written += len(chats)
+                for chat_id in chats:
+                    self.chat_cache.pop(chat_id)
+            except Exception as e:
+                print(f"Error flushing chat activity: {e}")
+                for chat_id, chat in chats.items():
+                    self.pending_chats.setdefault(chat_id, chat)
+        
+        if plays:
+            try:
+                day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+                await self.backend.add_plays(plays, day)
+                totals["total_songs_played"] = sum(count for count, _ in plays.values())
+                written += len(plays)
+            except Exception as e:
+                # Not retried: increments may have been applied partially;
+                # reconcile_stats() corrects the totals
+                print(f"Error flushing play counts: {e}")
+        
+        await self._inc_global_stats(totals)
+        self.flushes += 1
+        self.flushed_writes += written
+        return written
+    
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(config.DB_WRITE_INTERVAL)
+            await self.flush()
+    
+    async def record_play(self, chat_id: int, duration: int = 0):
+        """Count a song that started playing, for chat and global statistics"""
+        if not self.connected:
+            return
+        
+        count, total = self.pending_plays.get(chat_id, (0, 0))
+        self.pending_plays[chat_id] = [count + 1, total + duration]
+        self._buffered()
+    
+    def get_write_stats(self) -> Dict[str, int]:
+        """Buffered vs. written activity updates"""
+        return {
+            'pending': len(self.pending_users) + len(self.pending_chats) + len(self.pending_plays),
+            'buffered': self.buffered_writes,
+            'written': self.flushed_writes,
+            'flushes': self.flushes,
+        }
     
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user data"""
@@ -93,10 +192,25 @@ class Database:
             return None
         
         try:
-            return await self.users.find_one({"user_id": user_id})
+            user = await self.backend.get_user(user_id)
         except Exception as e:
             print(f"Error getting user: {e}")
             return None
+        
+        # Activity not flushed yet
+        pending = self.pending_users.get(user_id)
+        if pending:
+            if user is None:
+                user = {
+                    "user_id": user_id,
+                    "username": pending["username"],
+                    "first_name": pending["first_name"],
+                    "join_date": pending["last_seen"],
+                    "commands_used": 0,
+                    "is_banned": False,
+                }
+            user["last_seen"] = pending["last_seen"]
+        return user
     
     async def ban_user(self, user_id: int):
         """Ban user"""
@@ -104,11 +218,8 @@ class Database:
             return
         
         try:
-            await self.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"is_banned": True, "ban_date": datetime.utcnow()}},
-                upsert=True
-            )
+            await self.backend.set_banned(user_id, True)
+            self.bans.add(user_id)
         except Exception as e:
             print(f"Error banning user: {e}")
     
@@ -118,10 +229,8 @@ class Database:
             return
         
         try:
-            await self.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"is_banned": False}, "$unset": {"ban_date": 1}}
-            )
+            await self.backend.set_banned(user_id, False)
+            self.bans.discard(user_id)
         except Exception as e:
             print(f"Error unbanning user: {e}")
     
@@ -130,102 +239,260 @@ class Database:
         if not self.connected:
             return False
         
+        if self.bans.loaded:
+            return user_id in self.bans
+        
+        # Ban list failed to load; the sync loop retries
         try:
-            user = await self.users.find_one({"user_id": user_id})
-            return user.get("is_banned", False) if user else False
+            return await self.backend.is_banned(user_id)
         except Exception as e:
             print(f"Error checking ban status: {e}")
             return False
     
+    async def load_bans(self):
+        """Load all banned ids into memory"""
+        try:
+            started = datetime.utcnow()
+            self.bans.load(await self.backend.banned_ids())
+            self.ban_synced = started
+        except Exception as e:
+            print(f"Error loading banned users: {e}")
+    
+    async def sync_bans(self) -> int:
+        """Apply bans and unbans made since the last sync (e.g. by other processes)"""
+        if not self.bans.loaded:
+            await self.load_bans()
+            return len(self.bans)
+        
+        # Overlap the window so writers with a slightly late clock are not
+        # missed; applying a change twice is harmless
+        since = self.ban_synced - timedelta(seconds=config.BAN_SYNC_INTERVAL)
+        started = datetime.utcnow()
+        changes = await self.backend.ban_changes(since)
+        for user_id, banned, _ in changes:
+            if banned:
+                self.bans.add(user_id)
+            else:
+                self.bans.discard(user_id)
+        self.ban_synced = started
+        return len(changes)
+    
+    async def _ban_sync_loop(self):
+        while True:
+            await asyncio.sleep(config.BAN_SYNC_INTERVAL)
+            try:
+                await self.sync_bans()
+            except Exception as e:
+                print(f"Error syncing banned users: {e}")
+    
     # Chat management
     async def add_chat(self, chat_id: int, chat_title: str = "", chat_type: str = ""):
         """Add or update chat in database"""
         if not self.connected:
             return
         
-        try:
-            chat_data = {
-                "chat_id": chat_id,
-                "chat_title": chat_title,
-                "chat_type": chat_type,
-                "join_date": datetime.utcnow(),
-                "last_active": datetime.utcnow(),
-                "settings": {
-                    "language": config.DEFAULT_LANGUAGE,
-                    "admin_only": False,
-                    "delete_messages": True,
-                    "welcome_message": True
-                },
-                "stats": {
-                    "songs_played": 0,
-                    "commands_used": 0,
-                    "total_duration": 0
-                }
-            }
-            
-            await self.chats.update_one(
-                {"chat_id": chat_id},
-                {"$setOnInsert": chat_data, "$set": {"last_active": datetime.utcnow()}},
-                upsert=True
-            )
-        except Exception as e:
-            print(f"Error adding chat: {e}")
+        # Buffered like add_user; the cached document is dropped on flush
+        self.pending_chats[chat_id] = {
+            "chat_title": chat_title,
+            "chat_type": chat_type,
+            "last_active": datetime.utcnow(),
+        }
+        self._buffered()
     
     async def get_chat(self, chat_id: int) -> Optional[Dict]:
         """Get chat data"""
         if not self.connected:
             return None
         
+        chat = self.chat_cache.get(chat_id, _MISSING)
+        if chat is not _MISSING:
+            return chat
+        
         try:
-            return await self.chats.find_one({"chat_id": chat_id})
+            chat = await self.backend.get_chat(chat_id)
+            self.chat_cache.set(chat_id, chat)
+            return chat
         except Exception as e:
             print(f"Error getting chat: {e}")
             return None
     
+    async def update_chat_settings(self, chat_id: int, settings: Dict[str, Any]):
+        """Update some of a chat's settings"""
+        if not self.connected:
+            return
+        
+        try:
+            await self.backend.update_chat_settings(chat_id, settings)
+            self.chat_cache.pop(chat_id)
+        except Exception as e:
+            print(f"Error updating chat settings: {e}")
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """In-memory ban list and chat cache statistics"""
+        return {
+            'bans': self.bans.get_stats(),
+            'chats': self.chat_cache.get_stats(),
+        }
+    
+    # Playlists
+    async def save_playlist(self, user_id: int, name: str, tracks: List[Dict[str, Any]]):
+        """Create or replace a user's saved playlist"""
+        if not self.connected:
+            return
+        
+        try:
+            await self.backend.save_playlist(user_id, name, tracks)
+        except Exception as e:
+            print(f"Error saving playlist: {e}")
+    
+    async def get_playlist(self, user_id: int, name: str) -> Optional[List[Dict[str, Any]]]:
+        """Tracks of a saved playlist"""
+        if not self.connected:
+            return None
+        
+        try:
+            return await self.backend.get_playlist(user_id, name)
+        except Exception as e:
+            print(f"Error getting playlist: {e}")
+            return None
+    
+    async def get_user_playlists(self, user_id: int) -> List[str]:
+        """Names of a user's saved playlists"""
+        if not self.connected:
+            return []
+        
+        try:
+            return await self.backend.list_playlists(user_id)
+        except Exception as e:
+            print(f"Error listing playlists: {e}")
+            return []
+    
+    async def delete_playlist(self, user_id: int, name: str) -> bool:
+        """Delete a saved playlist"""
+        if not self.connected:
+            return False
+        
+        try:
+            return await self.backend.delete_playlist(user_id, name)
+        except Exception as e:
+            print(f"Error deleting playlist: {e}")
+            return False
+    
+    # Queue persistence
+    async def save_queue_snapshot(self, snapshot: Dict[str, Any]):
+        """Mirror a queue snapshot, one document per chat"""
+        if not self.connected:
+            return
+        
+        try:
+            await self.backend.save_queue_snapshot(snapshot)
+        except Exception as e:
+            print(f"Error saving queue snapshot: {e}")
+    
+    async def get_queue_snapshot(self) -> Optional[Dict[str, Any]]:
+        """Load the mirrored queue snapshot"""
+        if not self.connected:
+            return None
+        
+        try:
+            return await self.backend.get_queue_snapshot()
+        except Exception as e:
+            print(f"Error loading queue snapshot: {e}")
+            return None
+    
+    async def _inc_global_stats(self, totals: Dict[str, int]):
+        """Apply changes to the materialized global counters"""
+        increments = {key: value for key, value in totals.items() if value}
+        if not increments:
+            return
+        try:
+            await self.backend.inc_counters(increments)
+        except Exception as e:
+            print(f"Error updating global stats: {e}")
+    
+    async def reconcile_stats(self) -> Dict[str, Any]:
+        """Recount the global counters from the stored data"""
+        stats = await self.backend.count_totals()
+        await self.backend.set_counters(stats)
+        return stats
+    
+    async def _reconcile_loop(self):
+        while True:
+            await asyncio.sleep(config.DB_STATS_RECONCILE_INTERVAL)
+            try:
+                await self.reconcile_stats()
+            except Exception as e:
+                print(f"Error reconciling stats: {e}")
+    
     async def get_global_stats(self) -> Dict[str, Any]:
-        """Get global bot statistics"""
+        """Get global bot statistics from the materialized counters"""
         if not self.connected:
             return {"total_users": 0, "total_chats": 0, "total_songs_played": 0}
         
         try:
-            # Count total users and chats
-            total_users = await self.users.count_documents({})
-            total_chats = await self.chats.count_documents({})
-            
-            # Get total songs played
-            pipeline = [
-                {"$group": {"_id": None, "total_songs": {"$sum": "$stats.songs_played"}}}
-            ]
-            result = await self.chats.aggregate(pipeline).to_list(1)
-            total_songs = result[0]["total_songs"] if result else 0
+            stats = await self.backend.get_counters()
+            if stats is None:
+                # First use: build the counters once
+                stats = await self.reconcile_stats()
             
             return {
-                "total_users": total_users,
-                "total_chats": total_chats,
-                "total_songs_played": total_songs,
+                "total_users": stats.get("total_users", 0),
+                "total_chats": stats.get("total_chats", 0),
+                "total_songs_played": stats.get("total_songs_played", 0),
             }
         except Exception as e:
             print(f"Error getting global stats: {e}")
             return {"total_users": 0, "total_chats": 0, "total_songs_played": 0}
     
-    async def cleanup_old_data(self, days: int = 30):
-        """Clean up old data from database"""
-        if not self.connected:
-            return
+    async def cleanup_old_data(self, days: Optional[int] = None) -> Dict[str, Any]:
+        """Start the retention job in the background unless it is running; returns its progress"""
+        if self.connected and not self.retention["running"]:
+            self.retention.update({"running": True, "stats": 0, "users": 0, "rate": 0.0})
+            self.retention_task = asyncio.create_task(self.run_retention(days))
+        return self.retention
+    
+    async def run_retention(self, days: Optional[int] = None) -> Dict[str, Any]:
+        """Delete old stats and inactive users in small batches with pauses in between"""
+        days = days if days is not None else config.DB_RETENTION_DAYS
+        cutoff_date = datetime.utcnow() - timedelta(days=days)
+        progress = self.retention
+        progress.update({"running": True, "stats": 0, "users": 0, "rate": 0.0})
+        started = asyncio.get_running_loop().time()
+        
+        # MongoDB expires old stats through a TTL index
+        tables = [("users", self.backend.delete_inactive_users)]
+        if not self.backend.expires_stats:
+            tables.insert(0, ("stats", self.backend.delete_old_stats))
         
         try:
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            
-            # Remove old stats
-            await self.stats.delete_many({"date": {"$lt": cutoff_date}})
-            
-            # Remove inactive users
-            await self.users.delete_many({
-                "last_seen": {"$lt": cutoff_date},
-                "commands_used": {"$lt": 5}
-            })
-            
-            print(f"Cleaned up data older than {days} days")
+            for table, delete in tables:
+                progress["table"] = table
+                while True:
+                    deleted = await delete(cutoff_date, config.DB_RETENTION_BATCH_SIZE)
+                    progress[table] += deleted
+                    if table == "users" and deleted:
+                        await self._inc_global_stats({"total_users": -deleted})
+                    elapsed = asyncio.get_running_loop().time() - started
+                    progress["rate"] = (progress["stats"] + progress["users"]) / elapsed if elapsed else 0.0
+                    if deleted < config.DB_RETENTION_BATCH_SIZE:
+                        break
+                    # Let live commands use the database between batches
+                    await asyncio.sleep(config.DB_RETENTION_PAUSE)
             
+            progress["runs"] += 1
+            progress["finished"] = datetime.utcnow()
+            print(f"Cleaned up data older than {days} days: {progress['stats']} stats, {progress['users']} users")
+        
         except Exception as e:
             print(f"Error during cleanup: {e}")
+        
+        finally:
+            progress["running"] = False
+            progress.pop("table", None)
+        
+        return progress
+    
+    async def _retention_loop(self):
+        while True:
+            await asyncio.sleep(config.DB_RETENTION_INTERVAL)
+            await self.cleanup_old_data()
@@ -1,9 +1,11 @@
 # Lightweight wrappers split out from helpers where needed
 
 import functools
+from typing import Optional
 from pyrogram import Client
 from pyrogram.types import Message
 import config
+from utils.context import RequestContext
 
 def admin_only(func):
     @functools.wraps(func)
@@ -14,43 +16,24 @@ def admin_only(func):
         return await func(client, message, bot, *args, **kwargs)
     return wrapper
 
-async def _is_group_admin(client: Client, chat_id: int, user_id: int) -> bool:
-    try:
-        member = await client.get_chat_member(chat_id, user_id)
-        return member.status in ("creator", "administrator")
-    except Exception:
-        return False
-
 def authorized_users_only(func):
+    """Check ban and admin-only settings, passing the loaded state on as ``ctx``"""
     @functools.wraps(func)
-    async def wrapper(client: Client, message: Message, bot, *args, **kwargs):
-        # Add user to database
-        await bot.db.add_user(
-            message.from_user.id,
-            message.from_user.username or "",
-            message.from_user.first_name or ""
-        )
+    async def wrapper(client: Client, message: Message, bot, *args, ctx: Optional[RequestContext] = None, **kwargs):
+        # Load user and chat state once for the whole request
+        if ctx is None:
+            ctx = await RequestContext.build(client, message, bot)
         
-        # Check if user is banned
-        if await bot.db.is_user_banned(message.from_user.id):
+        if ctx.banned:
             await message.reply_text("🚫 **You are banned from using this bot!**")
             return False
         
         # If chat is configured admin-only, require group admin
-        chat_id = message.chat.id
-        is_admin_only = False
-        try:
-            chat_doc = await bot.db.get_chat(chat_id)
-            is_admin_only = bool(chat_doc and chat_doc.get("settings", {}).get("admin_only"))
-        except Exception:
-            pass
-            
-        if is_admin_only:
-            if not await _is_group_admin(client, chat_id, message.from_user.id):
-                await message.reply_text("🔒 **This command is admin-only in this chat.**")
-                return False
+        if ctx.admin_only and not await ctx.is_group_admin():
+            await message.reply_text("🔒 **This command is admin-only in this chat.**")
+            return False
                 
-        return await func(client, message, bot, *args, **kwargs)
+        return await func(client, message, bot, *args, ctx=ctx, **kwargs)
     return wrapper
 
 def check_voice_chat(func):
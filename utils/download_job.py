@@ -0,0 +1,107 @@
+# Download job tracking for VCPlay Music Bot
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Dict, Optional
+import config
+
+class DownloadJob:
+    """A single download with its own progress state and final result.
+
+    yt-dlp calls ``progress_hook`` from a worker thread; updates are moved
+    onto the event loop and exposed through ``progress()``, which coalesces
+    them to at most one snapshot per ``min_interval`` seconds.
+    """
+
+    def __init__(self, url: str, profile: str, min_interval: Optional[float] = None):
+        self.url = url
+        self.profile = profile
+        self.min_interval = config.PROGRESS_UPDATE_INTERVAL if min_interval is None else min_interval
+        self.status = "queued"
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.speed = 0.0
+        self.eta = 0
+        self.filename: Optional[str] = None
+        self.cached = False
+
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, coro: Awaitable[Optional[str]]) -> "DownloadJob":
+        """Run the coroutine that performs the download"""
+        self._task = asyncio.ensure_future(coro)
+        self._task.add_done_callback(lambda _: self._changed.set())
+        return self
+
+    def done(self) -> bool:
+        return self._task is not None and self._task.done()
+
+    async def result(self) -> Optional[str]:
+        """Wait for the download and return the file path"""
+        return await self._task
+
+    def add_done_callback(self, callback):
+        self._task.add_done_callback(callback)
+
+    def cancel(self):
+        if self._task:
+            self._task.cancel()
+
+    def progress_hook(self, d: Dict[str, Any]):
+        """yt-dlp progress hook, safe to call from any thread"""
+        update = {
+            'status': d.get('status'),
+            'downloaded_bytes': d.get('downloaded_bytes') or 0,
+            'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+            'speed': d.get('speed') or 0.0,
+            'eta': d.get('eta') or 0,
+            'filename': d.get('filename'),
+        }
+        self._loop.call_soon_threadsafe(self._apply, update)
+
+    def _apply(self, update: Dict[str, Any]):
+        self.status = update['status'] or self.status
+        self.downloaded_bytes = update['downloaded_bytes'] or self.downloaded_bytes
+        self.total_bytes = update['total_bytes'] or self.total_bytes
+        self.speed = update['speed']
+        self.eta = update['eta']
+        if update['status'] == 'finished':
+            self.filename = update['filename']
+        self._changed.set()
+
+    @property
+    def percent(self) -> float:
+        if not self.total_bytes:
+            return 0.0
+        return min(100.0, self.downloaded_bytes * 100 / self.total_bytes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current progress as a plain dict"""
+        return {
+            'status': self.status,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'percent': self.percent,
+            'speed': self.speed,
+            'eta': self.eta,
+        }
+
+    async def progress(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield throttled progress snapshots until the job finishes"""
+        last_emit = 0.0
+        while not self.done():
+            await self._changed.wait()
+            self._changed.clear()
+            if self.done():
+                break
+
+            delay = self.min_interval - (self._loop.time() - last_emit)
+            if delay > 0:
+                # Let further updates pile up, only the latest one is reported
+                await asyncio.wait({self._task}, timeout=delay)
+                if self.done():
+                    break
+
+            last_emit = self._loop.time()
+            yield self.snapshot()
@@ -0,0 +1,135 @@
+# Download scheduler for VCPlay Music Bot
+
+import asyncio
+import functools
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+import config
+
+# Lower value runs first
+PRIORITY_PLAY = 0
+PRIORITY_PREFETCH = 1
+
+class _Job:
+    __slots__ = ("fn", "chat_id", "priority", "future", "enqueued")
+
+    def __init__(self, fn: Callable, chat_id: Optional[int], priority: int, future: asyncio.Future):
+        self.fn = fn
+        self.chat_id = chat_id
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+
+class DownloadScheduler:
+    """Bounded executor for blocking yt-dlp work.
+
+    Jobs are grouped into priority lanes ("play now" before prefetch and
+    playlist work). Inside a lane chats are served round-robin, so one chat
+    queuing a long playlist cannot starve the others.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or config.DOWNLOAD_WORKERS
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        self.lanes: Dict[int, "OrderedDict[Optional[int], Deque[_Job]]"] = {
+            PRIORITY_PLAY: OrderedDict(),
+            PRIORITY_PREFETCH: OrderedDict(),
+        }
+        self._runners: List[asyncio.Task] = []
+        self._condition: Optional[asyncio.Condition] = None
+
+        # Metrics
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _ensure_started(self):
+        if self._runners:
+            return
+        self._condition = asyncio.Condition()
+        self._runners = [asyncio.create_task(self._runner()) for _ in range(self.workers)]
+
+    async def submit(self, fn: Callable, *args, chat_id: Optional[int] = None,
+                     priority: int = PRIORITY_PLAY, **kwargs) -> Any:
+        """Run a blocking function on a download worker and return its result"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(functools.partial(fn, *args, **kwargs), chat_id, priority, future)
+
+        async with self._condition:
+            self.lanes[priority].setdefault(chat_id, deque()).append(job)
+            self._condition.notify()
+
+        # Cancelling the caller cancels the future; the runner skips it
+        return await future
+
+    def _pop_job(self) -> Optional[_Job]:
+        for priority in sorted(self.lanes):
+            lane = self.lanes[priority]
+            while lane:
+                chat_id, jobs = next(iter(lane.items()))
+                job = jobs.popleft()
+                if jobs:
+                    # Round-robin: chat goes to the back of its lane
+                    lane.move_to_end(chat_id)
+                else:
+                    del lane[chat_id]
+
+                if not job.future.done():
+                    return job
+        return None
+
+    async def _runner(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._condition:
+                job = self._pop_job()
+                while job is None:
+                    await self._condition.wait()
+                    job = self._pop_job()
+
+            wait = time.monotonic() - job.enqueued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self.executor, job.fn)
+                if not job.future.done():
+                    job.future.set_result(result)
+                self.completed += 1
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                self.failed += 1
+            finally:
+                self.running -= 1
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        """Number of jobs waiting for a worker"""
+        lanes = [self.lanes[priority]] if priority is not None else self.lanes.values()
+        return sum(len(jobs) for lane in lanes for jobs in lane.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get scheduler metrics"""
+        started = self.completed + self.failed + self.running
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'queued_play': self.queue_depth(PRIORITY_PLAY),
+            'queued_prefetch': self.queue_depth(PRIORITY_PREFETCH),
+            'completed': self.completed,
+            'failed': self.failed,
+            'average_wait': self.total_wait / started if started else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+    def shutdown(self):
+        """Stop runners and the worker threads"""
+        for runner in self._runners:
+            runner.cancel()
+        self._runners = []
+        self.executor.shutdown(wait=False, cancel_futures=True)
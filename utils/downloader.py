@@ -1,14 +1,38 @@
 # YouTube downloader utility for VCPlay Music Bot
 
 import asyncio
+import itertools
 import os
 import re
-from typing import List, Dict, Optional
-import yt_dlp
+from contextlib import ExitStack
+from typing import AsyncIterator, Iterator, List, Dict, Optional
 import config
+from utils.media_cache import MediaCache
+from utils.download_scheduler import DownloadScheduler, PRIORITY_PLAY, PRIORITY_PREFETCH
+from utils.download_job import DownloadJob
+from utils.cache import TTLCache
+from utils.ydl_pool import YDLPool
+from utils.transcoder import AudioTranscoder
+from utils.loudness import LoudnessAnalyzer
+
+YOUTUBE_REGEX = re.compile(
+    r'^(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
+    r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
+)
 
 class YouTubeDownloader:
     def __init__(self):
+        self.cache = MediaCache()
+        self.scheduler = DownloadScheduler()
+        self.transcoder = AudioTranscoder(self.cache)
+        self.loudness = LoudnessAnalyzer(self.cache, self._cache_profiles('audio'))
+        self._background: Dict[str, DownloadJob] = {}
+        
+        self.search_cache = TTLCache(config.SEARCH_CACHE_SIZE, config.SEARCH_CACHE_TTL)
+        self.search_cache_path = config.SEARCH_CACHE_PATH
+        if config.SEARCH_CACHE_PERSIST:
+            self.search_cache.load(self.search_cache_path)
+        
         self.ydl_opts = {
             'format': 'best[height<=720]/best',
             'extractaudio': True,
@@ -29,29 +53,85 @@ class YouTubeDownloader:
             'extractaudio': True,
             'audioformat': 'mp3',
             'audioquality': '192K',
+            'outtmpl': self.cache.outtmpl('audio'),
         }
         
         self.video_opts = {
             **self.ydl_opts,
             'format': 'best[height<=720]/best',
             'extractaudio': False,
+            'outtmpl': self.cache.outtmpl('video'),
         }
+        
+        self.playlist_opts = {
+            **self.ydl_opts,
+            'extract_flat': True,
+            'dump_single_json': True,
+        }
+        
+        self.pool = YDLPool({
+            'search-audio': self.audio_opts,
+            'search-video': self.video_opts,
+            'audio': self.audio_opts,
+            'video': self.video_opts,
+            'playlist': self.playlist_opts,
+        })
+    
+    def _cache_profiles(self, profile: str) -> List[str]:
+        """Cache profiles to look up, most playback-ready first"""
+        if profile == 'audio':
+            return [self.transcoder.profile, 'audio']
+        return [profile]
+    
+    async def warmup(self):
+        """Pre-create pooled YoutubeDL instances"""
+        try:
+            await self.scheduler.submit(self.pool.warmup)
+        except Exception as e:
+            print(f"Downloader warmup error: {e}")
+    
+    def _extract(self, profile: str, url: str, download: bool = False,
+                 progress_hooks: Optional[List] = None, overrides: Optional[Dict] = None) -> Optional[Dict]:
+        """Run extract_info on a pooled instance (called on a download worker)"""
+        with self.pool.checkout(profile, progress_hooks, overrides) as ydl:
+            return ydl.extract_info(url, download=download)
+    
+    def _open_playlist(self, url: str, stack: ExitStack) -> Optional[Dict]:
+        """Extract a playlist without resolving its entries (called on a download worker).
+        
+        The pooled instance stays checked out on stack while the lazy
+        entries fetch their continuation pages.
+        """
+        ydl = stack.enter_context(self.pool.checkout('playlist'))
+        info = ydl.extract_info(url, download=False, process=False)
+        # Watch URLs with a list= parameter point at the playlist extractor
+        while info and info.get('_type') in ('url', 'url_transparent'):
+            info = ydl.extract_info(info['url'], download=False, ie_key=info.get('ie_key'), process=False)
+        return info
     
-    async def search_youtube(self, query: str, video: bool = False, limit: int = 1) -> List[Dict]:
+    @staticmethod
+    def _take(entries: Iterator, count: int) -> List[Dict]:
+        """Read the next entries of a lazy playlist (called on a download worker)"""
+        return list(itertools.islice(entries, count))
+    
+    async def search_youtube(self, query: str, video: bool = False, limit: int = 1,
+                             chat_id: Optional[int] = None) -> List[Dict]:
         """Search YouTube for videos/audio"""
+        cache_key = f"{'video' if video else 'audio'}:{limit}:{self.normalize_query(query)}"
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            return [dict(result) for result in cached]
+        
         try:
             search_query = f"ytsearch{limit}:{query}"
             
-            ydl_opts = self.video_opts if video else self.audio_opts
-            ydl_opts['quiet'] = True
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                search_results = await asyncio.get_event_loop().run_in_executor(
-                    None, 
-                    lambda: ydl.extract_info(search_query, download=False)
-                )
+            search_results = await self.scheduler.submit(
+                self._extract, 'search-video' if video else 'search-audio', search_query,
+                chat_id=chat_id, priority=PRIORITY_PLAY
+            )
             
             if not search_results or 'entries' not in search_results:
+                self.search_cache.set(cache_key, [], ttl=config.SEARCH_CACHE_NEGATIVE_TTL)
                 return []
             
             results = []
@@ -68,12 +148,26 @@ class YouTubeDownloader:
                     }
                     results.append(result)
             
-            return results
+            if results:
+                self.search_cache.set(cache_key, results)
+            else:
+                self.search_cache.set(cache_key, [], ttl=config.SEARCH_CACHE_NEGATIVE_TTL)
+            return [dict(result) for result in results]
         
         except Exception as e:
             print(f"Search error: {e}")
             return []
     
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Normalize search text so trivial variations share a cache entry"""
+        return " ".join(query.casefold().split())
+    
+    def flush_search_cache(self):
+        """Persist the search cache if enabled"""
+        if config.SEARCH_CACHE_PERSIST:
+            self.search_cache.save(self.search_cache_path)
+    
     def _get_best_thumbnail(self, thumbnails: List[Dict]) -> str:
         """Get the best quality thumbnail URL"""
         if not thumbnails:
@@ -88,79 +182,159 @@ class YouTubeDownloader:
         
         return sorted_thumbs[0].get('url', config.THUMBNAIL_URL)
     
-    async def download_audio(self, url: str) -> Optional[str]:
+    def get_video_id(self, url: str) -> Optional[str]:
+        """Extract the YouTube video id from a URL"""
+        match = YOUTUBE_REGEX.match(url)
+        return match.group(6) if match else None
+    
+    def start_download(self, url: str, video: bool = False, chat_id: Optional[int] = None,
+                       priority: int = PRIORITY_PLAY, check_cache: bool = True) -> DownloadJob:
+        """Start a download and return its job (progress stream + result)"""
+        profile = 'video' if video else 'audio'
+        job = DownloadJob(url, profile)
+        return job.start(self._download(job, check_cache, chat_id, priority))
+    
+    async def download_audio(self, url: str, chat_id: Optional[int] = None,
+                             priority: int = PRIORITY_PLAY) -> Optional[str]:
         """Download audio from YouTube URL"""
+        return await self.start_download(url, chat_id=chat_id, priority=priority).result()
+    
+    async def download_video(self, url: str, chat_id: Optional[int] = None,
+                             priority: int = PRIORITY_PLAY) -> Optional[str]:
+        """Download video from YouTube URL"""
+        return await self.start_download(url, video=True, chat_id=chat_id, priority=priority).result()
+    
+    async def get_audio_source(self, url: str, chat_id: Optional[int] = None) -> Optional[Dict]:
+        """Get something AudioPiped can play right away.
+        
+        Cached files are returned directly. Otherwise the direct media URL is
+        resolved and returned while the full file is downloaded into the cache
+        in the background.
+        """
+        video_id = self.get_video_id(url)
+        if video_id:
+            cached = self.cache.get_any(video_id, self._cache_profiles('audio'))
+            if cached:
+                return {'path': cached, 'headers': None, 'stream': False}
+        
+        stream = await self.resolve_stream(url, chat_id=chat_id)
+        if not stream:
+            # Fall back to a blocking download
+            path = await self.start_download(url, chat_id=chat_id, check_cache=False).result()
+            return {'path': path, 'headers': None, 'stream': False} if path else None
+        
+        self.download_in_background(url, stream['id'] or video_id, chat_id=chat_id)
+        return {'path': stream['url'], 'headers': stream['headers'], 'stream': True}
+    
+    async def resolve_stream(self, url: str, video: bool = False,
+                             chat_id: Optional[int] = None) -> Optional[Dict]:
+        """Resolve the direct media URL without downloading"""
         try:
-            filename = None
-            
-            def progress_hook(d):
-                nonlocal filename
-                if d['status'] == 'finished':
-                    filename = d['filename']
+            info = await self.scheduler.submit(
+                self._extract, 'video' if video else 'audio', url,
+                chat_id=chat_id, priority=PRIORITY_PLAY
+            )
             
-            self.audio_opts['progress_hooks'] = [progress_hook]
-            
-            with yt_dlp.YoutubeDL(self.audio_opts) as ydl:
-                await asyncio.get_event_loop().run_in_executor(
-                    None, 
-                    lambda: ydl.download([url])
-                )
+            if not info or not info.get('url'):
+                return None
             
-            return filename
+            return {
+                'url': info['url'],
+                'headers': info.get('http_headers'),
+                'id': info.get('id'),
+                'title': info.get('title', 'Unknown'),
+                'duration': info.get('duration', 0),
+            }
         
         except Exception as e:
-            print(f"Audio download error: {e}")
+            print(f"Stream resolve error: {e}")
             return None
     
-    async def download_video(self, url: str) -> Optional[str]:
-        """Download video from YouTube URL"""
+    def download_in_background(self, url: str, video_id: Optional[str] = None, video: bool = False,
+                               chat_id: Optional[int] = None) -> DownloadJob:
+        """Fill the media cache without blocking playback"""
+        key = self.cache.make_key(video_id or url, 'video' if video else 'audio')
+        if key in self._background:
+            return self._background[key]
+        
+        job = self.start_download(
+            url, video=video, chat_id=chat_id, priority=PRIORITY_PREFETCH, check_cache=False
+        )
+        job.add_done_callback(lambda _: self._background.pop(key, None))
+        self._background[key] = job
+        return job
+    
+    async def _download(self, job: DownloadJob, check_cache: bool = True,
+                        chat_id: Optional[int] = None, priority: int = PRIORITY_PLAY) -> Optional[str]:
+        """Serve media from the cache or download it into the cache"""
+        profile = job.profile
         try:
-            filename = None
+            video_id = self.get_video_id(job.url)
+            if video_id and check_cache:
+                cached = self.cache.get_any(video_id, self._cache_profiles(profile))
+                if cached:
+                    job.cached = True
+                    job.status = 'finished'
+                    return cached
             
-            def progress_hook(d):
-                nonlocal filename
-                if d['status'] == 'finished':
-                    filename = d['filename']
+            # Hooks are bound to the checked-out instance only, never shared
+            info = await self.scheduler.submit(
+                self._extract, profile, job.url, download=True,
+                progress_hooks=[job.progress_hook],
+                chat_id=chat_id, priority=priority
+            )
             
-            self.video_opts['progress_hooks'] = [progress_hook]
-            
-            with yt_dlp.YoutubeDL(self.video_opts) as ydl:
-                await asyncio.get_event_loop().run_in_executor(
-                    None, 
-                    lambda: ydl.download([url])
-                )
+            # Hook callbacks were queued on the loop before the result, so this is set
+            filename = job.filename
+            if not filename or not info:
+                return filename
             
-            return filename
+            video_id = info.get('id') or video_id
+            path = self.cache.put(
+                video_id,
+                profile,
+                filename,
+                title=info.get('title', 'Unknown'),
+                duration=info.get('duration', 0),
+            )
+            if profile == 'audio':
+                self.loudness.schedule(video_id, path)
+                self.transcoder.schedule(video_id, path)
+            return path
         
         except Exception as e:
-            print(f"Video download error: {e}")
+            job.status = 'error'
+            print(f"{profile.capitalize()} download error: {e}")
             return None
     
-    async def get_playlist(self, url: str) -> Optional[Dict]:
+    @staticmethod
+    def _playlist_entry(entry: Dict) -> Dict:
+        """Convert a flat playlist entry into our entry format"""
+        url = entry.get('url') or ''
+        if not url.startswith('http') and entry.get('id'):
+            url = f"https://www.youtube.com/watch?v={entry['id']}"
+        return {
+            'title': entry.get('title', 'Unknown'),
+            'duration': entry.get('duration') or 0,
+            'webpage_url': url,
+            'id': entry.get('id', ''),
+            'thumbnail': config.THUMBNAIL_URL
+        }
+    
+    async def get_playlist(self, url: str, chat_id: Optional[int] = None) -> Optional[Dict]:
         """Get playlist information and entries"""
         try:
-            playlist_opts = {
-                **self.ydl_opts,
-                'extract_flat': True,
-                'dump_single_json': True,
-            }
-            
-            with yt_dlp.YoutubeDL(playlist_opts) as ydl:
-                playlist_info = await asyncio.get_event_loop().run_in_executor(
-                    None, 
-                    lambda: ydl.extract_info(url, download=False)
-                )
+            playlist_info = await self.scheduler.submit(
+                self._extract, 'playlist', url,
+                overrides={'playlist_items': f"1-{config.PLAYLIST_LIMIT}", 'lazy_playlist': True},
+                chat_id=chat_id, priority=PRIORITY_PREFETCH
+            )
             
             if playlist_info and 'entries' in playlist_info:
-                entries = []
-                for entry in playlist_info['entries'][:config.PLAYLIST_LIMIT]:
-                    if entry:
-                        entries.append({
-                            'title': entry.get('title', 'Unknown'),
-                            'duration': entry.get('duration', 0),
-                            'webpage_url': entry.get('url', ''),
-                            'thumbnail': config.THUMBNAIL_URL
-                        })
+                entries = [
+                    self._playlist_entry(entry)
+                    for entry in list(playlist_info['entries'])[:config.PLAYLIST_LIMIT] if entry
+                ]
                 
                 return {
                     'title': playlist_info.get('title', 'Unknown Playlist'),
@@ -175,13 +349,59 @@ class YouTubeDownloader:
             print(f"Playlist extraction error: {e}")
             return None
     
+    async def iter_playlist(self, url: str, chat_id: Optional[int] = None,
+                            page_size: Optional[int] = None,
+                            max_entries: Optional[int] = None) -> AsyncIterator[Dict]:
+        """Yield a playlist page by page so playback can start on the first page.
+        
+        Each page is a dict with the playlist 'title', 'uploader' and up to
+        page_size 'entries'. The playlist is extracted once and its entries
+        are read lazily, so only one page is held in memory at a time.
+        """
+        page_size = page_size or config.PLAYLIST_PAGE_SIZE
+        remaining = max_entries or config.PLAYLIST_MAX_TRACKS
+        # The first page is what the user is waiting for
+        priority = PRIORITY_PLAY
+        stack = ExitStack()
+        
+        try:
+            try:
+                info = await self.scheduler.submit(
+                    self._open_playlist, url, stack, chat_id=chat_id, priority=priority
+                )
+            except Exception as e:
+                print(f"Playlist error: {e}")
+                return
+            if not info:
+                return
+            entries = iter(info.get('entries') or [])
+            
+            while remaining > 0:
+                try:
+                    raw_entries = await self.scheduler.submit(
+                        self._take, entries, min(page_size, remaining),
+                        chat_id=chat_id, priority=priority
+                    )
+                except Exception as e:
+                    print(f"Playlist page error: {e}")
+                    return
+                if not raw_entries:
+                    return
+                
+                yield {
+                    'title': info.get('title', 'Unknown Playlist'),
+                    'uploader': info.get('uploader', 'Unknown'),
+                    'entries': [self._playlist_entry(entry) for entry in raw_entries if entry],
+                }
+                remaining -= len(raw_entries)
+                priority = PRIORITY_PREFETCH
+        finally:
+            # Return the pooled instance
+            stack.close()
+    
     def is_youtube_url(self, url: str) -> bool:
         """Check if URL is a valid YouTube URL"""
-        youtube_regex = re.compile(
-            r'^(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/'
-            r'(watch\?v=|embed/|v/|.+\?v=)?([^&=%\?]{11})'
-        )
-        return bool(youtube_regex.match(url))
+        return bool(YOUTUBE_REGEX.match(url))
     
     async def cleanup_downloads(self):
         """Clean up old downloaded files"""
@@ -0,0 +1,134 @@
+# Loudness analysis for cached tracks in VCPlay Music Bot
+
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional
+import config
+
+class LoudnessAnalyzer:
+    """Measures integrated loudness and true peak of cached tracks once.
+
+    Results are stored in the media cache metadata so playback can apply a
+    static gain instead of running an analysis filter on every stream.
+    """
+
+    def __init__(self, cache, profiles: List[str]):
+        self.cache = cache
+        self.profiles = profiles
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.failed = 0
+        self.backfill_task: Optional[asyncio.Task] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def get_loudness(self, video_id: Optional[str]) -> Optional[Dict]:
+        """Stored measurement for a video, from any cached profile"""
+        if not video_id:
+            return None
+        for profile in self.profiles:
+            entry = self.cache.get_entry(video_id, profile)
+            if entry and entry.get("loudness"):
+                return entry["loudness"]
+        return None
+
+    def gain_for(self, video_id: Optional[str]) -> Optional[float]:
+        """Static gain in dB that brings a track to LOUDNESS_TARGET without clipping"""
+        if not config.LOUDNESS_NORMALIZATION:
+            return None
+        loudness = self.get_loudness(video_id)
+        if not loudness:
+            return None
+
+        gain = config.LOUDNESS_TARGET - loudness["integrated"]
+        # Keep true peak under -1 dBTP
+        gain = min(gain, -1.0 - loudness["true_peak"])
+        return round(gain, 2)
+
+    def schedule(self, video_id: str, path: str) -> Optional[asyncio.Task]:
+        """Analyze a freshly cached file in the background"""
+        if not config.LOUDNESS_NORMALIZATION or video_id in self.pending or self.get_loudness(video_id):
+            return self.pending.get(video_id)
+
+        task = asyncio.create_task(self.analyze(video_id, path))
+        task.add_done_callback(lambda _: self.pending.pop(video_id, None))
+        self.pending[video_id] = task
+        return task
+
+    async def analyze(self, video_id: str, path: str) -> Optional[Dict]:
+        """Run the ffmpeg loudnorm measurement pass and store the result"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(config.LOUDNESS_WORKERS)
+
+        async with self._semaphore:
+            if not os.path.isfile(path):
+                # The source may have been replaced by its pre-encoded copy meanwhile
+                entries = [self.cache.get_entry(video_id, profile) for profile in self.profiles]
+                path = next((entry["path"] for entry in entries if entry), path)
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "ffmpeg", "-hide_banner", "-nostats",
+                    "-i", path,
+                    "-vn", "-af", "loudnorm=print_format=json",
+                    "-f", "null", "-",
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await process.communicate()
+                result = self.parse_loudnorm(stderr.decode(errors="ignore"))
+            except Exception as e:
+                print(f"Loudness analysis error {video_id}: {e}")
+                result = None
+
+        if not result:
+            self.failed += 1
+            return None
+
+        for profile in self.profiles:
+            self.cache.update_meta(video_id, profile, loudness=result)
+        self.completed += 1
+        return result
+
+    @staticmethod
+    def parse_loudnorm(output: str) -> Optional[Dict]:
+        """Extract the measurement from loudnorm's JSON summary"""
+        start = output.rfind("{")
+        end = output.rfind("}")
+        if start == -1 or end < start:
+            return None
+        try:
+            data = json.loads(output[start:end + 1])
+            integrated = float(data["input_i"])
+            true_peak = float(data["input_tp"])
+        except (ValueError, KeyError):
+            return None
+        # Digital silence reports -inf
+        if integrated == float("-inf"):
+            return None
+        return {"integrated": integrated, "true_peak": true_peak}
+
+    async def backfill(self) -> int:
+        """Analyze every cached track that has no measurement yet"""
+        missing: Dict[str, str] = {}
+        for entry in list(self.cache.entries.values()):
+            if entry.get("profile") in self.profiles and not self.get_loudness(entry["video_id"]):
+                missing.setdefault(entry["video_id"], entry["path"])
+
+        # Through schedule() so tracks played meanwhile are not analyzed twice
+        tasks = [self.schedule(video_id, path) for video_id, path in missing.items()]
+        results = await asyncio.gather(*(task for task in tasks if task), return_exceptions=True)
+        return sum(1 for result in results if isinstance(result, dict))
+
+    def start_backfill(self) -> asyncio.Task:
+        """Run backfill() in the background, reusing a run that is still going"""
+        if self.backfill_task is None or self.backfill_task.done():
+            self.backfill_task = asyncio.create_task(self.backfill())
+        return self.backfill_task
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get analysis statistics"""
+        return {
+            'pending': len(self.pending),
+            'completed': self.completed,
+            'failed': self.failed,
+        }
@@ -0,0 +1,198 @@
+# Persistent media cache for VCPlay Music Bot
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any
+import config
+
+class MediaCache:
+    """On-disk cache of downloaded media keyed by video id and format profile.
+
+    Files live under ``<cache_dir>/<profile>/<video_id>.<ext>`` and are tracked
+    in an ``index.json`` file. Entries are kept in LRU order and the least
+    recently used ones are evicted once the total size exceeds ``max_size``.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_size: Optional[int] = None):
+        self.cache_dir = cache_dir or config.MEDIA_CACHE_DIR
+        # max_size is in bytes, config value is in megabytes
+        self.max_size = max_size if max_size is not None else config.MEDIA_CACHE_MAX_SIZE * 1024 * 1024
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(video_id: str, profile: str) -> str:
+        """Build the cache key for a video id and format profile"""
+        return f"{profile}:{video_id}"
+
+    def outtmpl(self, profile: str) -> str:
+        """yt-dlp output template that writes straight into the cache"""
+        return os.path.join(self.cache_dir, profile, "%(id)s.%(ext)s")
+
+    def _load_index(self):
+        """Load the index file, dropping entries whose file is gone"""
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, "r") as index_file:
+                data = json.load(index_file)
+        except Exception as e:
+            print(f"Media cache index error: {e}")
+            return
+
+        # Oldest access first so the OrderedDict head is the LRU victim
+        for key, entry in sorted(data.items(), key=lambda item: item[1].get("last_access", 0)):
+            if os.path.isfile(entry.get("path", "")):
+                self.entries[key] = entry
+                self.total_size += entry.get("size", 0)
+            else:
+                self._dirty = True
+
+    def _save_index(self):
+        """Atomically write the index file"""
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, "w") as index_file:
+                json.dump(self.entries, index_file)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = False
+        except Exception as e:
+            print(f"Media cache save error: {e}")
+
+    def flush(self):
+        """Persist pending index changes (last access times)"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def get(self, video_id: str, profile: str) -> Optional[str]:
+        """Return cached file path or None, updating LRU order and counters"""
+        return self.get_any(video_id, [profile])
+
+    def get_any(self, video_id: str, profiles: List[str]) -> Optional[str]:
+        """Return the first cached file among profiles (in preference order).
+
+        Counts a single hit or miss for the whole lookup.
+        """
+        with self._lock:
+            for profile in profiles:
+                key = self.make_key(video_id, profile)
+                entry = self.entries.get(key)
+                if not entry:
+                    continue
+                if not os.path.isfile(entry["path"]):
+                    self._drop(key)
+                    continue
+
+                self.hits += 1
+                entry["last_access"] = time.time()
+                self.entries.move_to_end(key)
+                self._dirty = True
+                return entry["path"]
+
+            self.misses += 1
+            return None
+
+    def get_entry(self, video_id: str, profile: str) -> Optional[Dict[str, Any]]:
+        """Return the raw index entry without touching counters"""
+        return self.entries.get(self.make_key(video_id, profile))
+
+    def put(self, video_id: str, profile: str, path: str, **meta) -> str:
+        """Register a downloaded file and evict old entries if over the size cap"""
+        key = self.make_key(video_id, profile)
+        size = os.path.getsize(path)
+        now = time.time()
+
+        with self._lock:
+            if key in self.entries:
+                old = self.entries.pop(key)
+                self.total_size -= old.get("size", 0)
+                if old["path"] != path:
+                    self._remove_file(old["path"])
+
+            self.entries[key] = {
+                "video_id": video_id,
+                "profile": profile,
+                "path": path,
+                "size": size,
+                "created": now,
+                "last_access": now,
+                **meta,
+            }
+            self.total_size += size
+            self._evict(keep=key)
+            self._save_index()
+
+        return path
+
+    def update_meta(self, video_id: str, profile: str, **meta) -> bool:
+        """Attach extra metadata to an existing entry"""
+        key = self.make_key(video_id, profile)
+        with self._lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return False
+            entry.update(meta)
+            self._save_index()
+            return True
+
+    def remove(self, video_id: str, profile: str):
+        """Remove an entry and its file"""
+        with self._lock:
+            self._drop(self.make_key(video_id, profile), delete_file=True)
+            self._save_index()
+
+    def _drop(self, key: str, delete_file: bool = False):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.total_size -= entry.get("size", 0)
+            self._dirty = True
+            if delete_file:
+                self._remove_file(entry["path"])
+
+    def _evict(self, keep: Optional[str] = None):
+        """Evict least recently used entries until under the size cap"""
+        if self.max_size <= 0:
+            return
+
+        for key in list(self.entries.keys()):
+            if self.total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            self._drop(key, delete_file=True)
+            self.evictions += 1
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"Media cache delete error {path}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'total_size': self.total_size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
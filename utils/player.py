@@ -0,0 +1,117 @@
+# Per-chat playback state for VCPlay Music Bot
+
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+IDLE = "idle"
+LOADING = "loading"
+PLAYING = "playing"
+PAUSED = "paused"
+ENDING = "ending"
+
+# Allowed state changes; anything else is rejected by ChatPlayer.transition
+TRANSITIONS: Dict[str, set] = {
+    IDLE: {LOADING},
+    LOADING: {LOADING, PLAYING, IDLE},
+    PLAYING: {PAUSED, ENDING, LOADING, IDLE},
+    PAUSED: {PLAYING, ENDING, LOADING, IDLE},
+    ENDING: {LOADING, IDLE},
+}
+
+class ChatPlayer:
+    """Playback state of one voice chat.
+
+    Transitions are plain synchronous calls made on the event loop, so a
+    check-and-set such as ``begin()`` cannot interleave with another
+    handler and needs no lock.
+    """
+
+    __slots__ = ("chat_id", "state", "track", "since", "_on_change")
+
+    def __init__(self, chat_id: int, on_change: Optional[Callable[["ChatPlayer"], None]] = None):
+        self.chat_id = chat_id
+        self.state = IDLE
+        self.track = None
+        self.since = time.time()
+        self._on_change = on_change
+
+    def transition(self, state: str, track: Any = None) -> bool:
+        """Move to a new state if allowed, returning whether it happened"""
+        if state not in TRANSITIONS[self.state]:
+            return False
+        self.state = state
+        self.since = time.time()
+        if track is not None:
+            self.track = track
+        if state == IDLE:
+            self.track = None
+        if self._on_change:
+            self._on_change(self)
+        return True
+
+    def begin(self) -> bool:
+        """Claim an idle chat for a new stream (idle -> loading)"""
+        return self.state == IDLE and self.transition(LOADING)
+
+    def reset(self):
+        """Return to idle from any state"""
+        if self.state != IDLE:
+            self.transition(IDLE)
+
+    @property
+    def is_active(self) -> bool:
+        return self.state != IDLE
+
+    @property
+    def is_playing(self) -> bool:
+        return self.state == PLAYING
+
+    @property
+    def is_paused(self) -> bool:
+        return self.state == PAUSED
+
+class PlayerRegistry:
+    """Owns the ChatPlayer of every active chat; idle players are dropped"""
+
+    def __init__(self):
+        self.players: Dict[int, ChatPlayer] = {}
+        self.listeners: List[Callable[[int, str], None]] = []
+
+    def add_listener(self, callback: Callable[[int, str], None]):
+        """Register a callback invoked as callback(chat_id, state) on every transition"""
+        self.listeners.append(callback)
+
+    def get(self, chat_id: int) -> ChatPlayer:
+        """Get the player of a chat, creating an idle one if needed"""
+        player = self.players.get(chat_id)
+        if player is None:
+            player = ChatPlayer(chat_id, on_change=self._on_change)
+        return player
+
+    def state(self, chat_id: int) -> str:
+        """Current state of a chat without creating a player"""
+        player = self.players.get(chat_id)
+        return player.state if player else IDLE
+
+    def _on_change(self, player: ChatPlayer):
+        if player.is_active:
+            self.players[player.chat_id] = player
+        elif self.players.get(player.chat_id) is player:
+            del self.players[player.chat_id]
+        for callback in self.listeners:
+            try:
+                callback(player.chat_id, player.state)
+            except Exception as e:
+                print(f"Player listener error: {e}")
+
+    def active_chats(self) -> List[int]:
+        """Chats that are loading, playing, paused or ending"""
+        return [chat_id for chat_id, player in self.players.items() if player.is_active]
+
+    def get_stats(self) -> Dict[str, int]:
+        """Count of chats per state"""
+        stats = {state: 0 for state in (LOADING, PLAYING, PAUSED, ENDING)}
+        for player in self.players.values():
+            if player.state in stats:
+                stats[player.state] += 1
+        return stats
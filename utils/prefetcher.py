@@ -0,0 +1,117 @@
+# Queue look-ahead prefetcher for VCPlay Music Bot
+
+import asyncio
+import os
+from typing import Dict, Optional
+import config
+from utils.download_scheduler import PRIORITY_PREFETCH
+
+class Prefetcher:
+    """Downloads the next few queued tracks of each chat ahead of time.
+
+    Reacts to QueueManager events: additions, track changes and shuffles
+    re-plan the look-ahead window, clearing a queue cancels its jobs.
+    """
+
+    def __init__(self, queue_manager, downloader):
+        self.queue_manager = queue_manager
+        self.downloader = downloader
+        self.depth: Dict[int, int] = {}
+        self.tasks: Dict[int, Dict[str, asyncio.Task]] = {}
+        self.completed = 0
+        self.cancelled = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        queue_manager.add_listener(self._on_queue_event)
+
+    def _on_queue_event(self, chat_id: int, event: str):
+        if event == "clear":
+            self.cancel(chat_id)
+        elif event == "evict":
+            self.cancel(chat_id)
+            self.depth.pop(chat_id, None)
+        else:
+            self.schedule(chat_id)
+
+    def set_depth(self, chat_id: int, depth: int) -> int:
+        """Set look-ahead depth for a chat (bounded by PREFETCH_MAX_DEPTH)"""
+        depth = max(0, min(depth, config.PREFETCH_MAX_DEPTH))
+        self.depth[chat_id] = depth
+        self.schedule(chat_id)
+        return depth
+
+    def get_depth(self, chat_id: int) -> int:
+        """Get look-ahead depth for a chat"""
+        return self.depth.get(chat_id, config.PREFETCH_DEPTH)
+
+    @staticmethod
+    def is_ready(track) -> bool:
+        """Check if a queued song can be played without waiting"""
+        return bool(track.path) and os.path.isfile(track.path)
+
+    def schedule(self, chat_id: int):
+        """Start jobs for the look-ahead window and cancel ones that left it"""
+        if not config.PREFETCH_ENABLED:
+            return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(config.PREFETCH_MAX_CONCURRENT)
+
+        window = self.queue_manager.peek(chat_id, self.get_depth(chat_id))
+        wanted = {
+            track.url: track for track in window
+            if track.type == "youtube" and track.url and not self.is_ready(track)
+        }
+
+        chat_tasks = self.tasks.setdefault(chat_id, {})
+        for url in list(chat_tasks.keys()):
+            if url not in wanted:
+                chat_tasks.pop(url).cancel()
+                self.cancelled += 1
+
+        for url, track in wanted.items():
+            if url not in chat_tasks:
+                task = asyncio.create_task(self._prefetch(chat_id, track))
+                task.add_done_callback(lambda t, c=chat_id, u=url: self._forget(c, u, t))
+                chat_tasks[url] = task
+
+        if not chat_tasks:
+            self.tasks.pop(chat_id, None)
+
+    def cancel(self, chat_id: int):
+        """Cancel all prefetch jobs for a chat"""
+        for task in self.tasks.pop(chat_id, {}).values():
+            task.cancel()
+            self.cancelled += 1
+
+    def cancel_all(self):
+        """Cancel every prefetch job"""
+        for chat_id in list(self.tasks.keys()):
+            self.cancel(chat_id)
+
+    def _forget(self, chat_id: int, url: str, task: asyncio.Task):
+        chat_tasks = self.tasks.get(chat_id)
+        if chat_tasks is not None and chat_tasks.get(url) is task:
+            del chat_tasks[url]
+            if not chat_tasks:
+                self.tasks.pop(chat_id, None)
+
+    async def _prefetch(self, chat_id: int, track):
+        """Download a queued song and point it at the cached file"""
+        async with self._semaphore:
+            path = await self.downloader.download_audio(
+                track.url, chat_id=chat_id, priority=PRIORITY_PREFETCH
+            )
+
+        if path:
+            track.path = path
+            track.headers = None
+            self.completed += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get prefetch statistics"""
+        return {
+            'active_jobs': sum(len(tasks) for tasks in self.tasks.values()),
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+        }
@@ -0,0 +1,256 @@
+# Crash-safe queue persistence for VCPlay Music Bot
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+import config
+from utils.queue_manager import Track
+
+# Events that rewrite a chat's queue in place are journaled as the full list
+_REWRITE_EVENTS = ("shuffle", "remove", "move")
+
+class QueueJournal:
+    """Append-only journal of queue changes with periodic snapshots.
+
+    Every QueueManager event is appended as one JSON line. Replaying the
+    journal on top of the latest snapshot rebuilds all queues after a
+    restart or crash. Entries carry a sequence number and the snapshot
+    stores the last one it includes, so a crash between writing a snapshot
+    and truncating the journal cannot apply an entry twice.
+    """
+
+    def __init__(self, queue_manager, db=None, directory: Optional[str] = None):
+        self.queue_manager = queue_manager
+        self.db = db
+        self.directory = directory or config.QUEUE_JOURNAL_DIR
+        self.journal_path = os.path.join(self.directory, "journal.jsonl")
+        self.snapshot_path = os.path.join(self.directory, "snapshot.json")
+        self.seq = 0
+        self.pending = 0
+        self.appended = 0
+        self.compactions = 0
+        self.closed = False
+        self._file = None
+        self._task: Optional[asyncio.Task] = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        queue_manager.add_listener(self._on_queue_event)
+
+    @staticmethod
+    def encode(track: Track) -> Dict[str, Any]:
+        """Persistable form of a track (direct stream URLs expire, so drop them)"""
+        data = track.to_dict()
+        data.pop("gain", None)
+        if data.pop("headers", None):
+            data["path"] = None
+        return data
+
+    @staticmethod
+    def decode(data: Dict[str, Any]) -> Optional[Track]:
+        """Rebuild a track, forgetting files that no longer exist"""
+        track = Track.from_dict(data)
+        if track.path and not os.path.isfile(track.path):
+            if track.type == "file":
+                return None
+            track.path = None
+        return track
+
+    def _on_queue_event(self, chat_id: int, event: str):
+        if self.closed or event in ("restore", "evict"):
+            return
+
+        entry: Dict[str, Any] = {"op": event, "chat": chat_id}
+        if event == "add":
+            entry["track"] = self.encode(self.queue_manager.queues[chat_id][-1])
+        elif event == "current":
+            entry["track"] = self.encode(self.queue_manager.current_playing[chat_id])
+        elif event == "loop":
+            entry["on"] = self.queue_manager.is_looping(chat_id)
+        elif event in _REWRITE_EVENTS:
+            entry["op"] = "set"
+            entry["tracks"] = [self.encode(track) for track in self.queue_manager.queues[chat_id]]
+        self._append(entry)
+
+        if self.pending >= config.QUEUE_JOURNAL_COMPACT_EVERY:
+            self.compact()
+
+    def _append(self, entry: Dict[str, Any]):
+        self.seq += 1
+        entry["seq"] = self.seq
+        try:
+            if self._file is None:
+                self._file = open(self.journal_path, "a")
+            # A flushed write survives a process crash; fsync per entry would not be worth it
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self.pending += 1
+            self.appended += 1
+        except Exception as e:
+            print(f"Queue journal write error: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current state of every non-empty chat"""
+        chats = {}
+        qm = self.queue_manager
+        for chat_id in set(qm.queues) | set(qm.current_playing):
+            queue = qm.queues.get(chat_id)
+            current = qm.current_playing.get(chat_id)
+            if not queue and current is None:
+                continue
+            chats[str(chat_id)] = {
+                "queue": [self.encode(track) for track in queue or ()],
+                "current": self.encode(current) if current else None,
+                "loop": qm.is_looping(chat_id),
+            }
+        return {"seq": self.seq, "time": time.time(), "chats": chats}
+
+    def compact(self) -> Dict[str, Any]:
+        """Write a snapshot and start a fresh journal"""
+        snapshot = self.snapshot()
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, "w") as snapshot_file:
+                json.dump(snapshot, snapshot_file, separators=(",", ":"))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            if self._file:
+                self._file.close()
+            self._file = open(self.journal_path, "w")
+            self.pending = 0
+            self.compactions += 1
+        except Exception as e:
+            print(f"Queue snapshot error: {e}")
+        return snapshot
+
+    async def checkpoint(self):
+        """Compact if anything changed and mirror the snapshot to MongoDB"""
+        if not self.pending:
+            return
+        snapshot = self.compact()
+        if config.QUEUE_JOURNAL_MONGO and self.db and self.db.connected:
+            await self.db.save_queue_snapshot(snapshot)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.QUEUE_SNAPSHOT_INTERVAL)
+            await self.checkpoint()
+
+    def start(self):
+        """Start periodic snapshots"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Write a final snapshot and stop journaling (e.g. before clearing queues on shutdown)"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.checkpoint()
+        self.closed = True
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    async def load(self) -> Dict[int, Dict[str, Any]]:
+        """Replay snapshot + journal into plain per-chat state"""
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "r") as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except Exception as e:
+                print(f"Queue snapshot load error: {e}")
+        elif config.QUEUE_JOURNAL_MONGO and self.db and self.db.connected:
+            snapshot = await self.db.get_queue_snapshot()
+
+        snapshot = snapshot or {"seq": 0, "chats": {}}
+        state = {
+            int(chat_id): {
+                "queue": deque(chat["queue"]),
+                "current": chat.get("current"),
+                "loop": chat.get("loop", False),
+            }
+            for chat_id, chat in snapshot["chats"].items()
+        }
+        seq = snapshot.get("seq", 0)
+
+        for entry in self._read_journal():
+            if entry.get("seq", 0) <= snapshot.get("seq", 0):
+                continue
+            seq = max(seq, entry["seq"])
+            chat = state.setdefault(entry["chat"], {"queue": deque(), "current": None, "loop": False})
+            self._apply(chat, entry)
+
+        self.seq = seq
+        return state
+
+    def _read_journal(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.journal_path):
+            return []
+        entries = []
+        with open(self.journal_path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Torn last line from a crash mid-write
+                    break
+        return entries
+
+    @staticmethod
+    def _apply(chat: Dict[str, Any], entry: Dict[str, Any]):
+        """Apply one journal entry the same way QueueManager did"""
+        op = entry["op"]
+        queue = chat["queue"]
+        if op == "add":
+            queue.append(entry["track"])
+        elif op == "next":
+            if queue:
+                track = queue.popleft()
+                if chat["loop"] and chat["current"]:
+                    queue.append(chat["current"])
+                chat["current"] = track
+        elif op == "current":
+            chat["current"] = entry["track"]
+        elif op == "set":
+            chat["queue"] = deque(entry["tracks"])
+        elif op == "loop":
+            chat["loop"] = entry["on"]
+        elif op == "end":
+            chat["current"] = None
+        elif op == "clear":
+            queue.clear()
+            chat["current"] = None
+
+    async def restore(self) -> List[int]:
+        """Rebuild all queues and return the chats that were playing.
+
+        The interrupted track of each such chat is put back at the front of
+        its queue so playback can resume with it.
+        """
+        state = await self.load()
+        playing = []
+        for chat_id, chat in state.items():
+            tracks = [track for track in map(self.decode, chat["queue"]) if track]
+            current = self.decode(chat["current"]) if chat["current"] else None
+            if current:
+                tracks.insert(0, current)
+                playing.append(chat_id)
+            if tracks or chat["loop"]:
+                self.queue_manager.restore(chat_id, tracks, loop=chat["loop"])
+        self.compact()
+        return playing
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get journal statistics"""
+        return {
+            'seq': self.seq,
+            'pending': self.pending,
+            'appended': self.appended,
+            'compactions': self.compactions,
+        }
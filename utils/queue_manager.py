@@ -1,74 +1,342 @@
 # Queue Manager for VCPlay Music Bot
 
 import random
-from typing import Dict, List, Optional, Any
-from collections import defaultdict
+import sys
+import time
+from itertools import islice
+from typing import Callable, Deque, Dict, List, Optional, Any, Union
+from collections import deque
+import config
+
+def parse_duration(duration: Union[int, float, str, None]) -> int:
+    """Convert seconds or a "HH:MM:SS" / "MM:SS" string to seconds"""
+    if not duration:
+        return 0
+    if isinstance(duration, (int, float)):
+        return int(duration)
+    seconds = 0
+    try:
+        for part in duration.split(":"):
+            seconds = seconds * 60 + int(part)
+    except ValueError:
+        return 0
+    return seconds
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Track:
+    """Compact queue entry.
+
+    Requester mentions, thumbnails and source types repeat across many
+    queued tracks, so they are interned and shared between records.
+    """
+
+    __slots__ = ("title", "duration", "thumbnail", "requested_by", "path",
+                 "headers", "type", "url", "video_id", "gain")
+
+    def __init__(self, title: str, duration: int = 0, thumbnail: Optional[str] = None,
+                 requested_by: Optional[str] = None, path: Optional[str] = None,
+                 headers: Optional[Dict] = None, type: str = "file",
+                 url: Optional[str] = None, video_id: Optional[str] = None):
+        self.title = title
+        self.duration = parse_duration(duration)
+        self.thumbnail = _intern(thumbnail)
+        self.requested_by = _intern(requested_by)
+        self.path = path
+        self.headers = headers
+        self.type = _intern(type)
+        self.url = url
+        self.video_id = video_id
+        self.gain: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Track":
+        """Build a track from a legacy song_info dict"""
+        return cls(
+            title=data.get("title", "Unknown"),
+            duration=data.get("duration", 0),
+            thumbnail=data.get("thumbnail"),
+            requested_by=data.get("requested_by"),
+            path=data.get("path"),
+            headers=data.get("headers"),
+            type=data.get("type", "file"),
+            url=data.get("url"),
+            video_id=data.get("video_id", data.get("id")),
+        )
+
+    def memory_size(self) -> int:
+        """Approximate bytes owned by this record (interned fields are shared)"""
+        size = sys.getsizeof(self)
+        for value in (self.title, self.path, self.url, self.video_id, self.headers):
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"Track({self.title!r}, {self.duration}s, {self.type})"
 
 class QueueManager:
+    """Per-chat queues, current track and loop mode.
+
+    Chat state is created on the first write only; read-only calls never
+    add entries. Chats with nothing queued or playing are dropped by
+    evict_idle() after QUEUE_IDLE_TIMEOUT seconds without activity.
+    """
+
     def __init__(self):
-        self.queues: Dict[int, List[Dict]] = defaultdict(list)
-        self.loop_mode: Dict[int, bool] = defaultdict(bool)
-        self.current_playing: Dict[int, Optional[Dict]] = defaultdict(lambda: None)
-        
-    def add_to_queue(self, chat_id: int, song_info: Dict) -> int:
+        self.queues: Dict[int, Deque[Track]] = {}
+        self.loop_mode: Dict[int, bool] = {}
+        self.current_playing: Dict[int, Optional[Track]] = {}
+        self.last_active: Dict[int, float] = {}
+        self.listeners: List[Callable[[int, str], None]] = []
+        self.evicted = 0
+        # Running totals, updated on every mutation
+        self.total_tracks = 0
+        self.total_duration = 0
+        self.queue_duration: Dict[int, int] = {}
+
+    def add_listener(self, callback: Callable[[int, str], None]):
+        """Register a callback invoked as callback(chat_id, event) on queue changes"""
+        self.listeners.append(callback)
+
+    def _notify(self, chat_id: int, event: str):
+        self.last_active[chat_id] = time.time()
+        for callback in self.listeners:
+            try:
+                callback(chat_id, event)
+            except Exception as e:
+                print(f"Queue listener error: {e}")
+
+    def _count(self, chat_id: int, tracks: int, duration: int):
+        """Apply a change in queued tracks/seconds to the running totals"""
+        self.total_tracks += tracks
+        self.total_duration += duration
+        remaining = self.queue_duration.get(chat_id, 0) + duration
+        if remaining or self.queues.get(chat_id):
+            self.queue_duration[chat_id] = remaining
+        else:
+            self.queue_duration.pop(chat_id, None)
+
+    def _queue(self, chat_id: int) -> Deque[Track]:
+        """Queue of a chat, created for writes"""
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = self.queues[chat_id] = deque()
+        return queue
+
+    def add_to_queue(self, chat_id: int, track: Union[Track, Dict]) -> int:
         """Add song to queue and return position"""
-        self.queues[chat_id].append(song_info)
-        return len(self.queues[chat_id])
-    
-    def get_next(self, chat_id: int) -> Optional[Dict]:
+        if not isinstance(track, Track):
+            track = Track.from_dict(track)
+        queue = self._queue(chat_id)
+        queue.append(track)
+        self._count(chat_id, 1, track.duration)
+        self._notify(chat_id, "add")
+        return len(queue)
+
+    def get_next(self, chat_id: int) -> Optional[Track]:
         """Get next song from queue"""
-        if not self.queues[chat_id]:
+        queue = self.queues.get(chat_id)
+        if not queue:
             return None
-        
-        next_song = self.queues[chat_id].pop(0)
-        
+
+        next_song = queue.popleft()
+        self._count(chat_id, -1, -next_song.duration)
+
         # If loop mode is enabled, add current song back to end
-        if self.loop_mode[chat_id] and self.current_playing[chat_id]:
-            self.queues[chat_id].append(self.current_playing[chat_id])
-        
+        current = self.current_playing.get(chat_id)
+        if self.loop_mode.get(chat_id) and current:
+            queue.append(current)
+            self._count(chat_id, 1, current.duration)
+
         self.current_playing[chat_id] = next_song
+        self._notify(chat_id, "next")
         return next_song
-    
-    def get_queue(self, chat_id: int) -> List[Dict]:
+
+    def set_current(self, chat_id: int, track: Track):
+        """Record a song that started playing without passing through the queue"""
+        self.current_playing[chat_id] = track
+        self._notify(chat_id, "current")
+
+    def replace_path(self, old_path: str, new_path: str) -> int:
+        """Point queued and current songs using a file at a replacement"""
+        replaced = 0
+        for queue in (*self.queues.values(), self.current_playing.values()):
+            for track in queue:
+                if track and track.path == old_path:
+                    track.path = new_path
+                    replaced += 1
+        return replaced
+
+    def get_queue(self, chat_id: int) -> List[Track]:
         """Get current queue"""
-        return self.queues[chat_id].copy()
-    
+        return list(self.queues.get(chat_id, ()))
+
+    def peek(self, chat_id: int, count: int) -> List[Track]:
+        """Get the next few songs without copying the whole queue"""
+        return list(islice(self.queues.get(chat_id, ()), count))
+
+    def get_page(self, chat_id: int, page: int, page_size: int) -> List[Track]:
+        """One 1-based page of the queue, iterating only up to that page"""
+        start = (max(page, 1) - 1) * page_size
+        return list(islice(self.queues.get(chat_id, ()), start, start + page_size))
+
+    def get_queue_duration(self, chat_id: int) -> int:
+        """Total seconds of queued songs"""
+        return self.queue_duration.get(chat_id, 0)
+
+    def queue_length(self, chat_id: int) -> int:
+        """Number of queued songs"""
+        return len(self.queues.get(chat_id, ()))
+
     def is_empty(self, chat_id: int) -> bool:
         """Check if queue is empty"""
-        return len(self.queues[chat_id]) == 0
-    
+        return not self.queues.get(chat_id)
+
+    def get_current(self, chat_id: int) -> Optional[Track]:
+        """Song currently playing in a chat"""
+        return self.current_playing.get(chat_id)
+
+    def is_looping(self, chat_id: int) -> bool:
+        """Check if loop mode is enabled"""
+        return self.loop_mode.get(chat_id, False)
+
+    def remove(self, chat_id: int, position: int) -> Optional[Track]:
+        """Remove the song at a 1-based position"""
+        queue = self.queues.get(chat_id)
+        if not queue or not 1 <= position <= len(queue):
+            return None
+        # deque rotates from the nearer end, so this touches min(i, n - i) blocks
+        track = queue[position - 1]
+        del queue[position - 1]
+        self._count(chat_id, -1, -track.duration)
+        self._notify(chat_id, "remove")
+        return track
+
+    def move(self, chat_id: int, source: int, target: int) -> bool:
+        """Move a song from one 1-based position to another"""
+        queue = self.queues.get(chat_id)
+        if not queue or not (1 <= source <= len(queue) and 1 <= target <= len(queue)):
+            return False
+        track = queue[source - 1]
+        del queue[source - 1]
+        queue.insert(target - 1, track)
+        self._notify(chat_id, "move")
+        return True
+
+    def end_playback(self, chat_id: int):
+        """Mark that nothing is playing after the queue ran out"""
+        self.current_playing.pop(chat_id, None)
+        self._notify(chat_id, "end")
+
+    def restore(self, chat_id: int, tracks: List[Track], current: Optional[Track] = None, loop: bool = False):
+        """Replace a chat's queue with persisted state"""
+        self._drop_queue(chat_id)
+        self.queues[chat_id] = deque(tracks)
+        self._count(chat_id, len(tracks), sum(track.duration for track in tracks))
+        if current:
+            self.current_playing[chat_id] = current
+        if loop:
+            self.loop_mode[chat_id] = True
+        self._notify(chat_id, "restore")
+
     def clear_queue(self, chat_id: int):
         """Clear the queue for a chat"""
-        self.queues[chat_id].clear()
-        self.current_playing[chat_id] = None
-    
+        self._drop_queue(chat_id)
+        self.current_playing.pop(chat_id, None)
+        self._notify(chat_id, "clear")
+
     def clear_all(self):
         """Clear all queues"""
+        for chat_id in list(self.queues.keys()):
+            self._notify(chat_id, "clear")
         self.queues.clear()
         self.loop_mode.clear()
         self.current_playing.clear()
-    
+        self.last_active.clear()
+        self.queue_duration.clear()
+        self.total_tracks = 0
+        self.total_duration = 0
+
+    def _drop_queue(self, chat_id: int):
+        queue = self.queues.pop(chat_id, None)
+        if queue:
+            self._count(chat_id, -len(queue), -self.queue_duration.get(chat_id, 0))
+
     def shuffle_queue(self, chat_id: int) -> int:
         """Shuffle the queue and return count of shuffled songs"""
-        if self.queues[chat_id]:
-            random.shuffle(self.queues[chat_id])
-            return len(self.queues[chat_id])
+        queue = self.queues.get(chat_id)
+        if queue:
+            random.shuffle(queue)
+            self._notify(chat_id, "shuffle")
+            return len(queue)
         return 0
-    
+
     def toggle_loop(self, chat_id: int) -> bool:
         """Toggle loop mode for a chat"""
-        self.loop_mode[chat_id] = not self.loop_mode[chat_id]
-        return self.loop_mode[chat_id]
-    
+        enabled = not self.loop_mode.get(chat_id, False)
+        if enabled:
+            self.loop_mode[chat_id] = True
+        else:
+            self.loop_mode.pop(chat_id, None)
+        self._notify(chat_id, "loop")
+        return enabled
+
+    def evict_idle(self, max_idle: Optional[float] = None) -> int:
+        """Drop chats with nothing queued or playing that have been idle too long"""
+        max_idle = config.QUEUE_IDLE_TIMEOUT if max_idle is None else max_idle
+        cutoff = time.time() - max_idle
+        evicted = 0
+        for chat_id, last_active in list(self.last_active.items()):
+            if last_active > cutoff or self.queues.get(chat_id) or chat_id in self.current_playing:
+                continue
+            self._drop_queue(chat_id)
+            self.loop_mode.pop(chat_id, None)
+            # Listeners drop their own per-chat state
+            self._notify(chat_id, "evict")
+            del self.last_active[chat_id]
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    def chat_memory(self, chat_id: int) -> int:
+        """Approximate bytes held for a chat's queue and current song"""
+        queue = self.queues.get(chat_id)
+        size = sys.getsizeof(queue) if queue is not None else 0
+        size += sum(track.memory_size() for track in queue or ())
+        current = self.current_playing.get(chat_id)
+        if current:
+            size += current.memory_size()
+        return size
+
+    def get_memory_report(self, top: int = 5) -> Dict[str, Any]:
+        """Memory use per chat, largest chats first"""
+        chats = set(self.last_active) | set(self.queues) | set(self.current_playing)
+        usage = sorted(((self.chat_memory(chat_id), chat_id) for chat_id in chats), reverse=True)
+        return {
+            'chats': len(chats),
+            'tracks': self.total_tracks,
+            'total_bytes': sum(size for size, _ in usage),
+            'evicted': self.evicted,
+            'top': [
+                {'chat_id': chat_id, 'bytes': size, 'tracks': self.queue_length(chat_id)}
+                for size, chat_id in usage[:top]
+            ],
+        }
+
     def get_queue_stats(self) -> Dict[str, Any]:
-        """Get overall queue statistics"""
-        total_chats = len(self.queues)
-        total_songs = sum(len(queue) for queue in self.queues.values())
-        active_loops = sum(1 for enabled in self.loop_mode.values() if enabled)
-        
+        """Get overall queue statistics (constant time)"""
+        total_chats = len(self.queue_duration)
+
         return {
             'total_chats': total_chats,
-            'total_songs': total_songs,
-            'active_loops': active_loops,
-            'average_queue_size': total_songs / max(total_chats, 1)
+            'total_songs': self.total_tracks,
+            'total_duration': self.total_duration,
+            # loop_mode only holds enabled chats
+            'active_loops': len(self.loop_mode),
+            'average_queue_size': self.total_tracks / max(total_chats, 1)
         }
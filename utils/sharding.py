@@ -0,0 +1,372 @@
+# Multi-process playback sharding for VCPlay Music Bot
+
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+import config
+
+# Frames are a 4-byte big-endian length followed by a JSON object
+_HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 1 << 20
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+def socket_path(index: int) -> str:
+    """Unix socket a worker listens on"""
+    return os.path.join(config.SHARD_SOCKET_DIR, f"worker-{index}.sock")
+
+async def write_frame(writer: asyncio.StreamWriter, payload: Dict[str, Any]):
+    """Send one length-prefixed JSON message"""
+    data = json.dumps(payload, separators=(",", ":")).encode()
+    writer.write(_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+async def read_frame(reader: asyncio.StreamReader) -> Dict[str, Any]:
+    """Receive one length-prefixed JSON message"""
+    (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes is too large")
+    return json.loads(await reader.readexactly(length))
+
+class ShardError(Exception):
+    """Error returned by a worker for a request"""
+
+class HashRing:
+    """Consistent hash ring mapping chat ids to worker indexes.
+
+    Every worker owns ``replicas`` points on the ring, so adding or
+    removing one worker only moves the chats on its arcs (about 1/N).
+    """
+
+    def __init__(self, nodes: List[int], replicas: int = 128):
+        self.replicas = replicas
+        self.points: List[int] = []
+        self.owners: Dict[int, int] = {}
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[int]:
+        return sorted(set(self.owners.values()))
+
+    def add(self, node: int):
+        """Put a worker on the ring"""
+        for replica in range(self.replicas):
+            point = _hash(f"{node}:{replica}")
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = node
+
+    def remove(self, node: int):
+        """Take a worker off the ring"""
+        self.points = [point for point in self.points if self.owners[point] != node]
+        self.owners = {point: self.owners[point] for point in self.points}
+
+    def node_for(self, chat_id: int) -> int:
+        """Worker that owns a chat"""
+        if not self.points:
+            raise LookupError("Hash ring is empty")
+        i = bisect.bisect(self.points, _hash(str(chat_id))) % len(self.points)
+        return self.owners[self.points[i]]
+
+class ShardServer:
+    """Worker side of the IPC protocol: runs named methods for the coordinator.
+
+    Requests are ``{"id", "method", "params"}`` and answered with
+    ``{"id", "result"}`` or ``{"id", "error"}``; several requests may be
+    in flight on one connection.
+    """
+
+    def __init__(self, path: str, methods: Dict[str, Callable[..., Awaitable[Any]]]):
+        self.path = path
+        self.methods = methods
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """Listen on the worker's socket"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await read_frame(reader)
+                task = asyncio.create_task(self._dispatch(request, writer))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"Shard server error: {e}")
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request: Dict[str, Any], writer: asyncio.StreamWriter):
+        response: Dict[str, Any] = {"id": request.get("id")}
+        try:
+            method = self.methods.get(request.get("method"))
+            if method is None:
+                raise ValueError(f"Unknown method {request.get('method')}")
+            response["result"] = await method(**request.get("params", {}))
+        except Exception as e:
+            response["error"] = str(e)
+        try:
+            await write_frame(writer, response)
+        except ConnectionError:
+            pass
+
+    async def close(self):
+        """Stop listening and remove the socket"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for task in list(self.tasks):
+            task.cancel()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class ShardClient:
+    """Coordinator side of one worker connection, reconnecting on demand"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if not self.connected:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+                self._reader_task = asyncio.create_task(self._read_responses(self.reader))
+
+    async def _read_responses(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                response = await read_frame(reader)
+                future = self.pending.pop(response.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(ShardError(response["error"]))
+                else:
+                    future.set_result(response.get("result"))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            if self.reader is reader:
+                self._disconnect()
+
+    def _disconnect(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Worker connection lost"))
+        self.pending.clear()
+
+    async def call(self, method: str, timeout: float = 10, **params) -> Any:
+        """Run a method on the worker and return its result"""
+        if not self.connected:
+            await self.connect()
+        self.next_id += 1
+        request_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await write_frame(self.writer, {"id": request_id, "method": method, "params": params})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._disconnect()
+
+class ShardWorker:
+    """One worker process as seen by the coordinator"""
+
+    def __init__(self, index: int, sessions: List[str]):
+        self.index = index
+        self.sessions = sessions
+        self.client = ShardClient(socket_path(index))
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.healthy = False
+        self.failures = 0
+        self.restarts = 0
+        self.started = 0.0
+        self.stats: Dict[str, Any] = {}
+
+class ShardCoordinator:
+    """Spawns playback workers and routes each chat to its owner.
+
+    Every worker is a full MusicBot process with its own assistant
+    sessions, PyTgCalls instances, queues, journal and media cache. The
+    coordinator only receives commands and forwards voice chat commands
+    to the worker that owns the chat on the hash ring.
+    """
+
+    # Consecutive failed pings before a worker is restarted
+    MAX_FAILURES = 3
+    # Seconds a new worker gets to log in before pings count as failures
+    STARTUP_GRACE = 60
+
+    def __init__(self, count: int, sessions: List[str], script: str):
+        if len(sessions) < count:
+            raise ValueError(f"{count} shard workers need at least {count} extra assistant sessions")
+        self.script = script
+        self.workers = [ShardWorker(i, sessions[i::count]) for i in range(count)]
+        self.ring = HashRing([worker.index for worker in self.workers])
+        self.routed = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def worker_for(self, chat_id: int) -> ShardWorker:
+        """Worker that owns a chat"""
+        return self.workers[self.ring.node_for(chat_id)]
+
+    def _worker_env(self, worker: ShardWorker) -> Dict[str, str]:
+        env = dict(os.environ)
+        search_cache, ext = os.path.splitext(config.SEARCH_CACHE_PATH)
+        env.update({
+            "SHARD_INDEX": str(worker.index),
+            "SHARD_WORKERS": "0",
+            "SESSION_STRING": worker.sessions[0],
+            "SESSION_STRINGS": " ".join(worker.sessions[1:]),
+            # The bot token and on-disk state cannot be shared between processes.
+            # SQLITE_DB_PATH stays shared on purpose: users, stats and bans are
+            # global, and SQLite locking serializes writes across processes.
+            "BOT_TOKEN": "",
+            "MEDIA_CACHE_DIR": os.path.join(config.MEDIA_CACHE_DIR, f"shard-{worker.index}"),
+            "QUEUE_JOURNAL_DIR": os.path.join(config.QUEUE_JOURNAL_DIR, f"shard-{worker.index}"),
+            "SEARCH_CACHE_PATH": f"{search_cache}.shard-{worker.index}{ext}",
+        })
+        return env
+
+    async def _spawn(self, worker: ShardWorker):
+        await worker.client.close()
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, self.script, env=self._worker_env(worker)
+        )
+        worker.started = time.time()
+        worker.healthy = False
+        worker.failures = 0
+
+    async def start(self):
+        """Spawn all workers and start health checks"""
+        os.makedirs(config.SHARD_SOCKET_DIR, exist_ok=True)
+        for worker in self.workers:
+            await self._spawn(worker)
+        if self._task is None:
+            self._task = asyncio.create_task(self._monitor())
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(config.SHARD_HEALTH_INTERVAL)
+            await asyncio.gather(*(self.check(worker) for worker in self.workers))
+
+    async def check(self, worker: ShardWorker):
+        """Ping a worker, restarting it if it exited or stopped answering"""
+        if worker.process and worker.process.returncode is not None:
+            print(f"Shard worker {worker.index} exited with code {worker.process.returncode}, restarting")
+            worker.restarts += 1
+            await self._spawn(worker)
+            return
+
+        try:
+            worker.stats = await worker.client.call("ping", timeout=5)
+            worker.healthy = True
+            worker.failures = 0
+        except Exception as e:
+            if time.time() - worker.started < self.STARTUP_GRACE:
+                return
+            worker.healthy = False
+            worker.failures += 1
+            print(f"Shard worker {worker.index} ping failed ({worker.failures}): {e}")
+            if worker.failures >= self.MAX_FAILURES and worker.process:
+                worker.process.kill()
+                await worker.process.wait()
+                worker.restarts += 1
+                await self._spawn(worker)
+
+    async def route(self, handler: str, message) -> bool:
+        """Forward a voice chat command to the worker owning the chat"""
+        worker = self.worker_for(message.chat.id)
+        try:
+            if not worker.healthy:
+                raise ConnectionError("worker is not ready")
+            await worker.client.call(
+                "command",
+                timeout=config.SHARD_COMMAND_TIMEOUT,
+                handler=handler,
+                chat_id=message.chat.id,
+                message_id=message.id,
+                command=message.command,
+            )
+            self.routed += 1
+            return True
+        except ShardError as e:
+            # The worker is up but could not take the command
+            self.failed += 1
+            print(f"Shard worker {worker.index} command error: {e}")
+            await message.reply_text(f"❌ **Error:** {e}")
+            return False
+        except Exception as e:
+            self.failed += 1
+            print(f"Shard worker {worker.index} command error: {e}")
+            await message.reply_text("⚠️ **Player is restarting, please try again in a few seconds.**")
+            return False
+
+    async def stop(self):
+        """Stop health checks and shut all workers down"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for worker in self.workers:
+            await worker.client.close()
+            if worker.process and worker.process.returncode is None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process and worker.process.returncode is None:
+                try:
+                    await asyncio.wait_for(worker.process.wait(), timeout=15)
+                except asyncio.TimeoutError:
+                    worker.process.kill()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Health and load of every worker"""
+        return {
+            'workers': [
+                {
+                    'index': worker.index,
+                    'healthy': worker.healthy,
+                    'restarts': worker.restarts,
+                    'chats': worker.stats.get('chats', 0),
+                    'queued': worker.stats.get('queued', 0),
+                }
+                for worker in self.workers
+            ],
+            'routed': self.routed,
+            'failed': self.failed,
+        }
@@ -0,0 +1,763 @@
+# Storage backends for VCPlay Music Bot's Database
+
+import asyncio
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import config
+
+# Settings of a newly seen chat
+DEFAULT_CHAT_SETTINGS = {
+    "language": config.DEFAULT_LANGUAGE,
+    "admin_only": False,
+    "delete_messages": True,
+    "welcome_message": True
+}
+
+# Materialized global counters
+COUNTERS = ("total_users", "total_chats", "total_songs_played")
+
+class StorageBackend(ABC):
+    """Persistence operations used by Database.
+
+    Database keeps caching, write buffering and counter bookkeeping; a
+    backend only stores and loads documents. Pending activity arrives in
+    batches keyed by id: users as {username, first_name, last_seen},
+    chats as {chat_title, chat_type, last_active} and plays as
+    [count, seconds].
+    """
+
+    name = "storage"
+    # True when the database expires old stats by itself (TTL index)
+    expires_stats = False
+
+    @abstractmethod
+    async def connect(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close(self):
+        raise NotImplementedError
+
+    # Users
+    @abstractmethod
+    async def upsert_users(self, users: Dict[int, Dict[str, Any]]) -> int:
+        """Create missing users and update last_seen; returns how many were created"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def is_banned(self, user_id: int) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_banned(self, user_id: int, banned: bool):
+        """Ban or unban, stamping ban_changed for ban_changes()"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def banned_ids(self) -> List[int]:
+        """Ids of all banned users"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def ban_changes(self, since: datetime) -> List[Tuple[int, bool, datetime]]:
+        """(user_id, banned, changed_at) of users banned or unbanned since a time"""
+        raise NotImplementedError
+
+    # Chats
+    @abstractmethod
+    async def upsert_chats(self, chats: Dict[int, Dict[str, Any]]) -> int:
+        """Create missing chats and update last_active; returns how many were created"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_chat(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_chat_settings(self, chat_id: int, settings: Dict[str, Any]):
+        raise NotImplementedError
+
+    # Play statistics
+    @abstractmethod
+    async def add_plays(self, plays: Dict[int, List[int]], day: datetime):
+        """Add plays to each chat's totals and to its stats for the day"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_counters(self) -> Optional[Dict[str, int]]:
+        """Materialized global counters, None if never built"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def inc_counters(self, increments: Dict[str, int]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_counters(self, counters: Dict[str, int]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def count_totals(self) -> Dict[str, int]:
+        """Global counters recomputed from the stored data"""
+        raise NotImplementedError
+
+    # Playlists
+    @abstractmethod
+    async def save_playlist(self, user_id: int, name: str, tracks: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_playlist(self, user_id: int, name: str) -> Optional[List[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def list_playlists(self, user_id: int) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_playlist(self, user_id: int, name: str) -> bool:
+        raise NotImplementedError
+
+    # Queue snapshots
+    @abstractmethod
+    async def save_queue_snapshot(self, snapshot: Dict[str, Any]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_queue_snapshot(self) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # Retention: each call removes at most ``limit`` rows so a run can
+    # pause between batches instead of holding one long delete
+    @abstractmethod
+    async def delete_old_stats(self, cutoff: datetime, limit: int) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_inactive_users(self, cutoff: datetime, limit: int) -> int:
+        raise NotImplementedError
+
+class MongoBackend(StorageBackend):
+    """MongoDB through motor (imported lazily, so other backends work without it)"""
+
+    name = "MongoDB"
+
+    def __init__(self, uri: str, db_name: str):
+        import motor.motor_asyncio
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(uri)
+        self.db = self.client[db_name]
+        self.users = self.db.users
+        self.chats = self.db.chats
+        self.stats = self.db.stats
+        self.playlists = self.db.playlists
+        self.settings = self.db.settings
+        self.queues = self.db.queues
+
+    async def connect(self):
+        await self.client.admin.command('ping')
+        await self._create_indexes()
+
+    async def close(self):
+        self.client.close()
+
+    async def _create_indexes(self):
+        """Create database indexes for better performance"""
+        try:
+            # User indexes
+            await self.users.create_index("user_id", unique=True)
+            await self.users.create_index("is_banned", partialFilterExpression={"is_banned": True})
+            await self.users.create_index("ban_changed", sparse=True)
+            await self.users.create_index("last_seen")
+
+            # Chat indexes
+            await self.chats.create_index("chat_id", unique=True)
+
+            # Stats indexes
+            await self.stats.create_index([("chat_id", 1), ("date", -1)])
+            await self._create_stats_ttl()
+
+            # Playlist indexes
+            await self.playlists.create_index([("user_id", 1), ("name", 1)])
+
+            # Queue snapshot indexes
+            await self.queues.create_index("chat_id", unique=True)
+
+        except Exception as e:
+            print(f"Error creating indexes: {e}")
+
+    async def _create_stats_ttl(self):
+        """Let MongoDB expire daily stats older than DB_RETENTION_DAYS"""
+        from pymongo.errors import OperationFailure
+        seconds = config.DB_RETENTION_DAYS * 86400
+        try:
+            await self.stats.create_index("date", expireAfterSeconds=seconds)
+        except OperationFailure:
+            # Index exists with another retention period
+            await self.db.command("collMod", "stats", index={"keyPattern": {"date": 1}, "expireAfterSeconds": seconds})
+        self.expires_stats = True
+
+    async def upsert_users(self, users: Dict[int, Dict[str, Any]]) -> int:
+        from pymongo import UpdateOne
+        requests = []
+        for user_id, user in users.items():
+            user_data = {
+                "user_id": user_id,
+                "username": user["username"],
+                "first_name": user["first_name"],
+                "join_date": user["last_seen"],
+                "commands_used": 0,
+                "is_banned": False
+            }
+            requests.append(UpdateOne(
+                {"user_id": user_id},
+                {"$setOnInsert": user_data, "$set": {"last_seen": user["last_seen"]}},
+                upsert=True
+            ))
+        result = await self.users.bulk_write(requests, ordered=False)
+        return result.upserted_count
+
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return await self.users.find_one({"user_id": user_id})
+
+    async def is_banned(self, user_id: int) -> bool:
+        user = await self.users.find_one({"user_id": user_id}, {"is_banned": 1})
+        return user.get("is_banned", False) if user else False
+
+    async def set_banned(self, user_id: int, banned: bool):
+        now = datetime.utcnow()
+        if banned:
+            await self.users.update_one(
+                {"user_id": user_id},
+                {"$set": {"is_banned": True, "ban_date": now, "ban_changed": now}},
+                upsert=True
+            )
+        else:
+            await self.users.update_one(
+                {"user_id": user_id},
+                {"$set": {"is_banned": False, "ban_changed": now}, "$unset": {"ban_date": 1}}
+            )
+
+    async def banned_ids(self) -> List[int]:
+        return [doc["user_id"] async for doc in self.users.find({"is_banned": True}, {"user_id": 1})]
+
+    async def ban_changes(self, since: datetime) -> List[Tuple[int, bool, datetime]]:
+        cursor = self.users.find(
+            {"ban_changed": {"$gte": since}},
+            {"user_id": 1, "is_banned": 1, "ban_changed": 1}
+        )
+        return [(doc["user_id"], doc.get("is_banned", False), doc["ban_changed"]) async for doc in cursor]
+
+    async def upsert_chats(self, chats: Dict[int, Dict[str, Any]]) -> int:
+        from pymongo import UpdateOne
+        requests = []
+        for chat_id, chat in chats.items():
+            chat_data = {
+                "chat_id": chat_id,
+                "chat_title": chat["chat_title"],
+                "chat_type": chat["chat_type"],
+                "join_date": chat["last_active"],
+                "settings": dict(DEFAULT_CHAT_SETTINGS),
+                "stats": {
+                    "songs_played": 0,
+                    "commands_used": 0,
+                    "total_duration": 0
+                }
+            }
+            requests.append(UpdateOne(
+                {"chat_id": chat_id},
+                {"$setOnInsert": chat_data, "$set": {"last_active": chat["last_active"]}},
+                upsert=True
+            ))
+        result = await self.chats.bulk_write(requests, ordered=False)
+        return result.upserted_count
+
+    async def get_chat(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        return await self.chats.find_one({"chat_id": chat_id})
+
+    async def update_chat_settings(self, chat_id: int, settings: Dict[str, Any]):
+        await self.chats.update_one(
+            {"chat_id": chat_id},
+            {"$set": {f"settings.{key}": value for key, value in settings.items()}}
+        )
+
+    async def add_plays(self, plays: Dict[int, List[int]], day: datetime):
+        from pymongo import UpdateOne
+        await self.chats.bulk_write(
+            [
+                UpdateOne(
+                    {"chat_id": chat_id},
+                    {"$inc": {"stats.songs_played": count, "stats.total_duration": duration}}
+                )
+                for chat_id, (count, duration) in plays.items()
+            ],
+            ordered=False
+        )
+        await self.stats.bulk_write(
+            [
+                UpdateOne(
+                    {"chat_id": chat_id, "date": day},
+                    {"$inc": {"songs_played": count, "total_duration": duration}},
+                    upsert=True
+                )
+                for chat_id, (count, duration) in plays.items()
+            ],
+            ordered=False
+        )
+
+    async def get_counters(self) -> Optional[Dict[str, int]]:
+        doc = await self.settings.find_one({"_id": "global_stats"})
+        return {key: doc.get(key, 0) for key in COUNTERS} if doc else None
+
+    async def inc_counters(self, increments: Dict[str, int]):
+        await self.settings.update_one({"_id": "global_stats"}, {"$inc": increments}, upsert=True)
+
+    async def set_counters(self, counters: Dict[str, int]):
+        await self.settings.update_one(
+            {"_id": "global_stats"},
+            {"$set": {**counters, "reconciled_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def count_totals(self) -> Dict[str, int]:
+        total_users = await self.users.count_documents({})
+        total_chats = await self.chats.count_documents({})
+        pipeline = [
+            {"$group": {"_id": None, "total_songs": {"$sum": "$stats.songs_played"}}}
+        ]
+        result = await self.chats.aggregate(pipeline).to_list(1)
+        return {
+            "total_users": total_users,
+            "total_chats": total_chats,
+            "total_songs_played": result[0]["total_songs"] if result else 0,
+        }
+
+    async def save_playlist(self, user_id: int, name: str, tracks: List[Dict[str, Any]]):
+        await self.playlists.update_one(
+            {"user_id": user_id, "name": name},
+            {"$set": {"tracks": tracks, "updated": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def get_playlist(self, user_id: int, name: str) -> Optional[List[Dict[str, Any]]]:
+        doc = await self.playlists.find_one({"user_id": user_id, "name": name})
+        return doc["tracks"] if doc else None
+
+    async def list_playlists(self, user_id: int) -> List[str]:
+        return [doc["name"] async for doc in self.playlists.find({"user_id": user_id}, {"name": 1}).sort("name", 1)]
+
+    async def delete_playlist(self, user_id: int, name: str) -> bool:
+        result = await self.playlists.delete_one({"user_id": user_id, "name": name})
+        return result.deleted_count > 0
+
+    async def save_queue_snapshot(self, snapshot: Dict[str, Any]):
+        from pymongo import ReplaceOne
+        chat_ids = [int(chat_id) for chat_id in snapshot["chats"]]
+        requests = [
+            ReplaceOne({"chat_id": int(chat_id)}, {"chat_id": int(chat_id), **chat}, upsert=True)
+            for chat_id, chat in snapshot["chats"].items()
+        ]
+        if requests:
+            await self.queues.bulk_write(requests, ordered=False)
+        await self.queues.delete_many({"chat_id": {"$nin": chat_ids}})
+        await self.settings.update_one(
+            {"_id": "queue_snapshot"},
+            {"$set": {"seq": snapshot["seq"], "time": snapshot["time"]}},
+            upsert=True
+        )
+
+    async def get_queue_snapshot(self) -> Optional[Dict[str, Any]]:
+        meta = await self.settings.find_one({"_id": "queue_snapshot"})
+        if not meta:
+            return None
+        chats = {}
+        async for doc in self.queues.find({}, {"_id": 0}):
+            chats[str(doc.pop("chat_id"))] = doc
+        return {"seq": meta["seq"], "time": meta["time"], "chats": chats}
+
+    async def _delete_batch(self, collection, query: Dict[str, Any], limit: int) -> int:
+        ids = [doc["_id"] async for doc in collection.find(query, {"_id": 1}).limit(limit)]
+        if not ids:
+            return 0
+        result = await collection.delete_many({"_id": {"$in": ids}})
+        return result.deleted_count
+
+    async def delete_old_stats(self, cutoff: datetime, limit: int) -> int:
+        return await self._delete_batch(self.stats, {"date": {"$lt": cutoff}}, limit)
+
+    async def delete_inactive_users(self, cutoff: datetime, limit: int) -> int:
+        return await self._delete_batch(self.users, {
+            "last_seen": {"$lt": cutoff},
+            "commands_used": {"$lt": 5},
+            "is_banned": {"$ne": True}
+        }, limit)
+
+def _ts(value: datetime) -> float:
+    """Naive UTC datetime (as used throughout Database) to epoch seconds"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+def _dt(value: Optional[float]) -> Optional[datetime]:
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None) if value is not None else None
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL DEFAULT '',
+    first_name TEXT NOT NULL DEFAULT '',
+    join_date REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    commands_used INTEGER NOT NULL DEFAULT 0,
+    is_banned INTEGER NOT NULL DEFAULT 0,
+    ban_date REAL,
+    ban_changed REAL
+);
+CREATE INDEX IF NOT EXISTS users_last_seen ON users (last_seen);
+CREATE INDEX IF NOT EXISTS users_banned ON users (user_id) WHERE is_banned = 1;
+CREATE INDEX IF NOT EXISTS users_ban_changed ON users (ban_changed) WHERE ban_changed IS NOT NULL;
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    chat_title TEXT NOT NULL DEFAULT '',
+    chat_type TEXT NOT NULL DEFAULT '',
+    join_date REAL NOT NULL,
+    last_active REAL NOT NULL,
+    settings TEXT NOT NULL,
+    songs_played INTEGER NOT NULL DEFAULT 0,
+    commands_used INTEGER NOT NULL DEFAULT 0,
+    total_duration INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats (
+    chat_id INTEGER NOT NULL,
+    date REAL NOT NULL,
+    songs_played INTEGER NOT NULL DEFAULT 0,
+    total_duration INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, date)
+);
+CREATE INDEX IF NOT EXISTS stats_date ON stats (date);
+CREATE TABLE IF NOT EXISTS playlists (
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    tracks TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (user_id, name)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queues (
+    chat_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+class SQLiteBackend(StorageBackend):
+    """Embedded SQLite database for single-host deployments.
+
+    Uses WAL journaling so reads never wait for the writer. All queries
+    are fixed, parameterized SQL, which sqlite3 prepares once and reuses
+    from its statement cache. The connection lives on one worker thread,
+    so queries never block the event loop and need no locking. Shard
+    workers open the same file; SQLite's file lock serializes their writes.
+    """
+
+    name = "SQLite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Wait for other processes' write locks instead of failing with "database is locked"
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only risks the last transactions on power loss
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Databases created before ban sync lack the ban_changed column
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(users)")]
+        if columns and "ban_changed" not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN ban_changed REAL")
+        conn.executescript(_SQLITE_SCHEMA)
+        self.conn = conn
+
+    async def connect(self):
+        await self._run(self._open)
+
+    async def close(self):
+        if self.conn:
+            await self._run(self.conn.close)
+            self.conn = None
+        self.executor.shutdown(wait=False)
+
+    def _write(self, sql: str, params: Tuple = ()) -> int:
+        with self.conn:
+            return self.conn.execute(sql, params).rowcount
+
+    def _write_many(self, statements: List[Tuple[str, List[Tuple]]]) -> List[int]:
+        """Run several executemany() calls in one transaction"""
+        with self.conn:
+            return [self.conn.executemany(sql, rows).rowcount for sql, rows in statements]
+
+    def _read_one(self, sql: str, params: Tuple = ()) -> Optional[sqlite3.Row]:
+        return self.conn.execute(sql, params).fetchone()
+
+    def _read_all(self, sql: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        return self.conn.execute(sql, params).fetchall()
+
+    # Users
+    async def upsert_users(self, users: Dict[int, Dict[str, Any]]) -> int:
+        inserted, _ = await self._run(self._write_many, [
+            (
+                "INSERT OR IGNORE INTO users (user_id, username, first_name, join_date, last_seen) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (user_id, user["username"], user["first_name"], _ts(user["last_seen"]), _ts(user["last_seen"]))
+                    for user_id, user in users.items()
+                ],
+            ),
+            (
+                "UPDATE users SET last_seen = ? WHERE user_id = ?",
+                [(_ts(user["last_seen"]), user_id) for user_id, user in users.items()],
+            ),
+        ])
+        return inserted
+
+    @staticmethod
+    def _user_doc(row: sqlite3.Row) -> Dict[str, Any]:
+        user = dict(row)
+        user["is_banned"] = bool(user["is_banned"])
+        for key in ("join_date", "last_seen", "ban_date", "ban_changed"):
+            user[key] = _dt(user[key])
+        for key in ("ban_date", "ban_changed"):
+            if user[key] is None:
+                del user[key]
+        return user
+
+    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        row = await self._run(self._read_one, "SELECT * FROM users WHERE user_id = ?", (user_id,))
+        return self._user_doc(row) if row else None
+
+    async def is_banned(self, user_id: int) -> bool:
+        row = await self._run(self._read_one, "SELECT is_banned FROM users WHERE user_id = ?", (user_id,))
+        return bool(row and row["is_banned"])
+
+    async def set_banned(self, user_id: int, banned: bool):
+        now = _ts(datetime.utcnow())
+        if banned:
+            await self._run(
+                self._write,
+                "INSERT INTO users (user_id, join_date, last_seen, is_banned, ban_date, ban_changed) "
+                "VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET is_banned = 1, "
+                "ban_date = excluded.ban_date, ban_changed = excluded.ban_changed",
+                (user_id, now, now, now, now),
+            )
+        else:
+            await self._run(
+                self._write,
+                "UPDATE users SET is_banned = 0, ban_date = NULL, ban_changed = ? WHERE user_id = ?",
+                (now, user_id),
+            )
+
+    async def banned_ids(self) -> List[int]:
+        rows = await self._run(self._read_all, "SELECT user_id FROM users WHERE is_banned = 1")
+        return [row["user_id"] for row in rows]
+
+    async def ban_changes(self, since: datetime) -> List[Tuple[int, bool, datetime]]:
+        rows = await self._run(
+            self._read_all,
+            "SELECT user_id, is_banned, ban_changed FROM users WHERE ban_changed >= ?",
+            (_ts(since),),
+        )
+        return [(row["user_id"], bool(row["is_banned"]), _dt(row["ban_changed"])) for row in rows]
+
+    # Chats
+    async def upsert_chats(self, chats: Dict[int, Dict[str, Any]]) -> int:
+        settings = json.dumps(DEFAULT_CHAT_SETTINGS)
+        inserted, _ = await self._run(self._write_many, [
+            (
+                "INSERT OR IGNORE INTO chats (chat_id, chat_title, chat_type, join_date, last_active, settings) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (chat_id, chat["chat_title"], chat["chat_type"],
+                     _ts(chat["last_active"]), _ts(chat["last_active"]), settings)
+                    for chat_id, chat in chats.items()
+                ],
+            ),
+            (
+                "UPDATE chats SET last_active = ? WHERE chat_id = ?",
+                [(_ts(chat["last_active"]), chat_id) for chat_id, chat in chats.items()],
+            ),
+        ])
+        return inserted
+
+    async def get_chat(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        row = await self._run(self._read_one, "SELECT * FROM chats WHERE chat_id = ?", (chat_id,))
+        if not row:
+            return None
+        return {
+            "chat_id": row["chat_id"],
+            "chat_title": row["chat_title"],
+            "chat_type": row["chat_type"],
+            "join_date": _dt(row["join_date"]),
+            "last_active": _dt(row["last_active"]),
+            "settings": json.loads(row["settings"]),
+            "stats": {
+                "songs_played": row["songs_played"],
+                "commands_used": row["commands_used"],
+                "total_duration": row["total_duration"],
+            },
+        }
+
+    def _update_settings(self, chat_id: int, settings: Dict[str, Any]):
+        with self.conn:
+            row = self.conn.execute("SELECT settings FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row:
+                merged = {**json.loads(row["settings"]), **settings}
+                self.conn.execute("UPDATE chats SET settings = ? WHERE chat_id = ?", (json.dumps(merged), chat_id))
+
+    async def update_chat_settings(self, chat_id: int, settings: Dict[str, Any]):
+        await self._run(self._update_settings, chat_id, settings)
+
+    # Play statistics
+    async def add_plays(self, plays: Dict[int, List[int]], day: datetime):
+        await self._run(self._write_many, [
+            (
+                "UPDATE chats SET songs_played = songs_played + ?, total_duration = total_duration + ? "
+                "WHERE chat_id = ?",
+                [(count, duration, chat_id) for chat_id, (count, duration) in plays.items()],
+            ),
+            (
+                "INSERT INTO stats (chat_id, date, songs_played, total_duration) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (chat_id, date) DO UPDATE SET "
+                "songs_played = songs_played + excluded.songs_played, "
+                "total_duration = total_duration + excluded.total_duration",
+                [(chat_id, _ts(day), count, duration) for chat_id, (count, duration) in plays.items()],
+            ),
+        ])
+
+    async def get_counters(self) -> Optional[Dict[str, int]]:
+        rows = await self._run(self._read_all, "SELECT name, value FROM counters")
+        if not rows:
+            return None
+        values = {row["name"]: row["value"] for row in rows}
+        return {key: values.get(key, 0) for key in COUNTERS}
+
+    async def inc_counters(self, increments: Dict[str, int]):
+        await self._run(self._write_many, [(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            list(increments.items()),
+        )])
+
+    async def set_counters(self, counters: Dict[str, int]):
+        await self._run(self._write_many, [(
+            "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+            list(counters.items()),
+        )])
+
+    def _count_totals(self) -> Dict[str, int]:
+        return {
+            "total_users": self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            "total_chats": self.conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0],
+            "total_songs_played": self.conn.execute("SELECT COALESCE(SUM(songs_played), 0) FROM chats").fetchone()[0],
+        }
+
+    async def count_totals(self) -> Dict[str, int]:
+        return await self._run(self._count_totals)
+
+    # Playlists
+    async def save_playlist(self, user_id: int, name: str, tracks: List[Dict[str, Any]]):
+        await self._run(
+            self._write,
+            "INSERT OR REPLACE INTO playlists (user_id, name, tracks, updated) VALUES (?, ?, ?, ?)",
+            (user_id, name, json.dumps(tracks), _ts(datetime.utcnow())),
+        )
+
+    async def get_playlist(self, user_id: int, name: str) -> Optional[List[Dict[str, Any]]]:
+        row = await self._run(
+            self._read_one, "SELECT tracks FROM playlists WHERE user_id = ? AND name = ?", (user_id, name)
+        )
+        return json.loads(row["tracks"]) if row else None
+
+    async def list_playlists(self, user_id: int) -> List[str]:
+        rows = await self._run(self._read_all, "SELECT name FROM playlists WHERE user_id = ? ORDER BY name", (user_id,))
+        return [row["name"] for row in rows]
+
+    async def delete_playlist(self, user_id: int, name: str) -> bool:
+        deleted = await self._run(
+            self._write, "DELETE FROM playlists WHERE user_id = ? AND name = ?", (user_id, name)
+        )
+        return deleted > 0
+
+    # Queue snapshots
+    def _save_queue_snapshot(self, snapshot: Dict[str, Any]):
+        with self.conn:
+            self.conn.execute("DELETE FROM queues")
+            self.conn.executemany(
+                "INSERT INTO queues (chat_id, data) VALUES (?, ?)",
+                [(int(chat_id), json.dumps(chat)) for chat_id, chat in snapshot["chats"].items()],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES ('queue_snapshot', ?)",
+                (json.dumps({"seq": snapshot["seq"], "time": snapshot["time"]}),),
+            )
+
+    async def save_queue_snapshot(self, snapshot: Dict[str, Any]):
+        await self._run(self._save_queue_snapshot, snapshot)
+
+    def _get_queue_snapshot(self) -> Optional[Dict[str, Any]]:
+        meta = self.conn.execute("SELECT value FROM settings WHERE key = 'queue_snapshot'").fetchone()
+        if not meta:
+            return None
+        chats = {str(row["chat_id"]): json.loads(row["data"]) for row in self.conn.execute("SELECT * FROM queues")}
+        return {**json.loads(meta["value"]), "chats": chats}
+
+    async def get_queue_snapshot(self) -> Optional[Dict[str, Any]]:
+        return await self._run(self._get_queue_snapshot)
+
+    # Retention
+    async def delete_old_stats(self, cutoff: datetime, limit: int) -> int:
+        return await self._run(
+            self._write,
+            "DELETE FROM stats WHERE rowid IN (SELECT rowid FROM stats WHERE date < ? LIMIT ?)",
+            (_ts(cutoff), limit),
+        )
+
+    async def delete_inactive_users(self, cutoff: datetime, limit: int) -> int:
+        return await self._run(
+            self._write,
+            "DELETE FROM users WHERE rowid IN ("
+            "SELECT rowid FROM users WHERE last_seen < ? AND commands_used < 5 AND is_banned = 0 LIMIT ?)",
+            (_ts(cutoff), limit),
+        )
+
+def create_backend() -> Optional[StorageBackend]:
+    """Backend selected by DB_BACKEND ("auto" picks MongoDB when MONGO_DB_URI is set, else SQLite)"""
+    backend = config.DB_BACKEND.lower()
+    if backend == "auto":
+        backend = "mongo" if config.MONGO_DB_URI else "sqlite"
+    if backend == "mongo" and config.MONGO_DB_URI:
+        return MongoBackend(config.MONGO_DB_URI, config.DB_NAME)
+    if backend == "sqlite":
+        return SQLiteBackend(config.SQLITE_DB_PATH)
+    return None
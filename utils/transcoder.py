@@ -0,0 +1,119 @@
+# Post-download audio pre-encoding for VCPlay Music Bot
+
+import asyncio
+import os
+from typing import Callable, Dict, List, Optional
+import config
+
+# Target formats per AUDIO_QUALITY. Sample rates follow pytgcalls'
+# High/Medium/LowQualityAudio so its ffmpeg pipe does not need to resample.
+# Opus only encodes 8/12/16/24/48 kHz, so "medium" (36 kHz) is stored at 48 kHz.
+OPUS_PROFILES: Dict[str, Dict] = {
+    "high": {"sample_rate": 48000, "channels": 2, "bitrate": "128k"},
+    "medium": {"sample_rate": 48000, "channels": 2, "bitrate": "96k"},
+    "low": {"sample_rate": 24000, "channels": 2, "bitrate": "64k"},
+}
+
+class AudioTranscoder:
+    """Transcodes cached downloads once into the Opus format playback needs.
+
+    The result is stored in the media cache under ``opus-<quality>`` and is
+    preferred over the original download on later lookups.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.failed = 0
+        self.listeners: List[Callable[[str, str], None]] = []
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def add_listener(self, callback: Callable[[str, str], None]):
+        """Register a callback invoked as callback(source_path, out_path) once a download is encoded"""
+        self.listeners.append(callback)
+
+    @property
+    def profile(self) -> str:
+        """Media cache profile for the configured audio quality"""
+        return f"opus-{config.AUDIO_QUALITY}"
+
+    def schedule(self, video_id: str, source_path: str) -> Optional[asyncio.Task]:
+        """Start a background transcode unless one is already running"""
+        if not config.PREENCODE_AUDIO or video_id in self.pending:
+            return self.pending.get(video_id)
+        if self.cache.get_entry(video_id, self.profile):
+            return None
+
+        task = asyncio.create_task(self._transcode(video_id, source_path))
+        task.add_done_callback(lambda _: self.pending.pop(video_id, None))
+        self.pending[video_id] = task
+        return task
+
+    async def _transcode(self, video_id: str, source_path: str) -> Optional[str]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(config.TRANSCODE_WORKERS)
+
+        target = OPUS_PROFILES.get(config.AUDIO_QUALITY, OPUS_PROFILES["high"])
+        profile = self.profile
+        out_dir = os.path.join(self.cache.cache_dir, profile)
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = os.path.join(out_dir, f"{video_id}.ogg")
+        tmp_path = f"{out_path}.part"
+
+        async with self._semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    "ffmpeg", "-y", "-v", "error",
+                    "-i", source_path,
+                    "-vn",
+                    "-ac", str(target["channels"]),
+                    "-ar", str(target["sample_rate"]),
+                    "-c:a", "libopus",
+                    "-b:a", target["bitrate"],
+                    "-f", "ogg", tmp_path,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await process.communicate()
+            except Exception as e:
+                print(f"Transcode error {video_id}: {e}")
+                self.failed += 1
+                return None
+
+        if process.returncode != 0:
+            print(f"Transcode failed {video_id}: {stderr.decode(errors='ignore').strip()}")
+            self.failed += 1
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        os.replace(tmp_path, out_path)
+        source_entry = self.cache.get_entry(video_id, "audio") or {}
+        self.cache.put(
+            video_id, profile, out_path,
+            title=source_entry.get("title", "Unknown"),
+            duration=source_entry.get("duration", 0),
+            **({"loudness": source_entry["loudness"]} if source_entry.get("loudness") else {}),
+        )
+        # Queued and playing tracks move to the encoded copy before the
+        # source can go away, so a later seek or restream still finds a file
+        for callback in self.listeners:
+            try:
+                callback(source_path, out_path)
+            except Exception as e:
+                print(f"Transcode listener error: {e}")
+        if not config.PREENCODE_KEEP_SOURCE:
+            # Readers that already opened the source keep their handle on POSIX
+            self.cache.remove(video_id, "audio")
+
+        self.completed += 1
+        return out_path
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get transcoding statistics"""
+        return {
+            'pending': len(self.pending),
+            'completed': self.completed,
+            'failed': self.failed,
+        }
@@ -0,0 +1,95 @@
+# Pool of reusable YoutubeDL instances for VCPlay Music Bot
+
+import queue
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import yt_dlp
+import config
+
+_UNSET = object()
+
+class _HookDispatcher:
+    """Progress hook registered once per instance; forwards to the current job's hooks"""
+
+    def __init__(self):
+        self.hooks: List[Callable] = []
+
+    def __call__(self, status: Dict):
+        for hook in self.hooks:
+            hook(status)
+
+class YDLPool:
+    """Keeps pre-initialised YoutubeDL objects per option profile.
+
+    Building a YoutubeDL instance processes options and registers extractors;
+    checking one out of the pool skips that on the hot path. An instance is
+    used by a single worker thread at a time and returned afterwards.
+    """
+
+    def __init__(self, profiles: Dict[str, Dict], size: Optional[int] = None):
+        self.profiles = profiles
+        self.size = size or config.YDL_POOL_SIZE
+        self._idle: Dict[str, "queue.LifoQueue[Tuple[yt_dlp.YoutubeDL, _HookDispatcher]]"] = {
+            profile: queue.LifoQueue() for profile in profiles
+        }
+        self.created = 0
+        self.reused = 0
+
+    def _create(self, profile: str) -> Tuple[yt_dlp.YoutubeDL, _HookDispatcher]:
+        self.created += 1
+        ydl = yt_dlp.YoutubeDL(dict(self.profiles[profile]))
+        # YoutubeDL cannot remove hooks, so jobs swap the dispatcher's list instead
+        dispatcher = _HookDispatcher()
+        ydl.add_progress_hook(dispatcher)
+        return ydl, dispatcher
+
+    def warmup(self):
+        """Fill every profile up to the pool size (blocking)"""
+        for profile, idle in self._idle.items():
+            while idle.qsize() < self.size:
+                idle.put(self._create(profile))
+
+    @contextmanager
+    def checkout(self, profile: str, progress_hooks: Optional[List[Callable]] = None,
+                 overrides: Optional[Dict] = None) -> Iterator[yt_dlp.YoutubeDL]:
+        """Borrow an instance, optionally with job-specific hooks and params"""
+        idle = self._idle[profile]
+        try:
+            ydl, dispatcher = idle.get_nowait()
+            self.reused += 1
+        except queue.Empty:
+            ydl, dispatcher = self._create(profile)
+
+        dispatcher.hooks = list(progress_hooks or [])
+        saved = {key: ydl.params.get(key, _UNSET) for key in (overrides or {})}
+        ydl.params.update(overrides or {})
+        try:
+            yield ydl
+        finally:
+            dispatcher.hooks = []
+            for key, value in saved.items():
+                if value is _UNSET:
+                    ydl.params.pop(key, None)
+                else:
+                    ydl.params[key] = value
+            if idle.qsize() < self.size:
+                idle.put((ydl, dispatcher))
+            else:
+                ydl.close()
+
+    def close(self):
+        """Close all idle instances"""
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait()[0].close()
+                except queue.Empty:
+                    break
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get pool statistics"""
+        return {
+            'idle': sum(idle.qsize() for idle in self._idle.values()),
+            'created': self.created,
+            'reused': self.reused,
+        }